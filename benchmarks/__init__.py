@@ -0,0 +1 @@
+"Benchmarks of the troubadour engine (see `benchmarks.run`)."
@@ -0,0 +1,51 @@
+"""Compares two benchmark result files produced by `benchmarks.run`.
+
+Usage:
+
+    python -m benchmarks.compare before.json after.json [--threshold 0.1]"""
+
+import argparse
+import json
+import sys
+
+
+def load(path: str) -> dict[str, dict]:
+    "Loads a result file, returns results indexed by name and parameters."
+    with open(path, encoding="utf-8") as file:
+        report = json.load(file)
+    return {
+        f"{r['name']} {json.dumps(r['params'], sort_keys=True)}": r
+        for r in report["results"]
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Compares two benchmark results.")
+    parser.add_argument("before")
+    parser.add_argument("after")
+    parser.add_argument(
+        "-t",
+        "--threshold",
+        type=float,
+        default=0.1,
+        help="Relative slowdown of the median above which a regression is reported.",
+    )
+    args = parser.parse_args()
+
+    before, after = load(args.before), load(args.after)
+    regressions = 0
+    for key, new in after.items():
+        if key not in before:
+            print(f"{key:<72} (new)")
+            continue
+        ratio = new["median"] / before[key]["median"]
+        flag = ""
+        if ratio > 1 + args.threshold:
+            flag = "  REGRESSION"
+            regressions += 1
+        print(f"{key:<72} x{ratio:6.2f}{flag}")
+    sys.exit(1 if regressions > 0 else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+"""Benchmarks of the troubadour engine, run under CPython on the headless backend.
+
+Usage (from the repository root):
+
+    python -m benchmarks.run -o results.json
+    python -m benchmarks.compare before.json after.json
+
+Results are written as JSON: one entry per benchmark and set of parameters, with the
+raw timings (in seconds per operation) and their summary statistics."""
+
+import argparse
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from typing import Any, Callable, Iterator
+
+import troubadour
+import troubadour.backend as be
+import troubadour.save as sv
+from troubadour.game import GameImpl
+from troubadour.unique_id import get_unique_element_id
+
+from benchmarks import scenarios
+
+Result = dict[str, Any]
+
+
+def measure(
+    func: Callable[[], object],
+    setup: Callable[[], object] | None = None,
+    repeat: int = 5,
+    number: int = 1,
+) -> list[float]:
+    """Times `func`, returns `repeat` timings in seconds per call, each averaged over
+    `number` calls. `setup` is called (untimed) before each timing."""
+    timings = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        timings.append((time.perf_counter() - start) / number)
+    return timings
+
+
+def result(
+    name: str, params: dict[str, Any], timings: list[float], **extra: Any
+) -> Result:
+    "Builds a result entry, `extra` holds additional measurements (e.g., sizes)."
+    return {
+        **extra,
+        "name": name,
+        "params": params,
+        "unit": "s",
+        "timings": timings,
+        "min": min(timings),
+        "median": statistics.median(timings),
+        "mean": statistics.fmean(timings),
+    }
+
+
+# -~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~
+def bench_run_passage(repeat: int) -> Iterator[Result]:
+    """Cost of a click: running, rendering, trimming and saving a passage (and the
+    checkpoint of its state), including the work deferred after the click handler."""
+    for nb_paragraphs in [5, 20, 100]:
+        game = scenarios.played_game(15, nb_paragraphs)
+
+        def click(game: GameImpl = game, nb_paragraphs: int = nb_paragraphs) -> None:
+            game.run_passage(
+                scenarios.stress_passage, kwargs=dict(nb_paragraphs=nb_paragraphs)
+            )
+            scenarios.run_deferred()
+
+        timings = measure(click, repeat=repeat, number=5)
+        yield result("run_passage", {"nb_paragraphs": nb_paragraphs}, timings)
+
+    sequence = scenarios.demo_sequence()
+    demo = scenarios.load_demo()
+    game = scenarios.new_game(demo.MyState())
+
+    def demo_tour() -> None:
+        for passage, kwargs in sequence:
+            game.run_passage(passage, kwargs=kwargs)
+            scenarios.run_deferred()
+
+    timings = measure(demo_tour, repeat=repeat, number=5)
+    yield result("run_passage_demo_tour", {"nb_passages": len(sequence)}, timings)
+
+
+def bench_render(repeat: int) -> Iterator[Result]:
+    "Cost of rendering the whole history, as done when loading a game."
+    for max_output_len in [5, 15, 50, 100]:
+        game = scenarios.played_game(max_output_len, max_output_len=max_output_len)
+
+        def clear_cache(game: GameImpl = game) -> None:
+            for passage in game._output:  # pylint: disable=W0212
+                passage.html = None
+
+        timings = measure(game._render, repeat=repeat)  # pylint: disable=W0212
+        yield result("render", {"max_output_len": max_output_len}, timings)
+        timings = measure(
+            game._render, setup=clear_cache, repeat=repeat  # pylint: disable=W0212
+        )
+        yield result("render_uncached", {"max_output_len": max_output_len}, timings)
+
+
+def bench_save_load(repeat: int) -> Iterator[Result]:
+    "Cost of saving and loading games with growing states and histories."
+    for nb_entries in [10, 1000, 10000]:
+        for nb_passages in [5, 15, 50]:
+            game = scenarios.played_game(
+                nb_passages, nb_entries=nb_entries, max_output_len=nb_passages
+            )
+            params = {"nb_entries": nb_entries, "nb_passages": nb_passages}
+            timings = measure(lambda: sv.save_game(game), repeat=repeat)
+            size = sv.save_game(game)
+            yield result("save_game", params, timings, size=size)
+            timings = measure(lambda: sv.load_game(GameImpl), repeat=repeat)
+            yield result("load_game", params, timings, size=size)
+
+            # per-turn save, appending the last passage to the journal
+            sv.journal.max_entries = repeat + 1
+            sv.save_game(game)
+            timings = measure(
+                lambda: sv.journal.write(game),
+                setup=lambda: game.run_passage(scenarios.stress_passage),
+                repeat=repeat,
+            )
+            sv.journal.max_entries = sv.Journal.max_entries
+            yield result("journal_write", params, timings)
+
+
+def bench_codecs(repeat: int) -> Iterator[Result]:
+    "Encoding and decoding cost, and payload size, of the save codecs."
+    codecs: dict[str, sv.Codec] = {
+        "jsonpickle": sv.JsonPickleCodec(),
+        "compact": sv.CompactCodec(),
+        "compact_compressed": sv.CompactCodec(compress=True),
+    }
+    game = scenarios.played_game(15, nb_entries=1000)
+    for name, codec in codecs.items():
+        timings = measure(lambda: codec.encode(game), repeat=repeat)
+        yield result("encode", {"codec": name}, timings, size=codec.last_size)
+        payload = codec.encode(game)
+        timings = measure(lambda: codec.decode(payload), repeat=repeat)
+        yield result("decode", {"codec": name}, timings, size=codec.last_size)
+
+
+def bench_unique_id(repeat: int) -> Iterator[Result]:
+    "Overhead of element id generation."
+    timings = measure(get_unique_element_id, repeat=repeat, number=10000)
+    yield result("get_unique_element_id", {}, timings)
+
+
+BENCHMARKS = {
+    "run_passage": bench_run_passage,
+    "render": bench_render,
+    "save_load": bench_save_load,
+    "codecs": bench_codecs,
+    "unique_id": bench_unique_id,
+}
+
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n", maxsplit=1)[0])
+    parser.add_argument("-o", "--output", help="JSON file to write results to.")
+    parser.add_argument("-r", "--repeat", type=int, default=5)
+    parser.add_argument(
+        "-b",
+        "--bench",
+        action="append",
+        choices=list(BENCHMARKS),
+        help="Benchmark to run (can be repeated, defaults to all).",
+    )
+    args = parser.parse_args()
+
+    be.use_backend("headless")
+    results = []
+    for name in args.bench or list(BENCHMARKS):
+        for bench_result in BENCHMARKS[name](args.repeat):
+            print(
+                f"{bench_result['name']:<24} {json.dumps(bench_result['params']):<48}"
+                f" {bench_result['median'] * 1000:10.3f} ms",
+                file=sys.stderr,
+            )
+            results.append(bench_result)
+
+    report = {
+        "meta": {
+            "troubadour_version": troubadour.VERSION,
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "time": time.time(),
+        },
+        "results": results,
+    }
+    if args.output is not None:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+
+
+if __name__ == "__main__":
+    main()
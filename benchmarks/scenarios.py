@@ -0,0 +1,93 @@
+"Passages and games used by the benchmarks."
+
+import sys
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable
+
+import troubadour.backend as be
+from troubadour import Button, Game, TextButton
+from troubadour.backends.headless import HeadlessBackend
+from troubadour.game import GameImpl
+
+EXAMPLES_DIR = Path(__file__).parent.parent / "examples"
+
+LOREM = (
+    "Praesent leo diam, scelerisque dapibus commodo ut, facilisis sit amet "
+    "felis. Donec libero lacus, interdum a tortor sed, vestibulum suipit nunc."
+)
+
+
+def load_demo():
+    """Imports the demo example (which starts a game on the active backend) and
+    returns its module."""
+    if str(EXAMPLES_DIR) not in sys.path:
+        sys.path.insert(0, str(EXAMPLES_DIR))
+    import demo  # type: ignore # pylint: disable=C0415
+
+    return demo
+
+
+def demo_sequence() -> list[tuple[Callable, dict]]:
+    "A tour of the passages of the demo example."
+    demo = load_demo()
+    return [
+        (demo.intro, {}),
+        (demo.my_other_passage, {"msg": "hello"}),
+        (demo.display_stuff, {"msg": "hello"}),
+        (demo.my_passage, {}),
+    ]
+
+
+@dataclass
+class StressState:
+    "Game state with a configurable amount of data."
+    counter: int = 0
+    data: dict[str, list[int]] = field(default_factory=dict)
+
+
+def make_state(nb_entries: int) -> StressState:
+    return StressState(data={f"key{i}": [i, i + 1, i + 2] for i in range(nb_entries)})
+
+
+def stress_passage(game: Game[StressState], nb_paragraphs: int = 10) -> None:
+    """Passage with `nb_paragraphs` paragraphs, some of them nested or in columns,
+    an image and a couple of continuations."""
+    game.state.counter += 1
+    for index in range(nb_paragraphs):
+        paragraph = game.paragraph(f"{index}: {LOREM}")
+        if index % 5 == 0:
+            paragraph.paragraph("<b>nested</b>", css={"class": "'nested'"})
+    for column in game.columns(3, ["a", "b", "c"]):
+        column.paragraph("In a column")
+    game.img("https://picsum.photos/600/80")
+    game.continuations(
+        Button("Again", stress_passage, dict(nb_paragraphs=nb_paragraphs)),
+        TextButton("Say", stress_passage, "nb_paragraphs", convertor=int),
+    )
+
+
+def new_game(state: object, max_output_len: int = 15) -> GameImpl:
+    "Creates a game on a fresh headless page."
+    be.use_backend("headless")
+    return GameImpl(state, max_output_len=max_output_len)
+
+
+def run_deferred() -> None:
+    "Runs the work deferred after the last passage, such as the save."
+    backend = be.get_backend()
+    assert isinstance(backend, HeadlessBackend)
+    backend.run_timers()
+
+
+def played_game(
+    nb_passages: int,
+    nb_paragraphs: int = 10,
+    nb_entries: int = 0,
+    max_output_len: int = 15,
+) -> GameImpl:
+    "Returns a game on which `nb_passages` stress passages have been played."
+    game = new_game(make_state(nb_entries), max_output_len)
+    for _ in range(nb_passages):
+        game.run_passage(stress_passage, kwargs=dict(nb_paragraphs=nb_paragraphs))
+    return game
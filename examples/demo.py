@@ -2,7 +2,7 @@
 
 from dataclasses import dataclass
 
-from troubadour import Button, Game, TextButton, run_game
+from troubadour import Button, Game, TextButton, passage, run_game
 
 
 @dataclass
@@ -10,6 +10,7 @@ class MyState:
     hello: int = 0
 
 
+@passage
 def intro(game: Game[MyState]) -> None:
     x = game.state.hello
     game.paragraph("<h1>Hello</h1>World lorem ipsum stuff<p/>\n")
@@ -17,6 +18,7 @@ def intro(game: Game[MyState]) -> None:
     game.continuations(Button("Click", my_other_passage, dict(msg="Youpi")))
 
 
+@passage
 def my_passage(game: Game[MyState]) -> None:
     game.state.hello += 1
     game.paragraph(
@@ -51,6 +53,7 @@ def my_passage(game: Game[MyState]) -> None:
     )
 
 
+@passage
 def my_other_passage(game: Game[MyState], msg: str) -> None:
     game.paragraph(f"Hi: <b>{game.state.hello}</b>")
     game.paragraph(
@@ -66,6 +69,7 @@ def my_other_passage(game: Game[MyState], msg: str) -> None:
     )
 
 
+@passage
 def display_stuff(game: Game[MyState], msg: str) -> None:
     cols = game.columns(3, ["", "Hello", ""])
     for col in cols:
@@ -0,0 +1,19 @@
+"Fixtures of the tests, which play games on the headless backend."
+
+import pytest
+
+import troubadour.backend as be
+import troubadour.trace as tr
+from troubadour.backends.headless import HeadlessBackend
+
+import story
+
+
+@pytest.fixture
+def backend() -> HeadlessBackend:
+    "A new page, with empty local storage, made the active backend."
+    tr.recorder.clear()
+    story.runs.clear()
+    page = HeadlessBackend()
+    be.use_backend(page)
+    return page
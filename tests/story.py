@@ -0,0 +1,79 @@
+"Small game played by the tests, and helpers to play it on the headless backend."
+
+import random
+from dataclasses import dataclass, field
+
+import troubadour.backend as be
+from troubadour import Button, Game, TextButton
+from troubadour.backends.headless import HeadlessBackend
+from troubadour.definitions import Eid
+
+
+@dataclass
+class State:
+    count: int = 0
+    rolls: list[int] = field(default_factory=list)
+    name: str = ""
+
+
+runs: list[str] = []
+"Names of the passages run so far."
+
+
+def start(game: Game[State]) -> None:
+    runs.append("start")
+    game.paragraph("Welcome")
+    game.continuations(Button("Next", step), TextButton("Sign", sign, "name"))
+
+
+def step(game: Game[State]) -> None:
+    runs.append("step")
+    game.state.count += 1
+    game.state.rolls.append(random.randint(1, 6))
+    game.paragraph(f"Step {game.state.count}, rolled {game.state.rolls[-1]}")
+    game.continuations(Button("Next", step), TextButton("Sign", sign, "name"))
+
+
+def sign(game: Game[State], name: str) -> None:
+    runs.append("sign")
+    game.state.name = name
+    game.paragraph(f"Signed by {name}")
+    game.continuations(Button("Next", step))
+
+
+def buttons(page: HeadlessBackend) -> list[str]:
+    "Labels of the enabled buttons of the output."
+    return [
+        node.inner_html()
+        for node in page.find_all("button")
+        if node.id is not None and "disabled" not in node.attrs
+    ]
+
+
+def passages(page: HeadlessBackend) -> list[tuple[str | None, list[str]]]:
+    "Ids and texts of the passages of the output."
+    return [
+        (
+            node.id,
+            [
+                text
+                for paragraph in node.elements()
+                for text in paragraph.children
+                if paragraph.tag == "p" and isinstance(text, str)
+            ],
+        )
+        for node in page.find_all("div")
+        if node.attrs.get("class") == "passage"
+    ]
+
+
+def click(page: HeadlessBackend, label: str, text: str | None = None) -> None:
+    "Clicks the enabled button `label` of the output, typing `text` in its input first."
+    for node in page.find_all("button"):
+        if node.id is None or "disabled" in node.attrs or node.inner_html() != label:
+            continue
+        if text is not None:
+            be.set_value(Eid(node.id.replace("__button", "__textinput")), text)
+        page.click(Eid(node.id))
+        return
+    raise KeyError(f"No enabled button {label!r}")
@@ -0,0 +1,34 @@
+from troubadour.definitions import Eid
+from troubadour.events import output_events
+from troubadour.game import GameImpl, passage_eid
+
+from story import State, buttons, click, start
+
+
+def test_clicks_are_delegated_to_the_output(backend):
+    game = GameImpl(State())
+    game.run_passage(start)
+    for _ in range(3):
+        click(backend, "Next")
+    click(backend, "Sign", "Ada")
+
+    assert game.state.count == 3
+    assert game.state.name == "Ada"
+    # a single listener for all the buttons, whatever the number of passages
+    assert len(backend.element(Eid("output")).listeners["click"]) == 1
+
+
+def test_finished_passages_are_unwired(backend):
+    game = GameImpl(State(), max_output_len=2)
+    game.run_passage(start)
+    for _ in range(4):
+        click(backend, "Next")
+
+    assert buttons(backend) == ["Next", "Sign"]
+    # the buttons of the last passage, and a load handler per passage on the page
+    assert len(output_events) == 2 + 2
+    assert [
+        node.id
+        for node in backend.find_all("div")
+        if node.attrs.get("class") == "passage"
+    ] == [passage_eid(4), passage_eid(5)]
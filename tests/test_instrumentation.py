@@ -0,0 +1,33 @@
+import functools
+
+import troubadour.instrumentation as ins
+from troubadour.game import GameImpl
+
+from story import State, click, sign, start
+
+
+def test_phases_are_measured_by_passage(backend):
+    ins.history.clear()
+    game = GameImpl(State())
+    game.run_passage(start)
+    click(backend, "Next")
+    backend.run_timers()
+
+    summary = ins.history.summary()
+    assert {phase for passage, phase in summary if passage == "story:step"} == {
+        "disable",
+        "passage",
+        "render",
+        "trim",
+        "checkpoint",
+        "save",
+    }
+
+
+def test_passages_without_qualname_are_measured(backend):
+    ins.history.clear()
+    game = GameImpl(State())
+    game.run_passage(functools.partial(sign, name="Ada"))
+
+    assert game.state.name == "Ada"
+    assert ins.history.records[-1].passage.startswith("functools.partial(")
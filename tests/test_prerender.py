@@ -0,0 +1,99 @@
+import json
+
+import troubadour.backend as be
+import troubadour.save as sv
+import troubadour.trace as tr
+from troubadour.backends.headless import HeadlessBackend
+from troubadour.definitions import Eid
+from troubadour.game import GameImpl, run_game
+from troubadour.prerender import PRERENDER_META, SNAPSHOT_KEY, Prerendered
+
+import story
+from story import State, buttons, click, passages, start
+
+BUILD = "test-build"
+
+
+def prerendered_page() -> HeadlessBackend:
+    """Page of a build made with --prerender, as it is displayed before Python is
+    ready (see `troubadour.app.prerender.run_start`)."""
+    be.use_backend(HeadlessBackend({"troubadour-build": BUILD}))
+    tr.recorder.start(State)
+    game = GameImpl(State())
+    game.run_passage(start)
+    assert tr.recorder.trace is not None
+    meta = Prerendered(
+        "story", sv.codec.encode(game), tr.recorder.trace.entries[0].encode()
+    )
+    html, _, _ = game._passage_html(game._output[-1], game._passage_count)
+    page = HeadlessBackend(
+        {"troubadour-build": BUILD, PRERENDER_META: json.dumps(meta.__dict__)}
+    )
+    page.set_html(Eid("output"), html)
+    tr.recorder.clear()
+    story.runs.clear()
+    return page
+
+
+def revisit(page: HeadlessBackend) -> HeadlessBackend:
+    "The same page, visited again (the inline script displays the snapshot)."
+    visit = HeadlessBackend(page.metas)
+    visit.storage.update(page.storage)
+    snapshot = json.loads(visit.storage.get(SNAPSHOT_KEY, "null"))
+    if snapshot is not None and snapshot["build"] == BUILD:
+        visit.set_html(Eid("output"), snapshot["html"])
+    return visit
+
+
+def test_prerendered_start_is_hydrated(backend):
+    page = prerendered_page()
+    be.use_backend(page)
+    shown = page.get_html(Eid("output"))
+    run_game(State, start)
+
+    assert story.runs == []
+    assert page.get_html(Eid("output")) == shown
+    click(page, "Next")
+    page.run_timers()
+    assert sv.load_game(GameImpl).state.count == 1
+    assert [entry.passage for entry in tr.recorder.trace.entries][0].endswith("start")
+
+
+def test_snapshot_of_last_visit_is_hydrated(backend):
+    page = prerendered_page()
+    be.use_backend(page)
+    run_game(State, start)
+    click(page, "Next")
+    click(page, "Sign", "Ada")
+    page.run_timers()
+    assert SNAPSHOT_KEY not in page.storage  # only stored when the page is hidden
+    page.hide_page()
+
+    visit = revisit(page)
+    be.use_backend(visit)
+    shown = visit.get_html(Eid("output"))
+    run_game(State, start)
+
+    assert story.runs == ["step", "sign"]  # nothing run again on the second visit
+    assert visit.get_html(Eid("output")) == shown
+    click(visit, "Next")
+    visit.run_timers()
+    assert SNAPSHOT_KEY not in visit.storage  # outdated by the save
+    assert sv.load_game(GameImpl).state.count == 2
+
+
+def test_outdated_snapshot_is_rendered_again(backend):
+    page = prerendered_page()
+    be.use_backend(page)
+    run_game(State, start)
+    click(page, "Next")
+    page.hide_page()
+    click(page, "Next")
+    page.run_timers()
+
+    visit = revisit(page)
+    be.use_backend(visit)
+    run_game(State, start)
+
+    assert [eid for eid, _ in passages(visit)][-1] == "troubadour__passage__3"
+    assert buttons(visit) == ["Next", "Sign"]
@@ -0,0 +1,32 @@
+from troubadour.definitions import Eid
+from troubadour.game import GameImpl, render_cache_key
+
+from story import State, click, start
+
+
+def test_finished_passages_cache_their_disabled_html(backend):
+    game = GameImpl(State())
+    game.run_passage(start)
+    click(backend, "Next")
+
+    first, last = game._output
+    assert first.html is not None and "disabled" in first.html
+    assert first.html_key == render_cache_key()
+    assert last.html is None
+
+    first.html = "<p>from the cache</p>"
+    game._render()
+    assert "<p>from the cache</p>" in backend.get_html(Eid("output"))
+
+
+def test_cached_html_is_dropped_by_other_builds(backend):
+    game = GameImpl(State())
+    game.run_passage(start)
+    click(backend, "Next")
+    game._output[0].html = "<p>from the cache</p>"
+
+    backend.metas["troubadour-build"] = "another build"
+    game._render()
+
+    assert "<p>from the cache</p>" not in backend.get_html(Eid("output"))
+    assert game._output[0].html_key == render_cache_key()
@@ -0,0 +1,169 @@
+from dataclasses import dataclass, field, replace
+
+import pytest
+
+import troubadour.backend as be
+import troubadour.save as sv
+from troubadour.definitions import Eid
+from troubadour.game import GameImpl, passage_eid, run_game
+import troubadour.rewind as rw
+from troubadour import Button
+from troubadour.rewind import StateHistory
+
+from story import State, buttons, click, passages, start
+
+
+def test_rewind_restores_the_state_and_the_output(backend):
+    game = GameImpl(State())
+    game.run_passage(start)
+    click(backend, "Next")
+    click(backend, "Sign", "Ada")
+    shown = passages(backend)
+    click(backend, "Next")
+    click(backend, "Next")
+
+    assert game.can_rewind(2) and not game.can_rewind(5)
+    game.rewind(2)
+    assert game.state == State(count=1, rolls=game.state.rolls[:1], name="Ada")
+    assert game._passage_count == 3
+    assert passages(backend)[-1][0] == passage_eid(3)
+    assert passages(backend)[-1][1] == shown[-1][1]
+    assert buttons(backend) == ["Next"]
+
+    click(backend, "Next")
+    assert game.state.count == 2
+    game.rewind(3)
+    assert game.state == State()
+    with pytest.raises(ValueError):
+        game.rewind(1)
+
+
+def test_back_button_rewinds_the_saved_game(backend):
+    run_game(State, start)
+    click(backend, "Next")
+    click(backend, "Next")
+    be.click(Eid("rewind"))
+    backend.run_timers()
+
+    assert sv.load_game(GameImpl).state.count == 1
+    assert len(passages(backend)) == 2
+
+
+@dataclass(slots=True)
+class Slotted:
+    count: int = 0
+    log: list[str] = field(default_factory=list)
+
+
+@dataclass(frozen=True)
+class Frozen:
+    count: int = 0
+    names: tuple[str, ...] = ()
+
+
+class Renamed(Slotted):
+    pass
+
+
+def change_slotted(state: Slotted, step: int) -> Slotted:
+    state.count += step
+    state.log.append(f"step {step}")
+    return state if step != 5 else Renamed(state.count, list(state.log))
+
+
+def change_frozen(state: Frozen, step: int) -> Frozen:
+    return replace(state, count=step, names=state.names + (f"step {step}",))
+
+
+def change_dict(state: dict, step: int) -> dict:
+    state[f"step {step}"] = step
+    return state
+
+
+@pytest.mark.parametrize(
+    "state, change",
+    [(Slotted(), change_slotted), (Frozen(), change_frozen), ({}, change_dict)],
+)
+def test_history_restores_changed_fields(state, change):
+    history = StateHistory()
+    states = []
+    for step in range(8):
+        state = change(state, step)
+        states.append(repr(state))
+        history.record(state, step + 1, step)
+
+    state, _, _ = history.rewind(state, 1)
+    assert repr(state) == states[6]
+    state, outputs, passage_count = history.rewind(state, 3)
+    assert repr(state) == states[3]
+    assert outputs == [0, 1, 2, 3] and passage_count == 4
+    state = change(state, 10)
+    history.record(state, 5, 10)
+    state, outputs, passage_count = history.rewind(state, 3)
+    assert repr(state) == states[1]
+
+
+def test_unchanged_immutable_fields_are_not_flattened():
+    history = StateHistory()
+    state = Frozen(names=("a",) * 1000)
+    history.record(state, 1, None)
+    state = replace(state, count=1)
+    history.record(state, 2, None)
+
+    assert list(history.checkpoints[-1].undo) == ["count"]
+
+
+@dataclass
+class Inventory:
+    items: list[dict] = field(default_factory=list)
+    equipped: dict | None = None
+    log: list[str] = field(default_factory=list)
+    journal: dict[str, str] = field(default_factory=dict)
+
+
+def test_fields_sharing_objects_stay_shared():
+    history = StateHistory()
+    state = Inventory(items=[{"name": "sword"}])
+    history.record(state, 1, None)
+    state.equipped = state.items[0]
+    state.log = state.items
+    history.record(state, 2, None)
+    state.equipped["name"] = "axe"
+    state.items.append({"name": "shield"})
+    history.record(state, 3, None)
+
+    state, _, _ = history.rewind(state, 1)
+    assert state.items == [{"name": "sword"}]
+    assert state.equipped is state.items[0] and state.log is state.items
+    state.equipped = None
+    history.record(state, 3, None)
+    state, _, _ = history.rewind(state, 2)
+    assert state.items == [{"name": "sword"}] and state.equipped is None
+
+
+def test_fields_not_used_by_the_passage_are_not_flattened(backend, monkeypatch):
+    def write(game):
+        game.state.journal["entry"] = "text"
+        game.continuations(Button("Next", take))
+
+    def take(game):
+        game.state.items.append({"name": "sword"})
+        game.continuations(Button("Next", take))
+
+    game = GameImpl(Inventory(journal={str(key): "" for key in range(1000)}))
+    game.run_passage(write)
+    click(backend, "Next")
+    game._history.flush()  # all the fields are flattened at the first checkpoint
+    flattened = []
+    flatten_group = rw.flatten_group
+    monkeypatch.setattr(
+        rw,
+        "flatten_group",
+        lambda values: flattened.append(list(values)) or flatten_group(values),
+    )
+    click(backend, "Next")
+    click(backend, "Next")
+    game.rewind(1)
+
+    assert flattened == [["items"], ["items"]]
+    assert len(game.state.items) == 2 and len(game.state.journal) == 1001
@@ -0,0 +1,181 @@
+import functools
+import json
+import random
+import string
+
+import troubadour.backend as be
+import troubadour.save as sv
+from troubadour import Button, Game, TextButton
+from troubadour.backends.headless import HeadlessBackend
+from troubadour.definitions import Eid
+from troubadour.game import GameImpl, passage_eid, run_game
+
+from story import State, buttons, click, passages, sign, start, step
+
+
+def test_passages_are_appended_to_the_journal(backend):
+    run_game(State, start)
+    backend.run_timers()
+    for _ in range(3):
+        click(backend, "Next")
+        backend.run_timers()
+    click(backend, "Sign", "Ada")
+    backend.run_timers()
+
+    assert sv.stored_journal_length() == 4
+    game = sv.load_game(GameImpl)
+    assert game.state.count == 3 and game.state.name == "Ada"
+    assert game._passage_count == 5
+    assert len(game._output) == 5
+    # the disabled html of finished passages is saved with them
+    assert all(passage.html is not None for passage in game._output[:-1])
+
+
+def test_reloaded_game_shows_the_same_output(backend):
+    run_game(State, start)
+    click(backend, "Next")
+    click(backend, "Next")
+    backend.hide_page()  # flushes the pending save
+
+    page = HeadlessBackend()
+    page.storage.update(backend.storage)
+    be.use_backend(page)
+    run_game(State, start)
+
+    assert passages(page) == passages(backend)
+    assert buttons(page) == buttons(backend)
+    click(page, "Sign", "Ada")
+    page.run_timers()
+    assert sv.load_game(GameImpl).state.name == "Ada"
+
+
+def local_convertors(game: Game[State]) -> None:
+    def shout(text: str) -> str:
+        return text + "!"
+
+    game.continuations(
+        TextButton("Shout", sign, "name", convertor=shout),
+        TextButton("Whisper", sign, "name", convertor=lambda text: text.lower()),
+        TextButton("Count", sign, "name", convertor=len),
+    )
+
+
+def test_convertors_without_import_path_are_saved(backend):
+    game = GameImpl(State())
+    game.run_passage(local_convertors)
+    sv.save_game(game)
+
+    loaded = sv.load_game(GameImpl)
+    loaded._render()
+    assert buttons(backend) == ["Shout", "Whisper", "Count"]
+    click(backend, "Count", "four")
+    assert loaded.state.name == 4
+
+
+BASELINE_SAVE = json.dumps(
+    {
+        "py/object": "troubadour.game.GameImpl",
+        "state": {"py/object": "story.State", "count": 2, "rolls": [3, 5], "name": ""},
+        "max_output_len": 15,
+        "_output": [
+            {
+                "py/object": "troubadour.game.PassageOutput",
+                "contents": [
+                    {
+                        "py/object": "troubadour.game.Container",
+                        "markup": "p",
+                        "html": "Step 2, rolled 5",
+                        "css": {},
+                        "target": None,
+                        "local_id": "0",
+                    },
+                    {
+                        "py/object": "troubadour.game.ContinuationElement",
+                        "continuation": {
+                            "py/object": "troubadour.continuations.Button",
+                            "txt": "Next",
+                            "passage": {"py/function": "story.step"},
+                            "kwargs": {},
+                            "dialog": False,
+                        },
+                        "target": None,
+                    },
+                ],
+            }
+        ],
+        "_current_passage": {
+            "py/object": "troubadour.game.PassageContext",
+            "output": {"py/object": "troubadour.game.PassageOutput", "contents": []},
+            "lid_to_eid": {},
+            "_id_provider": {
+                "py/object": "troubadour.unique_id.IdProvider",
+                "next_id": 0,
+            },
+        },
+        "_last_passage": None,
+    }
+)
+"A game saved by the first version of troubadour (plain jsonpickle)."
+
+
+def test_saves_of_older_versions_are_loaded(backend):
+    backend.storage[sv.STATE_KEY] = BASELINE_SAVE
+    run_game(State, start)
+
+    assert passages(backend) == [(passage_eid(1), ["Step 2, rolled 5"])]
+    click(backend, "Next")
+    backend.run_timers()
+    game = sv.load_game(GameImpl)
+    assert game.state.count == 3 and game._passage_count == 2
+
+
+def test_exports_of_older_versions_are_imported(backend):
+    run_game(State, start)
+    backend.upload(Eid("import"), BASELINE_SAVE)
+
+    assert backend.nb_refresh == 1
+    assert sv.load_game(GameImpl).state.rolls == [3, 5]
+
+
+def hoard(game: Game[State]) -> None:
+    "Stores a large value in the state, without displaying it."
+    game.state.name = "".join(random.Random(0).choices(string.ascii_letters, k=5000))
+    game.continuations(Button("Next", step))
+
+
+def test_journal_size_is_bounded(backend):
+    game = GameImpl(State())
+    game.run_passage(hoard)
+    for _ in range(10):
+        backend.run_timers()
+        click(backend, "Next")
+    backend.run_timers()
+
+    game = sv.load_game(GameImpl)
+    assert sv.stored_journal_length() == 10 and game.state.count == 10
+    journal_size = sum(
+        len(payload)
+        for key, payload in backend.storage.items()
+        if key.startswith(sv.JOURNAL_KEY)
+    )
+    # the state is only stored once, in the last entry
+    assert journal_size < 2 * len(sv.codec.encode(game.state))
+
+
+def unnamed_passages(game: Game[State]) -> None:
+    game.continuations(
+        Button("Ada", functools.partial(sign, name="Ada")),
+        Button("Step", lambda game: step(game)),
+    )
+
+
+def test_passages_without_import_path_are_saved(backend):
+    game = GameImpl(State())
+    game.run_passage(unnamed_passages)
+    sv.save_game(game)
+
+    loaded = sv.load_game(GameImpl)
+    loaded._render()
+    assert buttons(backend) == ["Ada", "Step"]
+    click(backend, "Ada")
+    assert loaded.state.name == "Ada"
@@ -0,0 +1,33 @@
+import pytest
+
+from troubadour.app.server import accepted_encodings, is_immutable
+
+
+@pytest.mark.parametrize(
+    "header, encodings",
+    [
+        ("gzip, deflate, br", ["br", "gzip"]),
+        ("gzip;q=0", []),
+        ("br;q=0.5, gzip", ["gzip", "br"]),
+        ("*;q=0.1, br;q=0", ["gzip"]),
+        ("identity", []),
+        ("", []),
+    ],
+)
+def test_accepted_encodings_follow_quality_values(header, encodings):
+    assert accepted_encodings(header, ["br", "gzip"]) == encodings
+
+
+@pytest.mark.parametrize(
+    "path, immutable",
+    [
+        ("runtime/pyodide.js", True),
+        ("assets/demo.00bd02cba2.css", True),
+        ("assets/images/map.0123456789.png", True),
+        ("assets.json", False),
+        ("index.html", False),
+        ("demo.py", False),
+    ],
+)
+def test_runtime_and_fingerprinted_assets_are_immutable(path, immutable):
+    assert is_immutable(path) == immutable
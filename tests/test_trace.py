@@ -0,0 +1,163 @@
+import importlib
+import sys
+import types
+
+import pytest
+
+import troubadour.backend as be
+import troubadour.game as gm
+import troubadour.lazy as lz
+import troubadour.save as sv
+import troubadour.trace as tr
+from troubadour.app.simulate import export_replay, replay_trace
+from troubadour.backends.headless import HeadlessBackend
+from troubadour.definitions import Eid
+from troubadour.game import GameImpl, run_game
+
+from story import State, click, passages, start
+
+
+def play(page: HeadlessBackend) -> GameImpl:
+    "Plays a game recording its trace, returns it as saved."
+    run_game(State, start)
+    for _ in range(3):
+        click(page, "Next")
+    click(page, "Sign", "Ada")
+    be.click(Eid("rewind"))
+    click(page, "Next")
+    page.run_timers()
+    return sv.load_game(GameImpl)
+
+
+def test_replay_rebuilds_the_game(backend):
+    game = play(backend)
+    trace = tr.Trace.loads(tr.recorder.trace.dumps())
+
+    be.use_backend(HeadlessBackend())
+    tr.recorder.clear()
+    replayed = GameImpl(State())
+    tr.replay(trace, replayed)
+
+    assert replayed.state == game.state
+    assert sv.export_codec.encode(replayed) == sv.export_codec.encode(game)
+
+
+def test_trace_is_resumed_after_reload(backend):
+    play(backend)
+    entries = len(tr.recorder.trace.entries)
+
+    page = HeadlessBackend()
+    page.storage.update(backend.storage)
+    be.use_backend(page)
+    run_game(State, start)
+
+    assert len(tr.recorder.trace.entries) == entries
+
+
+def test_stored_chunks_are_folded(backend, monkeypatch):
+    monkeypatch.setattr(tr, "MAX_CHUNKS", 3)
+    game = GameImpl(State())
+    tr.recorder.start(State)
+    game.run_passage(start)
+    for _ in range(5):  # folded on the fourth save
+        click(backend, "Next")
+        tr.recorder.persist()
+
+    assert tr.recorder.nb_chunks == 2
+    assert sorted(
+        key for key in backend.storage if key.startswith("troubadour_trace")
+    ) == [
+        "troubadour_trace",
+        "troubadour_trace_0",
+        "troubadour_trace_1",
+    ]
+    tr.recorder.resume(game)
+    assert len(tr.recorder.trace.entries) == 6
+
+
+def test_recording_stops_when_storage_is_full(backend, monkeypatch):
+    game = GameImpl(State())
+    tr.recorder.start(State)
+    game.run_passage(start)
+    tr.recorder.persist()
+
+    def full(key: str, value: str) -> None:
+        raise MemoryError("quota exceeded")
+
+    monkeypatch.setattr(backend, "storage_set", full)
+    click(backend, "Next")
+    tr.recorder.persist()
+
+    assert tr.recorder.trace is None
+    assert not [key for key in backend.storage if key.startswith("troubadour_trace")]
+
+
+@pytest.mark.parametrize("max_entries", [0, 2])
+def test_long_traces_are_not_recorded(backend, monkeypatch, max_entries):
+    monkeypatch.setattr(tr, "MAX_ENTRIES", max_entries)
+    tr.recorder.start(State)
+    game = GameImpl(State())
+    game.run_passage(start)
+    click(backend, "Next")
+    click(backend, "Next")
+    tr.recorder.persist()
+
+    assert tr.recorder.trace is None
+
+
+ENTRY = """
+from dataclasses import dataclass
+
+from troubadour import Button, Game
+from troubadour.game import run_game
+
+
+@dataclass
+class Counter:
+    count: int = 0
+
+
+def count(game: Game[Counter]) -> None:
+    game.state.count += 1
+    game.paragraph(f"Count {game.state.count}")
+    game.continuations(Button("Next", count))
+
+
+run_game(Counter, count)
+"""
+
+
+def test_replayed_save_is_imported_in_the_page(backend, tmp_path, monkeypatch):
+    (tmp_path / "demo.py").write_text(ENTRY)
+    monkeypatch.syspath_prepend(str(tmp_path))
+    monkeypatch.setattr(gm, "game_entry", None)
+    monkeypatch.setattr(lz, "loader", None)
+    monkeypatch.setattr(sys, "meta_path", list(sys.meta_path))
+    monkeypatch.delitem(sys.modules, "demo", raising=False)
+    importlib.import_module("demo")  # runs the game
+    for _ in range(3):
+        click(backend, "Next")
+    trace = tr.Trace.loads(tr.recorder.trace.dumps())
+
+    _, rebuilt = replay_trace(tmp_path, "demo.py", trace)
+    save = export_replay(rebuilt, "demo.py")
+    assert "demo" not in save
+
+    # the page runs the entry module as __main__, it cannot be imported by name
+    monkeypatch.delitem(sys.modules, "demo")
+    sys.path.remove(str(tmp_path))
+    main = types.ModuleType("__main__")
+    monkeypatch.setitem(sys.modules, "__main__", main)
+    page = HeadlessBackend()
+    be.use_backend(page)
+    exec(ENTRY, main.__dict__)  # pylint: disable=W0122
+    page.upload(Eid("import"), save)
+    visit = HeadlessBackend()
+    visit.storage.update(page.storage)
+    be.use_backend(visit)
+    run_game(main.Counter, main.count)
+
+    assert passages(visit)[-1][1] == ["Count 4"]
+    click(visit, "Next")
+    visit.run_timers()
+    assert sv.load_game(GameImpl).state == main.Counter(5)
@@ -1,20 +1,22 @@
 "Troubadour is a small browser-based text-based game framework."
 
-try:
-    from troubadour.continuations import (  # noqa: F401
-        Button,
-        TextButton,
-    )
-    from troubadour.definitions import Game  # noqa: F401
-    from troubadour.game import run_game  # noqa: F401
+from troubadour.assets import asset_url  # noqa: F401
 
-    __all__ = [
-        "Game",
-        "Button",
-        "TextButton",
-        "run_game",
-    ]
-except ImportError:  # if we're not in the browser
-    __all__ = []
+from troubadour.continuations import (  # noqa: F401
+    Button,
+    TextButton,
+)
+from troubadour.definitions import Game  # noqa: F401
+from troubadour.game import run_game  # noqa: F401
+from troubadour.passages import passage  # noqa: F401
+
+__all__ = [
+    "asset_url",
+    "Game",
+    "Button",
+    "TextButton",
+    "passage",
+    "run_game",
+]
 
 VERSION = "0.1.4"
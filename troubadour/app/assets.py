@@ -0,0 +1,190 @@
+"""Asset stage of the build: images and stylesheets of the source folder are
+(optionally) minified or recompressed, and written with a hash of their content in
+their file name, so that they can be cached forever by browsers. The mapping from
+source paths to urls is written to an asset manifest (and looked up by
+`troubadour.assets.asset_url` in the game)."""
+
+import io
+import json
+import posixpath
+import re
+from dataclasses import dataclass
+from pathlib import Path
+
+from troubadour.app.incremental import IncrementalBuild, hash_text
+
+try:
+    from PIL import Image as PILImage  # type: ignore
+except ImportError:
+    PILImage = None
+
+IMAGE_SUFFIXES = {".png", ".jpg", ".jpeg", ".gif", ".webp", ".svg", ".ico"}
+STYLESHEET_SUFFIXES = {".css"}
+RASTER_FORMATS = {".png": "PNG", ".jpg": "JPEG", ".jpeg": "JPEG", ".webp": "WEBP"}
+"Image formats that can be recompressed, by suffix."
+ASSETS_DIR = "assets"
+MANIFEST_NAME = "assets.json"
+MINIFIER_VERSION = 2
+"Version of the minifiers, to bump when their output changes (so pages are rebuilt)."
+
+
+@dataclass
+class AssetOptions:
+    "Processing of the assets."
+    minify: bool = True
+    "Minify stylesheets (and the html of the page)."
+    image_max_size: int | None = None
+    "Maximum width and height of images, larger images are downscaled."
+    image_quality: int | None = None
+    "Quality of recompressed lossy images (jpeg, webp), None to keep them as is."
+
+    def processes_images(self) -> bool:
+        return self.image_max_size is not None or self.image_quality is not None
+
+
+# -~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~
+CSS_COMMENT_RE = re.compile(r"/\*.*?\*/", re.DOTALL)
+CSS_STRING_RE = re.compile(r"\"(?:\\.|[^\"\\])*\"|'(?:\\.|[^'\\])*'")
+CSS_URL_RE = re.compile(r"url\(\s*(['\"]?)([^'\")]+)\1\s*\)")
+
+
+def minify_css(css: str) -> str:
+    "Removes comments and unneeded whitespace from stylesheet `css`."
+    # strings are kept as is, everything else is minified
+    parts = []
+    position = 0
+    for string in CSS_STRING_RE.finditer(css):
+        parts.append(_minify_css_code(css[position : string.start()]))
+        parts.append(string.group())
+        position = string.end()
+    parts.append(_minify_css_code(css[position:]))
+    return "".join(parts).strip()
+
+
+def _minify_css_code(code: str) -> str:
+    code = CSS_COMMENT_RE.sub("", code)
+    code = re.sub(r"\s+", " ", code)
+    code = re.sub(r"\s*([{};,>])\s*", r"\1", code)
+    code = re.sub(r"\s*:\s*(?![^{}]*\{)", ":", code)  # not in selectors (a :hover)
+    return code.replace(";}", "}")
+
+
+HTML_COMMENT_RE = re.compile(r"<!--(?!\[if).*?-->", re.DOTALL)
+HTML_PRESERVE_RE = re.compile(r"<(pre|textarea|script|py-script)\b.*?</\1>", re.DOTALL)
+
+
+def minify_html(html: str) -> str:
+    """Removes comments and collapses whitespace of `html` to single spaces (except in
+    pre, textarea and script elements). Whitespace between tags is kept, as it is
+    displayed between inline elements."""
+    # preserved elements are replaced by placeholders (\0<index>\0) while minifying
+    preserved: list[str] = []
+
+    def placeholder(match: re.Match) -> str:
+        preserved.append(match.group())
+        return f"\0{len(preserved) - 1}\0"
+
+    code = HTML_PRESERVE_RE.sub(placeholder, html)
+    code = HTML_COMMENT_RE.sub("", code)
+    code = re.sub(r"\s+", " ", code).strip()
+    return re.sub(r"\0(\d+)\0", lambda match: preserved[int(match.group(1))], code)
+
+
+def process_image(data: bytes, suffix: str, options: AssetOptions) -> bytes:
+    """Downscales and recompresses image `data`, if Pillow is installed and the image
+    format supports it. Returns the original image if the result is not smaller."""
+    fmt = RASTER_FORMATS.get(suffix.lower())
+    if PILImage is None or fmt is None or not options.processes_images():
+        return data
+    with PILImage.open(io.BytesIO(data)) as image:
+        if options.image_max_size is not None:
+            image.thumbnail((options.image_max_size, options.image_max_size))
+        save_options: dict = {"optimize": True}
+        if fmt != "PNG" and options.image_quality is not None:
+            save_options["quality"] = options.image_quality
+        buffer = io.BytesIO()
+        image.save(buffer, fmt, **save_options)
+    processed = buffer.getvalue()
+    return processed if len(processed) < len(data) else data
+
+
+def fingerprinted(path: str, digest: str) -> str:
+    "Path `path` with (the start of) hash `digest` inserted before its suffix."
+    stem, suffix = posixpath.splitext(path)
+    return f"{stem}.{digest[:10]}{suffix}"
+
+
+def rewrite_urls(css: str, css_path: str, manifest: dict[str, str]) -> str:
+    """Replaces the relative urls of stylesheet `css` (source path `css_path`) that
+    point to assets by the url of the asset, relative to the built stylesheet."""
+    css_dir = posixpath.dirname(css_path)
+    built_dir = posixpath.dirname(manifest[css_path])
+
+    def replace(match: re.Match) -> str:
+        target = posixpath.normpath(posixpath.join(css_dir, match.group(2).strip()))
+        if target not in manifest:
+            return match.group()
+        return f"url({posixpath.relpath(manifest[target], built_dir)})"
+
+    return CSS_URL_RE.sub(replace, css)
+
+
+# -~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~
+def build_assets(
+    builder: IncrementalBuild, src_dir: Path, options: AssetOptions
+) -> dict[str, str]:
+    """Writes the images and stylesheets of `src_dir` to the assets folder of the
+    build, with fingerprinted names, and writes the asset manifest.
+
+    Returns:
+        dict[str, str]: url of the assets (relative to the page), by source path
+            (relative to `src_dir`).
+    """
+    if options.processes_images() and PILImage is None:
+        print("Pillow is not installed, images are copied as is")
+    sources = sorted(
+        path
+        for path in src_dir.rglob("*")
+        if path.suffix.lower() in IMAGE_SUFFIXES | STYLESHEET_SUFFIXES
+        and path.is_file()
+    )
+    hashes = builder.hash_files(sources)
+    options_key = json.dumps(options.__dict__, sort_keys=True)
+    digests = {
+        path.relative_to(src_dir).as_posix(): hash_text(digest + options_key)
+        for path, digest in zip(sources, hashes)
+    }
+
+    # images first, since stylesheets refer to them
+    images = {
+        name: fingerprinted(f"{ASSETS_DIR}/{name}", digest)
+        for name, digest in digests.items()
+        if posixpath.splitext(name)[1].lower() in IMAGE_SUFFIXES
+    }
+    # urls in stylesheets depend on the images they refer to
+    images_key = hash_text(json.dumps(images, sort_keys=True))
+    stylesheets = {
+        name: fingerprinted(f"{ASSETS_DIR}/{name}", hash_text(digest + images_key))
+        for name, digest in digests.items()
+        if name not in images
+    }
+    manifest = {**images, **stylesheets}
+
+    for name, dest in images.items():
+
+        def image(path: Path = src_dir / name) -> bytes:
+            return process_image(path.read_bytes(), path.suffix, options)
+
+        builder.generate(dest, dest, image)
+    for name, dest in stylesheets.items():
+
+        def render(name: str = name) -> str:
+            css = rewrite_urls((src_dir / name).read_text(), name, manifest)
+            return minify_css(css) if options.minify else css
+
+        builder.generate(dest, dest, render)
+
+    manifest_json = json.dumps(manifest, indent=1, sort_keys=True)
+    builder.generate(MANIFEST_NAME, hash_text(manifest_json), lambda: manifest_json)
+    print(f"Found {len(images)} images and {len(stylesheets)} stylesheets")
+    return manifest
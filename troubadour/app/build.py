@@ -0,0 +1,511 @@
+"""Build of troubadour projects: copies the library and the source files, processes
+the assets and generates the page and its configuration (see `build_project`), once or
+each time a source file changes (see `watch_project`)."""
+
+import hashlib
+import importlib.util
+import io
+import json
+import marshal
+import sys
+import time
+import zipfile
+from dataclasses import dataclass, field
+from importlib.util import find_spec
+from pathlib import Path
+from typing import Any, Callable, TypedDict
+
+from jinja2 import Environment, PackageLoader
+
+from troubadour.app.assets import (
+    MINIFIER_VERSION,
+    AssetOptions,
+    build_assets,
+    fingerprinted,
+    minify_css,
+    minify_html,
+)
+from troubadour.app.incremental import BuildSummary, IncrementalBuild, hash_text
+from troubadour.app.lazy import module_index
+from troubadour.app.prerender import prerender as prerender_start
+
+BUNDLE_NAME = "troubadour-bundle.zip"
+BOOTSTRAP_NAME = "bootstrap.py"
+RELOAD_NAME = ".troubadour-reload.json"
+"Rebuild notification written by watch builds, sent to pages by the server."
+EVENTS_URL = "/_troubadour/events"
+"Url of the event stream of rebuild notifications."
+PYSCRIPT_VERSION = "2023.03.1"
+PYODIDE_VERSION = "0.23.4"
+"Versions of the runtime copied by vendored builds."
+PYODIDE_PYTHON = (3, 11)
+"Python version of the Pyodide release loaded by the generated pages."
+RUNTIME_PACKAGES = ["jsonpickle"]
+"Python packages needed by troubadour in the browser."
+
+
+NOT_SHIPPED = {"backends/headless.py"}
+"Modules of the library that pages never import."
+OPTIONAL_MODULES = {
+    "rewind": "rewind.py",
+    "trace": "trace.py",
+    "live_reload": "hotswap.py",
+}
+"Modules of the library only shipped with the build option that uses them."
+
+
+def library_files(options: set[str] | None = None) -> tuple[Path, list[Path]]:
+    """Returns the folder of the troubadour library and the files to ship with games
+    built with `options` (names of the flags of `build_project`, see
+    `OPTIONAL_MODULES`)."""
+    troubadour_spec = find_spec("troubadour")
+    assert troubadour_spec is not None and troubadour_spec.origin is not None
+    troubadour_module_dir = Path(troubadour_spec.origin).parent
+    excluded = NOT_SHIPPED | {
+        module
+        for option, module in OPTIONAL_MODULES.items()
+        if option not in (options or set())
+    }
+    files = [
+        f
+        for f in sorted(troubadour_module_dir.rglob("*.py"))
+        if str(f)[:5] != "__pyc"
+        and "app/" not in str(f)
+        and "templates/" not in str(f)
+        and f.relative_to(troubadour_module_dir).as_posix() not in excluded
+    ]
+    return troubadour_module_dir, files
+
+
+def compile_module(src: Path, dest: str, optimize: int) -> bytes:
+    """Compiles python file `src` to the content of a .pyc file, loadable without its
+    source (the header holds no timestamp to check against).
+
+    Args:
+        src (Path): python source file.
+        dest (str): path of the source in the built project, shown in tracebacks.
+        optimize (int): optimization level, 1 strips asserts and 2 also docstrings.
+    """
+    source = src.read_bytes()
+    code = compile(source, dest, "exec", dont_inherit=True, optimize=optimize)
+    # magic number, flags (0: timestamp-based), timestamp (not checked without the
+    # source) and source size
+    header = importlib.util.MAGIC_NUMBER + bytes(8) + len(source).to_bytes(4, "little")
+    return header + marshal.dumps(code)
+
+
+def compiled_name(dest: str) -> str:
+    return dest[:-3] + ".pyc"
+
+
+def make_bundle(files: list[tuple[Path, str]], optimize: int | None = None) -> bytes:
+    """Packs files in a zip archive, under their destination path. The archive only
+    depends on the content of the files (timestamps are not stored). If `optimize` is
+    not None, python files are stored compiled, see `compile_module`."""
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        for src, dest in sorted(files, key=lambda item: item[1]):
+            if optimize is not None and src.suffix == ".py":
+                name, content = compiled_name(dest), compile_module(src, dest, optimize)
+            else:
+                name, content = dest, src.read_bytes()
+            archive.writestr(zipfile.ZipInfo(name), content, zipfile.ZIP_DEFLATED, 9)
+    return buffer.getvalue()
+
+
+def report_compilation(
+    modules: list[tuple[Path, str]], compiled_sizes: dict[str, int]
+) -> None:
+    "Prints how much the compiled modules weigh compared to their sources."
+    source_size = sum(src.stat().st_size for src, _ in modules)
+    compiled_size = sum(compiled_sizes.values())
+    saved = source_size - compiled_size
+    print(
+        f"Compiled {len(modules)} modules, which will not be compiled at startup:"
+        f" {source_size} bytes of sources shipped as {compiled_size} bytes of bytecode"
+        f" ({abs(saved)} bytes {'saved' if saved >= 0 else 'more'})"
+    )
+
+
+@dataclass
+class Runtime:
+    "Location of the runtime files loaded by the generated pages."
+    pyscript_js: str = "https://pyscript.net/latest/pyscript.js"
+    pyscript_css: str = "https://pyscript.net/latest/pyscript.css"
+    interpreter: str = ""
+    "Pyodide script to load, or empty to use the default one of pyscript."
+    packages: list[str] = field(default_factory=lambda: list(RUNTIME_PACKAGES))
+    "Python packages to install, by name or wheel url."
+
+
+def vendor_runtime(builder: IncrementalBuild, cache_dir: Path) -> Runtime:
+    """Copies the pinned runtime from local folder `cache_dir` to the `runtime` folder
+    of the build. The cache is expected to contain:
+
+        pyscript-{PYSCRIPT_VERSION}/    pyscript.js and pyscript.css
+        pyodide-{PYODIDE_VERSION}/      the Pyodide core distribution
+        wheels/                         the wheels of the required packages
+
+    Returns:
+        Runtime: location of the vendored runtime files.
+    """
+    print(f"Copying runtime from {cache_dir}")
+    pyscript_dir = cache_dir / f"pyscript-{PYSCRIPT_VERSION}"
+    pyodide_dir = cache_dir / f"pyodide-{PYODIDE_VERSION}"
+    for required in [
+        pyscript_dir / "pyscript.js",
+        pyscript_dir / "pyscript.css",
+        pyodide_dir / "pyodide.js",
+    ]:
+        assert required.exists(), f"Runtime file {required} not found in cache!"
+    wheels = []
+    for package in RUNTIME_PACKAGES:
+        found = sorted((cache_dir / "wheels").glob(f"{package}-*.whl"))
+        assert len(found) == 1, f"Expected one wheel of {package} in cache!"
+        wheels.append(found[0])
+
+    files = [(f, f"runtime/pyscript/{f.name}") for f in pyscript_dir.iterdir()]
+    files += [
+        (f, f"runtime/pyodide/{f.relative_to(pyodide_dir)}")
+        for f in sorted(pyodide_dir.rglob("*"))
+        if f.is_file()
+    ]
+    files += [(f, f"runtime/wheels/{f.name}") for f in wheels]
+    builder.copy_files(files)
+    return Runtime(
+        pyscript_js="runtime/pyscript/pyscript.js",
+        pyscript_css="runtime/pyscript/pyscript.css",
+        interpreter="runtime/pyodide/pyodide.js",
+        packages=[f"./runtime/wheels/{f.name}" for f in wheels],
+    )
+
+
+class BuildOptions(TypedDict, total=False):
+    "Options of `build_project`, besides the source folder and the entry point."
+    css: str | None
+    output_path: Path
+    jobs: int | None
+    bundle: bool
+    optimize: int | None
+    vendor: Path | None
+    live_reload: bool
+    assets: AssetOptions | None
+    profile: list[str] | None
+    lazy: bool
+    prerender: bool
+    rewind: bool
+    trace: bool
+
+
+def build_project(
+    src_dir: Path,
+    entry_point: str,
+    css: str | None,
+    output_path: Path,
+    jobs: int | None = None,
+    bundle: bool = False,
+    optimize: int | None = None,
+    vendor: Path | None = None,
+    live_reload: bool = False,
+    assets: AssetOptions | None = None,
+    profile: list[str] | None = None,
+    lazy: bool = False,
+    prerender: bool = False,
+    rewind: bool = False,
+    trace: bool = False,
+) -> BuildSummary:
+    """Builds (incrementally) the project of folder `src_dir` into `output_path`.
+
+    Args:
+        src_dir (Path): folder containing the project source files.
+        entry_point (str): main file of the project, relative to `src_dir`.
+        css (str | None): custom CSS file, relative to `src_dir`.
+        output_path (Path): folder to store project files.
+        jobs (int | None): number of threads used to hash and copy files.
+        bundle (bool): if True, the library and the user modules are packed in a
+            single archive, fetched in one request and unpacked by a bootstrap script
+            before running the entry point.
+        optimize (int | None): if not None, python modules are shipped compiled (and
+            without their sources) with this optimization level (see
+            `compile_module`). The bytecode targets the python version of the
+            pinned Pyodide, which must be the one running the build, so `vendor`
+            is required.
+        vendor (Path | None): if not None, local folder from which the pinned runtime
+            (pyscript, Pyodide and the wheels of the packages) is copied into the
+            build, see `vendor_runtime`. Otherwise the pages load the latest pyscript
+            from its CDN.
+        live_reload (bool): if True, the page listens to the rebuild notifications of
+            the development server, see `watch_project`.
+        assets (AssetOptions | None): processing of the images and stylesheets of the
+            project (see `troubadour.app.assets`), defaults to minification only.
+        profile (list[str] | None): instrumentation sinks enabled in the page
+            ("console", "performance"), see `troubadour.instrumentation`.
+        lazy (bool): if True, only the entry point and the modules it imports are
+            fetched with the page, the other modules are downloaded when they are
+            first needed (see `troubadour.lazy`). Not compatible with `bundle` and
+            `optimize`, which ship all the modules at once.
+        prerender (bool): if True, the start passage is run at build time and
+            displayed by the page before Python is ready, and so is the output of
+            the last visit for returning players (see `troubadour.prerender`). The
+            start passage shows the time of the build and its random draws are
+            fixed by the build.
+        rewind (bool): if True, the page has a Back button that rewinds the game
+            (see `troubadour.rewind`).
+        trace (bool): if True, the page records the passages run in a trace that
+            can be downloaded and replayed (see `troubadour.trace`).
+
+    Returns:
+        BuildSummary: what was rebuilt, skipped and removed.
+    """
+    # Paths
+    print("Building project from folder", src_dir)
+    sources = sorted(src_dir.rglob("*.py"))
+    print(f"Found {len(sources)} source files")
+    assert src_dir / entry_point in sources, "Entry point not in source files!"
+    print(f"Entry point {entry_point} found in sources")
+    user_module = Path(src_dir.absolute().name)
+    print(f"Output folder is {output_path}")
+    if css is not None:
+        custom_css_path = src_dir / css
+        assert custom_css_path.exists(), "Custom CSS does not exist!"
+        print(f"Using custom CSS file: {custom_css_path}")
+    if optimize is not None:
+        # the latest pyscript from its CDN may run another version of python, which
+        # would reject the bytecode
+        assert (
+            vendor is not None
+        ), "Compiled modules need the pinned runtime (--vendor)!"
+        assert sys.version_info[:2] == PYODIDE_PYTHON, (
+            "Compiled modules must be built with python"
+            f" {'.'.join(map(str, PYODIDE_PYTHON))}, the version of Pyodide!"
+        )
+    assert not lazy or (
+        not bundle and optimize is None
+    ), "Lazy modules cannot be bundled or compiled!"
+    assets = assets if assets is not None else AssetOptions()
+    output_path.mkdir(parents=True, exist_ok=True)
+    builder = IncrementalBuild(output_path, jobs)
+
+    # Files of the game, with their destination
+    enabled = {
+        option
+        for option, value in [
+            ("rewind", rewind),
+            ("trace", trace),
+            ("live_reload", live_reload),
+        ]
+        if value
+    }
+    troubadour_module_dir, troubadour_files = library_files(enabled)
+    print(f"Using troubadour library from {troubadour_module_dir}")
+    library = [
+        (f, f"troubadour/{f.relative_to(troubadour_module_dir)}")
+        for f in troubadour_files
+    ]
+    user_files = [(f, f"{user_module / f.relative_to(src_dir)}") for f in sources]
+    modules = user_files + library
+    hashes = builder.hash_files([f for f, _ in modules])
+    module_hashes = {dest: digest for (_, dest), digest in zip(modules, hashes)}
+    library_hashes = {dest: module_hashes[dest] for _, dest in library}
+    # the bytecode depends on the optimization level and on the python version
+    compile_key = f"{optimize}:{importlib.util.MAGIC_NUMBER.hex()}"
+
+    if bundle:
+        print(f"Packing {len(modules)} modules into {BUNDLE_NAME}")
+        builder.generate(
+            BUNDLE_NAME,
+            hash_text(compile_key + json.dumps(module_hashes, sort_keys=True)),
+            lambda: make_bundle(modules, optimize),
+        )
+        fetched = [BUNDLE_NAME]
+        if optimize is not None:
+            with zipfile.ZipFile(output_path / BUNDLE_NAME) as archive:
+                compiled_sizes = {
+                    info.filename: info.file_size for info in archive.infolist()
+                }
+            report_compilation(modules, compiled_sizes)
+    elif optimize is not None:
+        print(f"Compiling {len(modules)} modules")
+        level = optimize
+        for src, dest in modules:
+
+            def compiled(src: Path = src, dest: str = dest) -> bytes:
+                return compile_module(src, dest, level)
+
+            builder.generate(
+                compiled_name(dest),
+                hash_text(compile_key + module_hashes[dest]),
+                compiled,
+            )
+        fetched = [compiled_name(dest) for _, dest in modules]
+        report_compilation(
+            modules, {dest: (output_path / dest).stat().st_size for dest in fetched}
+        )
+    else:
+        print("Copying troubadour library and source files")
+        fetched = list(builder.copy_files(modules))
+    modules_meta = ""
+    if lazy:
+        index, eager = module_index(src_dir, entry_point, user_module)
+        lazy_files = {dest for src, dest in user_files if src not in eager}
+        fetched = [dest for dest in fetched if dest not in lazy_files]
+        modules_meta = json.dumps(index, separators=(",", ":"))
+        print(f"{len(lazy_files)} modules are loaded lazily")
+
+    asset_urls = build_assets(builder, src_dir, assets)
+
+    runtime = Runtime() if vendor is None else vendor_runtime(builder, vendor)
+
+    # Generate file contents from Jinja templates
+    print("Generating project files from jinja template")
+    environment = Environment(loader=PackageLoader("troubadour"))
+
+    def template_hash(name: str) -> str:
+        assert environment.loader is not None
+        return hash_text(environment.loader.get_source(environment, name)[0])
+
+    # Build id, used by the game to invalidate cached html of passages when the
+    # library, the stylesheets or the images change
+    build_hash = hashlib.sha256(template_hash("troubadour.css.j2").encode())
+    for dest in sorted(library_hashes):
+        build_hash.update(library_hashes[dest].encode())
+    build_hash.update(json.dumps(asset_urls, sort_keys=True).encode())
+    build_id = build_hash.hexdigest()[:16]
+
+    prerendered, prerender_meta = "", ""
+    if prerender:
+        print("Running the start passage")
+        prerendered, prerender_meta = prerender_start(src_dir, entry_point, build_id)
+
+    def generate(
+        dest: str,
+        template: str,
+        minify: Callable[[str], str] | None = None,
+        **context: str,
+    ) -> None:
+        key = hash_text(
+            template_hash(template)
+            + json.dumps(context, sort_keys=True)
+            + (str(MINIFIER_VERSION) if minify is not None else "")
+        )
+
+        def render() -> str:
+            content = environment.get_template(template).render(**context)
+            return minify(content) if minify is not None else content
+
+        builder.generate(dest, key, render)
+
+    entrypoint = f"{user_module}/{entry_point}"
+    if bundle or optimize is not None or lazy:
+        generate(
+            BOOTSTRAP_NAME,
+            "bootstrap.py.j2",
+            bundle=BUNDLE_NAME if bundle else "",
+            entrypoint=entrypoint if optimize is None else compiled_name(entrypoint),
+            compiled="yes" if optimize is not None else "",
+            lazy="yes" if lazy else "",
+        )
+        entrypoint = BOOTSTRAP_NAME
+    custom_stylesheet = (
+        f'<link rel="stylesheet" href="{asset_urls[Path(css).as_posix()]}">'
+        if css is not None
+        else ""
+    )
+    stylesheet = fingerprinted(
+        "troubadour.css",
+        hash_text(template_hash("troubadour.css.j2") + str(assets.minify)),
+    )
+    generate(stylesheet, "troubadour.css.j2", minify_css if assets.minify else None)
+    generate(
+        "index.html",
+        "main.html.j2",
+        minify_html if assets.minify else None,
+        entrypoint=entrypoint,
+        stylesheet=stylesheet,
+        assets=json.dumps(asset_urls, separators=(",", ":"), sort_keys=True),
+        custom_stylesheet=custom_stylesheet,
+        build_id=build_id,
+        pyscript_js=runtime.pyscript_js,
+        pyscript_css=runtime.pyscript_css,
+        live_reload=EVENTS_URL if live_reload else "",
+        profile=",".join(profile) if profile else "",
+        modules=modules_meta,
+        rewind="yes" if rewind else "",
+        prerender=prerender_meta,
+        prerendered=prerendered,
+    )
+    generate(
+        "config.toml",
+        "config.toml.j2",
+        packages=",\n    ".join(f'"{package}"' for package in runtime.packages),
+        interpreter=runtime.interpreter,
+        interpreter_name=f"pyodide-{PYODIDE_VERSION}",
+        fetch=",\n    ".join(f'"{dest}"' for dest in fetched),
+    )
+
+    summary = builder.finish()
+    print(summary)
+    return summary
+
+
+def source_snapshot(src_dir: Path) -> dict[Path, tuple[int, int]]:
+    "Modification time and size of the files of folder `src_dir`."
+    snapshot = {}
+    for path in src_dir.rglob("*"):
+        if path.is_file() and "__pycache__" not in path.parts:
+            stat = path.stat()
+            snapshot[path] = (stat.st_mtime_ns, stat.st_size)
+    return snapshot
+
+
+def watch_project(
+    src_dir: Path, entry_point: str, interval: float = 0.5, **options: Any
+) -> None:
+    """Builds the project, then rebuilds it each time a file of `src_dir` changes,
+    until interrupted. After each rebuild, a notification is written to the output
+    folder for the development server to send to the pages (see `hotswap`). It lists
+    the user modules to reload, or asks for a full reload of the page if anything
+    else changed.
+
+    Args:
+        src_dir (Path): folder containing the project source files.
+        entry_point (str): main file of the project, relative to `src_dir`.
+        interval (float): time between two checks of the source files, in seconds.
+        options: other arguments of `build_project`.
+    """
+    output_path: Path = options["output_path"]
+    build_project(src_dir, entry_point, live_reload=True, **options)
+    snapshot = source_snapshot(src_dir)
+    print(f"Watching {src_dir} for changes (press Ctrl+C to stop)")
+    try:
+        while True:
+            time.sleep(interval)
+            new_snapshot = source_snapshot(src_dir)
+            if new_snapshot == snapshot:
+                continue
+            snapshot = new_snapshot
+            try:
+                summary = build_project(
+                    src_dir, entry_point, live_reload=True, **options
+                )
+            except (AssertionError, OSError, SyntaxError) as error:
+                print(f"Build failed: {error!r}")
+                continue
+            if not summary.written and not summary.removed:
+                continue
+            entry = f"{src_dir.absolute().name}/{entry_point}"
+            modules = [
+                dest
+                for dest in summary.written
+                if dest.endswith(".py") and not dest.startswith("troubadour/")
+            ]
+            full = bool(
+                summary.removed
+                or entry in modules
+                or len(modules) != len(summary.written)
+            )
+            notification = {"id": time.time_ns(), "full": full, "files": modules}
+            (output_path / RELOAD_NAME).write_text(json.dumps(notification))
+            print("Reloading page" if full else f"Hot swapping {', '.join(modules)}")
+    except KeyboardInterrupt:
+        pass
@@ -1,10 +1,17 @@
-import shutil
-import subprocess
-from importlib.util import find_spec
 from pathlib import Path
 
 import click
-from jinja2 import Environment, PackageLoader
+
+from troubadour.app.assets import AssetOptions
+from troubadour.app.build import BuildOptions, build_project, watch_project
+from troubadour.app.graph import passage_graph
+from troubadour.app.server import serve
+from troubadour.app.simulate import (
+    export_replay,
+    replay_trace,
+    simulate as run_simulation,
+)
+from troubadour.trace import Trace
 
 
 @click.group()
@@ -15,10 +22,14 @@ def main():
 # -~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~
 @main.command(short_help="Runs a development server for a locally built project.")
 @click.option("-p", "--port", type=int, default=8765)
-def server(port: int):
+@click.option("-d", "--directory", default="./_site", help="Folder to serve.")
+@click.option("--host", default="", help="Address to listen to (defaults to all).")
+def server(port: int, directory: str, host: str):
     """Runs a development server for a locally built project
-    (expects _site folder to be present)."""
-    subprocess.run(f"cd _site && python -m http.server {port}", shell=True)
+    (expects _site folder to be present). Files are served by several threads, with
+    compression, ETags, cache headers and range support; each request is logged with
+    its latency and size."""
+    serve(Path(directory), port, host)
 
 
 # -~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~
@@ -36,97 +47,255 @@ def server(port: int):
     default=None,
     help="Location of a custom CSS file for the project.",
 )
+@click.option(
+    "-j",
+    "--jobs",
+    type=int,
+    default=None,
+    help="Number of threads used to copy files (defaults to the number of CPUs).",
+)
+@click.option(
+    "--bundle",
+    is_flag=True,
+    help="Pack the library and the source files in a single archive, fetched at once.",
+)
+@click.option(
+    "--compile",
+    "compile_modules",
+    is_flag=True,
+    help="Ship python modules compiled to bytecode instead of their sources (needs"
+    " --vendor, as the bytecode only runs on the pinned version of Pyodide).",
+)
+@click.option(
+    "-O",
+    "--optimize",
+    type=click.IntRange(0, 2),
+    default=0,
+    help="Optimization level of compiled modules: 1 strips asserts, 2 also docstrings.",
+)
+@click.option(
+    "--vendor",
+    type=click.Path(exists=True, file_okay=False),
+    default=None,
+    help="Local cache folder to copy a pinned runtime (pyscript, Pyodide, wheels)"
+    " from, instead of loading the latest pyscript from its CDN.",
+)
+@click.option(
+    "-w",
+    "--watch",
+    is_flag=True,
+    help="Rebuild when source files change, and reload the pages opened through"
+    " the development server (hot swapping modules when possible).",
+)
+@click.option(
+    "--minify/--no-minify",
+    default=True,
+    help="Minify the stylesheets and the html of the page.",
+)
+@click.option(
+    "--image-max-size",
+    type=int,
+    default=None,
+    help="Downscale images larger than this many pixels (needs Pillow).",
+)
+@click.option(
+    "--image-quality",
+    type=click.IntRange(1, 100),
+    default=None,
+    help="Recompress jpeg and webp images with this quality (needs Pillow).",
+)
+@click.option(
+    "--profile",
+    type=click.Choice(["console", "performance"]),
+    multiple=True,
+    help="Log the timings of the phases of each passage to the browser console, or"
+    " add them to its performance timeline (can be repeated).",
+)
+@click.option(
+    "--lazy",
+    is_flag=True,
+    help="Only load the entry point and the modules it imports with the page, and"
+    " the other modules when they are needed.",
+)
+@click.option(
+    "--prerender",
+    is_flag=True,
+    help="Run the start passage at build time and show it (or the output of the last"
+    " visit) before Python is ready.",
+)
+@click.option("--rewind", is_flag=True, help="Add a Back button that rewinds the game.")
+@click.option(
+    "--trace",
+    is_flag=True,
+    help="Record the passages run by the player, to download them (shift-click on"
+    " Export) and replay them with troubadour replay.",
+)
 @click.argument("src")
-def build(path: str, entry_point: str, css: str | None, src: str) -> None:
+def build(
+    path: str,
+    entry_point: str,
+    css: str | None,
+    jobs: int | None,
+    bundle: bool,
+    compile_modules: bool,
+    optimize: int,
+    vendor: str | None,
+    watch: bool,
+    minify: bool,
+    image_max_size: int | None,
+    image_quality: int | None,
+    profile: tuple[str, ...],
+    lazy: bool,
+    prerender: bool,
+    rewind: bool,
+    trace: bool,
+    src: str,
+) -> None:
     """Generates the files for your troubadour project. Needs SRC, the path to the
-    directory containing the project source files."""
-
-    # Paths
-    src_dir = Path(src)
-    print("Building project from folder", src_dir)
-    sources = list(src_dir.rglob("*.py"))
-    print(f"Found {len(sources)} source files")
-    assert src_dir / entry_point in sources, "Entry point not in source files!"
-    print(f"Entry point {entry_point} found in sources")
-    output_path = Path(path)
-    user_module = output_path / src_dir.absolute().name
-    print(f"Output folder is {output_path}")
-    main_html_path = output_path / "index.html"
-    toml_path = output_path / "config.toml"
-    css_path = output_path / "troubadour.css"
-    if css is not None:
-        custom_css_path = src_dir / css
-        assert custom_css_path.exists(), "Custom CSS does not exist!"
-        print(f"Using custom CSS file: {custom_css_path}")
-        sources.append(custom_css_path)
-
-    # Copy troubadour lib to dest folder
-    troubadour_dest_dir = output_path / "troubadour"
-    troubadour_spec = find_spec("troubadour")
-    assert troubadour_spec is not None and troubadour_spec.origin is not None
-    troubadour_module_dir = Path(troubadour_spec.origin).parent
-    print(
-        f"Copying troubadour library from {troubadour_module_dir}"
-        f" to {troubadour_dest_dir}"
+    directory containing the project source files. Only the files whose inputs changed
+    since the previous build are rewritten."""
+    options: BuildOptions = dict(
+        css=css,
+        output_path=Path(path),
+        jobs=jobs,
+        bundle=bundle,
+        optimize=optimize if compile_modules else None,
+        vendor=Path(vendor) if vendor is not None else None,
+        assets=AssetOptions(minify, image_max_size, image_quality),
+        profile=list(profile),
+        lazy=lazy,
+        prerender=prerender,
+        rewind=rewind,
+        trace=trace,
     )
+    if watch:
+        watch_project(Path(src), entry_point, **options)
+    else:
+        build_project(Path(src), entry_point, **options)
 
-    troubadour_files = troubadour_module_dir.rglob("*.py")
-    troubadour_filtered_files = [
-        f
-        for f in troubadour_files
-        if str(f)[:5] != "__pyc" and "app/" not in str(f) and "templates/" not in str(f)
-    ]
-    if troubadour_dest_dir.exists():
-        shutil.rmtree(troubadour_dest_dir)
-    troubadour_dest_dir.mkdir(parents=True)
-
-    for f in troubadour_filtered_files:
-        shutil.copyfile(f, troubadour_dest_dir / f.relative_to(troubadour_module_dir))
-    troubadour_files_to_fetch = [
-        troubadour_dest_dir / f.relative_to(troubadour_module_dir)
-        for f in troubadour_filtered_files
-    ]
-    print("Done")
 
-    # Generate file contents from Jinja templates
-    print("Generating project files from jinja template")
-    environment = Environment(loader=PackageLoader("troubadour"))
-    main_template = environment.get_template("main.html.j2")
-    custom_stylesheet = (
-        f'<link rel="stylesheet" href="{src_dir.name}/{css}">'
-        if css is not None
-        else ""
-    )
-
-    main_source = main_template.render(
-        entrypoint=f"{user_module.name}/{entry_point}",
-        custom_stylesheet=custom_stylesheet,
+# -~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~
+@main.command(short_help="Plays your game many times to find errors and dead ends.")
+@click.option(
+    "-e",
+    "--entry-point",
+    default="index.py",
+    help="Location of the main file of the project, relative to the source directory.",
+)
+@click.option("-n", "--runs", type=int, default=1000, help="Number of playthroughs.")
+@click.option(
+    "-j",
+    "--jobs",
+    type=int,
+    default=None,
+    help="Number of worker processes (defaults to the number of CPUs).",
+)
+@click.option("--seed", type=int, default=0, help="Seed of the first playthrough.")
+@click.option(
+    "--max-steps", type=int, default=100, help="Maximum passages per playthrough."
+)
+@click.option(
+    "-t",
+    "--text",
+    multiple=True,
+    help="Value to type in text inputs (can be repeated).",
+)
+@click.option(
+    "--exhaustive",
+    is_flag=True,
+    help="Play every sequence of choices (up to --max-steps) instead of random ones.",
+)
+@click.argument("src")
+def simulate(
+    entry_point: str,
+    runs: int,
+    jobs: int | None,
+    seed: int,
+    max_steps: int,
+    text: tuple[str, ...],
+    exhaustive: bool,
+    src: str,
+) -> None:
+    """Simulates playthroughs of the game in SRC (the directory containing the
+    project source files) on a headless page, pressing random buttons, and reports
+    passage visits, dead ends, exceptions and passage execution times."""
+    stats = run_simulation(
+        Path(src),
+        entry_point,
+        runs=runs,
+        workers=jobs,
+        seed=seed,
+        max_steps=max_steps,
+        texts=list(text),
+        exhaustive=exhaustive,
     )
+    print(stats.report())
 
-    css_template = environment.get_template("troubadour.css.j2")
-    css_source = css_template.render()
 
-    toml_template = environment.get_template("config.toml.j2")
-    package_list = ["jsonpickle"]
-    toml_package_list = ",\n    ".join(f'"{package}"' for package in package_list)
-    toml_file_list = ",\n    ".join(
-        [f'"{p.relative_to(src_dir.parent)}"' for p in sources]
-        + [f'"{p.relative_to(output_path)}"' for p in troubadour_files_to_fetch]
-    )
-    toml_source = toml_template.render(packages=toml_package_list, fetch=toml_file_list)
-    print("Done")
-
-    # Make dest folder and module folder
-    output_path.mkdir(parents=True, exist_ok=True)
-    user_module.mkdir(exist_ok=True)
+# -~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~
+@main.command(short_help="Extracts the passage graph of your game and checks it.")
+@click.option(
+    "-e",
+    "--entry-point",
+    default="index.py",
+    help="Location of the main file of the project, relative to the source directory.",
+)
+@click.option(
+    "-n",
+    "--runs",
+    type=int,
+    default=0,
+    help="Number of simulated playthroughs used to refine the static graph.",
+)
+@click.option("--no-cache", is_flag=True, help="Recompute the graph.")
+@click.option("--dot", default=None, help="Graphviz file to write the graph to.")
+@click.argument("src")
+def graph(entry_point: str, runs: int, no_cache: bool, dot: str | None, src: str):
+    """Builds the passage graph of the game in SRC (the directory containing the
+    project source files), and reports unreachable passages, dead ends and cycles."""
+    passages = passage_graph(Path(src), entry_point, runs, use_cache=not no_cache)
+    nb_edges = sum(len(targets) for targets in passages.edges.values())
+    print(f"{len(passages.nodes)} passages, {nb_edges} transitions")
+    print(f"Start passage: {passages.start}")
+    print(f"Reachable passages: {len(passages.reachable())}")
+    print("Unreachable passages:")
+    for node in sorted(passages.unreachable()):
+        print(f"  {node} ({passages.nodes[node]})")
+    print("Dead ends:")
+    for node in sorted(passages.dead_ends()):
+        print(f"  {node} ({passages.nodes[node]})")
+    print("Cycles:")
+    for cycle in passages.cycles():
+        print(f"  {' -> '.join(cycle)}")
+    if dot is not None:
+        Path(dot).write_text(passages.to_dot())
 
-    # Copy source files
-    print("Copying source files")
-    for f in sources:
-        shutil.copyfile(f, user_module / f.relative_to(src_dir))
 
-    # Write to files
-    print("Writing generated files")
-    main_html_path.write_text(main_source)
-    toml_path.write_text(toml_source)
-    css_path.write_text(css_source)
+# -~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~
+@main.command(short_help="Replays a trace recorded in the page.")
+@click.option(
+    "-e",
+    "--entry-point",
+    default="index.py",
+    help="Location of the main file of the project, relative to the source directory.",
+)
+@click.option("-n", "--repeat", type=int, default=1, help="Number of replays.")
+@click.option(
+    "--save",
+    default=None,
+    help="File to write the rebuilt game to, in the format of exported saves.",
+)
+@click.argument("trace", type=click.Path(exists=True, dir_okay=False))
+@click.argument("src")
+def replay(entry_point: str, repeat: int, save: str | None, trace: str, src: str):
+    """Replays TRACE (downloaded by shift-clicking the export button of the game)
+    with the game in SRC (the directory containing the project source files), and
+    reports passage execution times. The rebuilt game can be saved, to restore a lost
+    or corrupted save by importing it."""
+    stats, game = replay_trace(
+        Path(src), entry_point, Trace.loads(Path(trace).read_text()), repeat
+    )
+    print(stats.report())
+    if save is not None:
+        Path(save).write_text(export_replay(game, entry_point))
+        print(f"Rebuilt game written to {save}")
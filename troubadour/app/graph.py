@@ -0,0 +1,359 @@
+"""Passage graph of a game: which passages lead to which.
+
+The graph is first extracted statically, from the syntax trees of the source files:
+a passage leads to the passages given to the `Button` and `TextButton` continuations it
+creates, and to the passages it calls directly. It can then be refined dynamically with
+the transitions observed during simulated playthroughs (see `troubadour.app.simulate`),
+which catches passages passed around in variables. Graphs are cached in the cache
+folder of the user (see `graph_cache_dir`), keyed by a hash of the source files.
+
+Passages are named `module:qualname`, like in the simulator."""
+
+import ast
+import json
+import os
+from collections import deque
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Iterator
+
+from troubadour.app.incremental import hash_bytes, hash_text
+
+GRAPH_FORMAT = 1
+CONTINUATIONS = {"Button": 1, "TextButton": 1}
+"Continuation classes that take a passage, with the position of the passage argument."
+
+
+@dataclass
+class PassageGraph:
+    "Passages of a game and the transitions between them."
+    nodes: dict[str, str] = field(default_factory=dict)
+    "Location (file:line) of each passage, by name."
+    edges: dict[str, set[str]] = field(default_factory=dict)
+    "Passages each passage leads to."
+    start: str | None = None
+    "Start passage, as given to `run_game`."
+
+    def add_edge(self, source: str, target: str) -> None:
+        self.edges.setdefault(source, set()).add(target)
+        for node in (source, target):
+            self.nodes.setdefault(node, "")
+
+    def reachable(self, start: str | None = None) -> set[str]:
+        "Passages reachable from `start` (defaults to the start passage)."
+        start = start if start is not None else self.start
+        if start is None:
+            return set()
+        seen = {start}
+        queue = deque([start])
+        while queue:
+            for target in self.edges.get(queue.popleft(), ()):
+                if target not in seen:
+                    seen.add(target)
+                    queue.append(target)
+        return seen
+
+    def unreachable(self) -> set[str]:
+        return set(self.nodes) - self.reachable()
+
+    def dead_ends(self) -> set[str]:
+        "Passages that lead nowhere."
+        return {node for node in self.nodes if not self.edges.get(node)}
+
+    def cycles(self) -> list[list[str]]:
+        """Strongly connected components with a cycle (several passages, or a passage
+        leading to itself), computed with Tarjan's algorithm (iterative version)."""
+        index: dict[str, int] = {}
+        lowlink: dict[str, int] = {}
+        on_stack: set[str] = set()
+        stack: list[str] = []
+        result = []
+        for root in sorted(self.nodes):
+            if root in index:
+                continue
+            work = [(root, iter(sorted(self.edges.get(root, ()))))]
+            index[root] = lowlink[root] = len(index)
+            stack.append(root)
+            on_stack.add(root)
+            while work:
+                node, targets = work[-1]
+                for target in targets:
+                    if target not in index:
+                        index[target] = lowlink[target] = len(index)
+                        stack.append(target)
+                        on_stack.add(target)
+                        work.append((target, iter(sorted(self.edges.get(target, ())))))
+                        break
+                    if target in on_stack:
+                        lowlink[node] = min(lowlink[node], index[target])
+                else:
+                    work.pop()
+                    if work:
+                        parent = work[-1][0]
+                        lowlink[parent] = min(lowlink[parent], lowlink[node])
+                    if lowlink[node] == index[node]:
+                        component = []
+                        while True:
+                            member = stack.pop()
+                            on_stack.discard(member)
+                            component.append(member)
+                            if member == node:
+                                break
+                        if len(component) > 1 or node in self.edges.get(node, ()):
+                            result.append(sorted(component))
+        return result
+
+    def to_json(self) -> dict:
+        return {
+            "nodes": self.nodes,
+            "edges": {node: sorted(targets) for node, targets in self.edges.items()},
+            "start": self.start,
+        }
+
+    @staticmethod
+    def from_json(data: dict) -> "PassageGraph":
+        return PassageGraph(
+            data["nodes"],
+            {node: set(targets) for node, targets in data["edges"].items()},
+            data["start"],
+        )
+
+    def to_dot(self) -> str:
+        "Graphviz representation of the graph."
+        lines = ["digraph passages {"]
+        for node in sorted(self.nodes):
+            shape = "doublecircle" if node == self.start else "box"
+            lines.append(f'  "{node}" [shape={shape}];')
+        for node, targets in sorted(self.edges.items()):
+            lines += [f'  "{node}" -> "{target}";' for target in sorted(targets)]
+        lines.append("}")
+        return "\n".join(lines)
+
+
+# -~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~
+def module_name(src_dir: Path, path: Path) -> str:
+    parts = list(path.relative_to(src_dir).with_suffix("").parts)
+    if parts[-1] == "__init__":
+        parts.pop()
+    return ".".join(parts)
+
+
+def passage_id(function: ast.FunctionDef) -> str | None:
+    "Id of `function` if it is registered with `@passage` (see `troubadour.passages`)."
+    for decorator in function.decorator_list:
+        name: ast.expr = decorator
+        keywords: list[ast.keyword] = []
+        if isinstance(decorator, ast.Call):
+            name, keywords = decorator.func, decorator.keywords
+        match name:
+            case ast.Name(id="passage") | ast.Attribute(attr="passage"):
+                for keyword in keywords:
+                    match keyword:
+                        case ast.keyword(
+                            arg="name", value=ast.Constant(value=str(pid))
+                        ):
+                            return pid
+                return function.name
+    return None
+
+
+def passage_ids(tree: ast.Module) -> dict[str, str]:
+    "Functions registered with `@passage` at the top level of `tree`, by id."
+    return {
+        pid: node.name
+        for node in tree.body
+        if isinstance(node, ast.FunctionDef) and (pid := passage_id(node)) is not None
+    }
+
+
+class _ModuleScanner(ast.NodeVisitor):
+    "Collects the passages of a module and the passages they lead to."
+
+    def __init__(
+        self, module: str, filename: str, graph: PassageGraph, ids: dict[str, str]
+    ) -> None:
+        self.module = module
+        self.filename = filename
+        self.graph = graph
+        self.ids = ids
+        "Passages registered with `@passage` in the project, by id."
+        self.names: dict[str, str] = {}
+        "Names bound in the module to functions (of any module), by local name."
+        self.modules: dict[str, str] = {}
+        "Modules imported in the module, by local name."
+        self.functions: dict[str, ast.FunctionDef] = {}
+
+    def scan(self, tree: ast.Module) -> None:
+        for node in tree.body:
+            match node:
+                case ast.FunctionDef(name=name):
+                    self.functions[name] = node
+                    self.names[name] = f"{self.module}:{name}"
+                case ast.ImportFrom(module=module, names=aliases, level=level):
+                    base = self._absolute(module, level)
+                    for alias in aliases:
+                        self.names[alias.asname or alias.name] = f"{base}:{alias.name}"
+                case ast.Import(names=aliases):
+                    for alias in aliases:
+                        if alias.asname is not None:
+                            self.modules[alias.asname] = alias.name
+                        else:  # import a.b binds a
+                            top = alias.name.split(".")[0]
+                            self.modules[top] = top
+        for name, function in self.functions.items():
+            if self._is_passage(function):
+                self.graph.nodes[
+                    self.names[name]
+                ] = f"{self.filename}:{function.lineno}"
+        for name, function in self.functions.items():
+            for target in self._targets(function):
+                self.graph.add_edge(self.names[name], target)
+        for call in ast.walk(tree):
+            if isinstance(call, ast.Call) and self._callee(call) == "run_game":
+                if len(call.args) >= 2:
+                    self.graph.start = self._resolve(call.args[1])
+
+    def _absolute(self, module: str | None, level: int) -> str:
+        if level == 0:
+            return module or ""
+        base = self.module.split(".")[: -level or None]
+        return ".".join(base + ([module] if module else []))
+
+    @staticmethod
+    def _is_passage(function: ast.FunctionDef) -> bool:
+        "Passages are registered with `@passage`, or take the game as first argument."
+        if passage_id(function) is not None:
+            return True
+        args = function.args.args
+        if not args:
+            return False
+        annotation = ast.unparse(args[0].annotation) if args[0].annotation else ""
+        return args[0].arg == "game" or annotation.split("[")[0].endswith("Game")
+
+    @staticmethod
+    def _callee(call: ast.Call) -> str | None:
+        match call.func:
+            case ast.Name(id=name) | ast.Attribute(attr=name):
+                return name
+        return None
+
+    def _resolve(self, expr: ast.expr) -> str | None:
+        "Name of the function that `expr` refers to, if it can be resolved."
+        match expr:
+            case ast.Constant(value=str(ref)):  # passage given by name
+                return ref if ":" in ref else self.ids.get(ref)
+            case ast.Name(id=name):
+                return self.names.get(name)
+            case ast.Attribute(value=ast.Name(id=module), attr=attr):
+                if module in self.modules:
+                    return f"{self.modules[module]}:{attr}"
+        return None
+
+    def _targets(self, function: ast.FunctionDef) -> Iterator[str]:
+        for node in ast.walk(function):
+            if not isinstance(node, ast.Call):
+                continue
+            callee = self._callee(node)
+            passage: ast.expr | None = None
+            if callee in CONTINUATIONS:
+                position = CONTINUATIONS[callee]
+                if len(node.args) > position:
+                    passage = node.args[position]
+                for keyword in node.keywords:
+                    if keyword.arg == "passage":
+                        passage = keyword.value
+            elif callee == "run_passage" and node.args:
+                passage = node.args[0]
+            else:
+                # direct call of another passage, with the game as first argument
+                target = self._resolve(node.func)
+                if target is not None and node.args:
+                    first = node.args[0]
+                    if isinstance(first, ast.Name) and first.id == "game":
+                        yield target
+                continue
+            if passage is not None:
+                target = self._resolve(passage)
+                if target is not None:
+                    yield target
+
+
+def static_graph(src_dir: Path, entry_point: str) -> PassageGraph:
+    """Extracts the passage graph from the source files of folder `src_dir`, the start
+    passage is the one given to `run_game` by module `entry_point`."""
+    graph = PassageGraph()
+    start = None
+    trees = {
+        path: ast.parse(path.read_bytes(), str(path))
+        for path in sorted(src_dir.rglob("*.py"))
+    }
+    ids = {
+        pid: f"{module_name(src_dir, path)}:{name}"
+        for path, tree in trees.items()
+        for pid, name in passage_ids(tree).items()
+    }
+    for path, tree in trees.items():
+        scanner = _ModuleScanner(module_name(src_dir, path), str(path), graph, ids)
+        scanner.scan(tree)
+        if path == src_dir / entry_point:
+            start = graph.start
+        graph.start = None
+    graph.start = start
+    # only keep the functions of the project that are passages (or targets of
+    # continuations, which are passages even if they do not look like ones)
+    targets = {target for targets in graph.edges.values() for target in targets}
+    for node in list(graph.nodes):
+        if not graph.nodes[node] and node not in targets and node != graph.start:
+            del graph.nodes[node]
+            graph.edges.pop(node, None)
+    return graph
+
+
+def source_key(src_dir: Path, entry_point: str, runs: int) -> str:
+    "Hash of the source files of `src_dir` (and of the graph options)."
+    digests = [
+        f"{path.relative_to(src_dir)}:{hash_bytes(path.read_bytes())}"
+        for path in sorted(src_dir.rglob("*.py"))
+    ]
+    return hash_text(json.dumps([GRAPH_FORMAT, entry_point, runs, digests]))
+
+
+def graph_cache_dir() -> Path:
+    "Folder of the cached graphs: troubadour/graphs in the cache folder of the user."
+    root = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+    return Path(root) / "troubadour" / "graphs"
+
+
+def passage_graph(
+    src_dir: Path, entry_point: str, runs: int = 0, use_cache: bool = True
+) -> PassageGraph:
+    """Passage graph of the game of folder `src_dir`, from the cache if the sources
+    did not change since it was computed.
+
+    Args:
+        src_dir (Path): folder containing the game source files.
+        entry_point (str): main file of the game, relative to `src_dir`.
+        runs (int): number of simulated playthroughs used to refine the graph, 0 for
+            a static graph only.
+        use_cache (bool): if False, the graph is recomputed.
+    """
+    # one cache file per source folder
+    cache_path = graph_cache_dir() / f"{hash_text(str(src_dir.resolve()))[:16]}.json"
+    key = source_key(src_dir, entry_point, runs)
+    if use_cache and cache_path.exists():
+        cached = json.loads(cache_path.read_text())
+        if cached.get("key") == key:
+            return PassageGraph.from_json(cached["graph"])
+
+    graph = static_graph(src_dir, entry_point)
+    if runs > 0:
+        from troubadour.app.simulate import simulate  # pylint: disable=C0415
+
+        stats = simulate(src_dir, entry_point, runs=runs)
+        for source, target in stats.transitions:
+            graph.add_edge(source, target)
+        if graph.start is None and stats.starts:
+            graph.start = stats.starts.most_common(1)[0][0]
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    cache_path.write_text(json.dumps({"key": key, "graph": graph.to_json()}))
+    return graph
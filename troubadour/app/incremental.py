@@ -0,0 +1,156 @@
+"""Incremental builds.
+
+The build records, in a manifest stored in the output folder, the content hash of the
+inputs of each output file. Outputs whose inputs did not change since the previous
+build are left untouched (and keep their modification time), the others are copied or
+regenerated. Files produced by a previous build that are no longer part of the project
+are removed."""
+
+import hashlib
+import json
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable
+
+MANIFEST_NAME = ".troubadour-manifest.json"
+MANIFEST_VERSION = 1
+
+
+def hash_bytes(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def hash_text(text: str) -> str:
+    return hash_bytes(text.encode())
+
+
+@dataclass
+class BuildSummary:
+    "Relative paths of the outputs, by what the build did with them."
+    written: list[str] = field(default_factory=list)
+    skipped: list[str] = field(default_factory=list)
+    removed: list[str] = field(default_factory=list)
+
+    def __str__(self) -> str:
+        return (
+            f"{len(self.written)} file(s) rebuilt, {len(self.skipped)} unchanged"
+            f" file(s) skipped, {len(self.removed)} stale file(s) removed"
+        )
+
+
+class IncrementalBuild:
+    """Writes the outputs of a build in folder `output_path`, skipping those that are
+    up to date according to the manifest of the previous build.
+
+    Args:
+        output_path (Path): output folder.
+        jobs (int | None): number of threads used to hash and copy files.
+    """
+
+    def __init__(self, output_path: Path, jobs: int | None = None) -> None:
+        self.output_path = output_path
+        self.jobs = jobs
+        self.summary = BuildSummary()
+        old = self._load_manifest()
+        self._old_inputs: dict[str, list] = old.get("inputs", {})
+        self._old_outputs: dict[str, str] = old.get("outputs", {})
+        self._inputs: dict[str, list] = {}
+        "Stat and hash of the input files, by absolute path."
+        self._outputs: dict[str, str] = {}
+        "Hash of the inputs of each output, by path relative to the output folder."
+
+    def _load_manifest(self) -> dict[str, Any]:
+        try:
+            manifest = json.loads((self.output_path / MANIFEST_NAME).read_text())
+        except (OSError, ValueError):
+            return {}
+        if manifest.get("version") != MANIFEST_VERSION:
+            return {}
+        return manifest
+
+    def file_hash(self, path: Path) -> str:
+        """Content hash of input file `path`. The hash of the previous build is reused
+        when the size and modification time of the file did not change."""
+        key = str(path.absolute())
+        if key in self._inputs:
+            return self._inputs[key][2]
+        stat = path.stat()
+        cached = self._old_inputs.get(key)
+        if cached is not None and cached[:2] == [stat.st_mtime_ns, stat.st_size]:
+            digest = cached[2]
+        else:
+            digest = hash_bytes(path.read_bytes())
+        self._inputs[key] = [stat.st_mtime_ns, stat.st_size, digest]
+        return digest
+
+    def _update(self, dest: str, key: str, write: Callable[[Path], None]) -> None:
+        self._outputs[dest] = key
+        dest_path = self.output_path / dest
+        if self._old_outputs.get(dest) == key and dest_path.exists():
+            self.summary.skipped.append(dest)
+            return
+        dest_path.parent.mkdir(parents=True, exist_ok=True)
+        write(dest_path)
+        self.summary.written.append(dest)
+
+    def hash_files(self, files: list[Path]) -> list[str]:
+        "Content hashes of input files, computed in parallel."
+        with ThreadPoolExecutor(self.jobs) as pool:
+            return list(pool.map(self.file_hash, files))
+
+    def copy_files(self, files: list[tuple[Path, str]]) -> dict[str, str]:
+        """Copies files that changed since the previous build, in parallel.
+
+        Args:
+            files (list[tuple[Path, str]]): source files, with their destination
+                relative to the output folder.
+
+        Returns:
+            dict[str, str]: content hash of the files, by destination.
+        """
+
+        def copy(item: tuple[Path, str]) -> tuple[str, str]:
+            src, dest = item
+            digest = self.file_hash(src)
+
+            def write(path: Path) -> None:
+                shutil.copyfile(src, path)
+
+            self._update(dest, digest, write)
+            return dest, digest
+
+        with ThreadPoolExecutor(self.jobs) as pool:
+            return dict(pool.map(copy, files))
+
+    def generate(self, dest: str, key: str, render: Callable[[], str | bytes]) -> None:
+        """Writes the output of `render` to `dest`, unless `key` (the hash of
+        everything the output depends on) is the same as in the previous build."""
+
+        def write(path: Path) -> None:
+            content = render()
+            if isinstance(content, bytes):
+                path.write_bytes(content)
+            else:
+                path.write_text(content)
+
+        self._update(dest, key, write)
+
+    def finish(self) -> BuildSummary:
+        "Removes stale outputs, writes the manifest and returns the build summary."
+        for dest in sorted(set(self._old_outputs) - set(self._outputs)):
+            path = self.output_path / dest
+            path.unlink(missing_ok=True)
+            self.summary.removed.append(dest)
+            for parent in path.relative_to(self.output_path).parents[:-1]:
+                folder = self.output_path / parent
+                if folder.exists() and not any(folder.iterdir()):
+                    folder.rmdir()
+        manifest = {
+            "version": MANIFEST_VERSION,
+            "inputs": self._inputs,
+            "outputs": self._outputs,
+        }
+        (self.output_path / MANIFEST_NAME).write_text(json.dumps(manifest, indent=1))
+        return self.summary
@@ -0,0 +1,97 @@
+"""Lazy stage of the build: splits the modules of the game between those fetched with
+the page (the entry point and the modules it imports, directly or not) and those
+downloaded when needed, and computes the module index embedded in the page (see
+`troubadour.lazy`)."""
+
+import ast
+from pathlib import Path
+
+from troubadour.app.graph import module_name, passage_ids, static_graph
+
+
+def imported_modules(tree: ast.Module, module: str, is_package: bool) -> set[str]:
+    "Modules imported by the code of `tree` (that of module `module`), anywhere in it."
+    package = module if is_package else module.rpartition(".")[0]
+    result = set()
+    for node in ast.walk(tree):
+        match node:
+            case ast.Import(names=aliases):
+                result |= {alias.name for alias in aliases}
+            case ast.ImportFrom(module=name, names=aliases, level=level):
+                if level > 0:
+                    parts = package.split(".") if package else []
+                    base = ".".join(parts[: len(parts) - level + 1])
+                    name = ".".join(part for part in (base, name) if part)
+                assert name is not None
+                result.add(name)
+                # from package import module
+                result |= {f"{name}.{alias.name}" for alias in aliases}
+    return result
+
+
+def module_index(
+    src_dir: Path, entry_point: str, user_module: Path
+) -> tuple[dict, set[Path]]:
+    """Splits the modules of `src_dir` into eager and lazy ones.
+
+    Args:
+        src_dir (Path): folder containing the game source files.
+        entry_point (str): main file of the game, relative to `src_dir`.
+        user_module (Path): folder of the source files in the build.
+
+    Returns:
+        tuple[dict, set[Path]]: the module index of the page (see
+            `troubadour.lazy.ModuleIndex`) and the source files to fetch with it.
+    """
+    sources = {module_name(src_dir, path): path for path in src_dir.rglob("*.py")}
+    entry = module_name(src_dir, src_dir / entry_point)
+    urls = {
+        name: (user_module / path.relative_to(src_dir)).as_posix()
+        for name, path in sources.items()
+    }
+    # folders without __init__.py are namespace packages
+    for name in list(urls):
+        parent = name.rpartition(".")[0]
+        while parent and parent not in urls:
+            urls[parent] = ""
+            parent = parent.rpartition(".")[0]
+
+    trees = {
+        name: ast.parse(path.read_bytes(), str(path)) for name, path in sources.items()
+    }
+    eager = {entry}
+    pending = [entry]
+    while pending:
+        name = pending.pop()
+        is_package = sources[name].name == "__init__.py"
+        for imported in imported_modules(trees[name], name, is_package):
+            # importing a.b.c imports a and a.b
+            parts = imported.split(".")
+            for end in range(1, len(parts) + 1):
+                prefix = ".".join(parts[:end])
+                if prefix in sources and prefix not in eager:
+                    eager.add(prefix)
+                    pending.append(prefix)
+
+    passages = {
+        pid: name
+        for name in sorted(sources)
+        if name not in eager
+        for pid in passage_ids(trees[name])
+    }
+    graph = static_graph(src_dir, entry_point)
+    following: dict[str, set[str]] = {}
+    for source, targets in graph.edges.items():
+        source_module = source.split(":")[0]
+        for target in targets:
+            target_module = target.split(":")[0]
+            if target_module != source_module and target_module not in eager:
+                following.setdefault(source_module, set()).add(target_module)
+
+    index = {
+        "entry": entry,
+        "modules": {name: url for name, url in sorted(urls.items()) if name != entry},
+        "passages": passages,
+        "next": {name: sorted(names) for name, names in sorted(following.items())},
+    }
+    return index, {sources[name] for name in eager}
@@ -0,0 +1,51 @@
+"""Prerender stage of the build: runs the start passage of the game on the headless
+backend, so that the page can display it before Python is ready (see
+`troubadour.prerender`)."""
+
+import json
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import troubadour.backend as be
+import troubadour.game as gm
+import troubadour.save as sv
+import troubadour.trace as tr
+from troubadour.app.graph import module_name
+from troubadour.app.simulate import load_entry
+from troubadour.backends.headless import HeadlessBackend
+from troubadour.prerender import Prerendered
+
+
+def run_start(src_dir: Path, entry_point: str, build_id: str) -> tuple[str, str]:
+    """Starts a new game and runs its start passage, as the page would.
+
+    Returns:
+        tuple[str, str]: the html of the output and the content of the prerender meta
+            tag of the page.
+    """
+    state_cls, start_passage = load_entry(src_dir, entry_point)
+    # the passages are rendered for the build, like in the page
+    be.use_backend(HeadlessBackend({"troubadour-build": build_id}))
+    tr.recorder.start(state_cls)
+    game = gm.GameImpl(state_cls())
+    game.run_passage(start_passage)
+    assert tr.recorder.trace is not None
+    prerendered = Prerendered(
+        module_name(src_dir, src_dir / entry_point),
+        sv.codec.encode(game),
+        tr.recorder.trace.entries[0].encode(),
+    )
+    meta = json.dumps(prerendered.__dict__, separators=(",", ":"))
+    # the html inserted by the game, not that of the headless page (browsers fix
+    # malformed html their own way)
+    html, _, _ = game._passage_html(  # pylint: disable=W0212
+        game._output[-1], game._passage_count  # pylint: disable=W0212
+    )
+    return html, meta
+
+
+def prerender(src_dir: Path, entry_point: str, build_id: str) -> tuple[str, str]:
+    """Same as `run_start`, in a new process so that the modules of the game are
+    imported afresh (watch builds run in a single process)."""
+    with ProcessPoolExecutor(1) as pool:
+        return pool.submit(run_start, src_dir, entry_point, build_id).result()
@@ -0,0 +1,332 @@
+"""Static file server for built projects.
+
+Files are served by a thread pool, with strong ETags, cache headers, compression
+(gzip, and brotli if the `brotli` package is installed) and byte range support. Files
+named `<file>.gz` or `<file>.br` next to `<file>` are used as precompressed variants,
+the other compressible files are compressed once and kept in memory. Each request is
+logged with its latency and the number of bytes sent. The server also streams the
+rebuild notifications of `troubadour build --watch` to the pages."""
+
+import gzip
+import hashlib
+import mimetypes
+import re
+import sys
+import threading
+import time
+import urllib.parse
+from dataclasses import dataclass, field
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+from troubadour.app.assets import ASSETS_DIR
+from troubadour.app.build import EVENTS_URL, RELOAD_NAME
+
+try:
+    import brotli  # type: ignore
+except ImportError:
+    brotli = None
+
+MIME_TYPES = {
+    ".wasm": "application/wasm",
+    ".js": "text/javascript",
+    ".mjs": "text/javascript",
+    ".py": "text/x-python",
+    ".pyc": "application/octet-stream",
+    ".toml": "application/toml",
+    ".whl": "application/zip",
+    ".zip": "application/zip",
+    ".json": "application/json",
+}
+COMPRESSIBLE = ("text/", "application/javascript", "application/json")
+COMPRESSIBLE_TYPES = {"application/wasm", "application/toml", "image/svg+xml"}
+MIN_COMPRESS_SIZE = 512
+"Files smaller than this (in bytes) are sent uncompressed."
+IMMUTABLE_PREFIXES = ("runtime/",)
+"Folders of files that never change for a given url (e.g., the pinned runtime)."
+FINGERPRINTED_RE = re.compile(rf"{ASSETS_DIR}/.+\.[0-9a-f]{{10}}(\.[^./]+)?")
+"""Assets whose name holds a hash of their content (see
+`troubadour.app.assets.fingerprinted`), which never change for a given url either."""
+RANGE_RE = re.compile(r"bytes=(\d*)-(\d*)$")
+EVENTS_POLL_INTERVAL = 0.2
+EVENTS_KEEPALIVE = 15.0
+"Time (in seconds) after which an idle event stream gets a comment, to keep it open."
+
+
+def content_type(path: Path) -> str:
+    if path.suffix in MIME_TYPES:
+        return MIME_TYPES[path.suffix]
+    return mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+
+
+def is_compressible(mime: str) -> bool:
+    return mime.startswith(COMPRESSIBLE) or mime in COMPRESSIBLE_TYPES
+
+
+def is_immutable(relative: str) -> bool:
+    "Whether the file at path `relative` (from the served folder) never changes."
+    return relative.startswith(IMMUTABLE_PREFIXES) or bool(
+        FINGERPRINTED_RE.fullmatch(relative)
+    )
+
+
+def accepted_encodings(header: str, candidates: list[str]) -> list[str]:
+    """Encodings among `candidates` that an Accept-Encoding `header` accepts, by
+    decreasing preference (quality value, then order of `candidates`)."""
+    qualities: dict[str, float] = {}
+    for item in header.split(","):
+        name, *params = item.split(";")
+        quality = 1.0
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if name.strip():
+            qualities[name.strip().lower()] = quality
+    default = qualities.get("*", 0.0)
+    accepted = [name for name in candidates if qualities.get(name, default) > 0]
+    return sorted(accepted, key=lambda name: -qualities.get(name, default))
+
+
+@dataclass
+class CachedFile:
+    "Content of a served file, with its ETag and its compressed variants."
+    mtime_ns: int
+    data: bytes
+    etag: str
+    encoded: dict[str, bytes] = field(default_factory=dict)
+    "Compressed content, by content encoding."
+
+
+class FileCache:
+    "Files read from the disk, reloaded when their modification time changes."
+
+    def __init__(self) -> None:
+        self._files: dict[Path, CachedFile] = {}
+        self._lock = threading.Lock()
+
+    def get(self, path: Path) -> CachedFile:
+        mtime_ns = path.stat().st_mtime_ns
+        with self._lock:
+            cached = self._files.get(path)
+        if cached is None or cached.mtime_ns != mtime_ns:
+            data = path.read_bytes()
+            cached = CachedFile(
+                mtime_ns, data, f'"{hashlib.sha256(data).hexdigest()[:32]}"'
+            )
+            with self._lock:
+                self._files[path] = cached
+        return cached
+
+    def encoded(self, path: Path, file: CachedFile, encoding: str) -> bytes | None:
+        """Returns the content of `file` compressed with `encoding`, from a
+        precompressed file if there is one, or None if it is not available."""
+        if encoding in file.encoded:
+            return file.encoded[encoding]
+        precompressed = path.with_name(
+            path.name + {"gzip": ".gz", "br": ".br"}[encoding]
+        )
+        if precompressed.exists() and precompressed.stat().st_mtime_ns >= file.mtime_ns:
+            data = precompressed.read_bytes()
+        elif encoding == "gzip":
+            data = gzip.compress(file.data, mtime=0)
+        elif encoding == "br" and brotli is not None:
+            data = brotli.compress(file.data)
+        else:
+            return None
+        with self._lock:
+            file.encoded[encoding] = data
+        return data
+
+
+class StaticHandler(BaseHTTPRequestHandler):
+    "Serves the files of the folder of the server."
+
+    server: "StaticServer"
+    protocol_version = "HTTP/1.1"
+
+    def handle_one_request(self) -> None:
+        self._start = time.perf_counter()
+        self._status: int | None = None
+        self._sent = 0
+        super().handle_one_request()
+        if self._status is not None:
+            latency = (time.perf_counter() - self._start) * 1000
+            self.log_message(
+                '"%s" %d %d bytes %.1f ms',
+                self.requestline,
+                self._status,
+                self._sent,
+                latency,
+            )
+
+    def log_request(self, code: int | str = "-", size: int | str = "-") -> None:
+        pass  # requests are logged once handled, see handle_one_request
+
+    def send_response(self, code: int, message: str | None = None) -> None:
+        self._status = code
+        super().send_response(code, message)
+
+    def send_body(self, data: bytes) -> None:
+        if self.command != "HEAD":
+            self.wfile.write(data)
+            self._sent += len(data)
+
+    def resolve(self) -> Path | None:
+        "Returns the file requested, or None if there is none."
+        url_path = urllib.parse.unquote(urllib.parse.urlsplit(self.path).path)
+        root = self.server.directory.resolve()
+        path = (root / url_path.lstrip("/")).resolve()
+        if not path.is_relative_to(root):
+            return None
+        if path.is_dir():
+            path = path / "index.html"
+        return path if path.is_file() else None
+
+    def cache_control(self, path: Path) -> str:
+        relative = path.relative_to(self.server.directory.resolve()).as_posix()
+        if is_immutable(relative):
+            return "public, max-age=31536000, immutable"
+        return "no-cache"
+
+    def do_HEAD(self) -> None:  # pylint: disable=C0103
+        self.do_GET()
+
+    def do_GET(self) -> None:  # pylint: disable=C0103
+        if urllib.parse.urlsplit(self.path).path == EVENTS_URL:
+            self.send_events()
+            return
+        path = self.resolve()
+        if path is None:
+            self.send_error(HTTPStatus.NOT_FOUND)
+            return
+        file = self.server.files.get(path)
+        mime = content_type(path)
+
+        range_header = self.headers.get("Range")
+        if range_header is not None and self.headers.get("If-Range") in (
+            None,
+            file.etag,
+        ):
+            self.send_range(path, file, mime, range_header)
+            return
+
+        data, etag, encoding = file.data, file.etag, None
+        if is_compressible(mime) and len(file.data) >= MIN_COMPRESS_SIZE:
+            accepted = self.headers.get("Accept-Encoding", "")
+            for candidate in accepted_encodings(accepted, ["br", "gzip"]):
+                encoded = self.server.files.encoded(path, file, candidate)
+                if encoded is not None:
+                    data, encoding = encoded, candidate
+                    etag = f'{file.etag[:-1]}-{candidate}"'
+                    break
+
+        if etag in self.headers.get("If-None-Match", ""):
+            self.send_response(HTTPStatus.NOT_MODIFIED)
+            self.send_common_headers(path, etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.send_response(HTTPStatus.OK)
+        self.send_common_headers(path, etag)
+        self.send_header("Content-Type", mime)
+        if encoding is not None:
+            self.send_header("Content-Encoding", encoding)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.send_body(data)
+
+    def send_events(self) -> None:
+        """Streams the rebuild notifications written by watch builds (see
+        `troubadour.app.build.watch_project`) as server-sent events."""
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        self.close_connection = True
+        notification = self.server.directory / RELOAD_NAME
+
+        def mtime() -> int | None:
+            return notification.stat().st_mtime_ns if notification.exists() else None
+
+        last, idle = mtime(), 0.0
+        try:
+            while True:
+                time.sleep(EVENTS_POLL_INTERVAL)
+                idle += EVENTS_POLL_INTERVAL
+                if mtime() != last:
+                    last, idle = mtime(), 0.0
+                    self.send_body(f"data: {notification.read_text()}\n\n".encode())
+                elif idle >= EVENTS_KEEPALIVE:
+                    idle = 0.0
+                    self.send_body(b": keepalive\n\n")
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def send_common_headers(self, path: Path, etag: str) -> None:
+        self.send_header("ETag", etag)
+        self.send_header("Cache-Control", self.cache_control(path))
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Vary", "Accept-Encoding")
+
+    def send_range(
+        self, path: Path, file: CachedFile, mime: str, range_header: str
+    ) -> None:
+        "Sends a single byte range of the (uncompressed) file."
+        size = len(file.data)
+        match = RANGE_RE.match(range_header.strip())
+        start, end = -1, -1
+        if match is not None and match.group(1):
+            start = int(match.group(1))
+            end = int(match.group(2)) if match.group(2) else size - 1
+        elif match is not None and match.group(2):  # suffix range: last bytes
+            start, end = max(size - int(match.group(2)), 0), size - 1
+        end = min(end, size - 1)
+        if start < 0 or start > end:
+            self.send_response(HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE)
+            self.send_header("Content-Range", f"bytes */{size}")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.send_response(HTTPStatus.PARTIAL_CONTENT)
+        self.send_common_headers(path, file.etag)
+        self.send_header("Content-Type", mime)
+        self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        self.send_header("Content-Length", str(end - start + 1))
+        self.end_headers()
+        self.send_body(file.data[start : end + 1])
+
+
+class StaticServer(ThreadingHTTPServer):
+    """Threaded server of the files of folder `directory`.
+
+    Args:
+        address (tuple[str, int]): host and port to listen to.
+        directory (Path): folder to serve.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address: tuple[str, int], directory: Path) -> None:
+        self.directory = directory
+        self.files = FileCache()
+        super().__init__(address, StaticHandler)
+
+
+def serve(directory: Path, port: int, host: str = "") -> None:
+    "Serves folder `directory` until interrupted."
+    with StaticServer((host, port), directory) as server:
+        print(
+            f"Serving {directory} on http://{host or 'localhost'}:{port}"
+            f" (brotli {'enabled' if brotli is not None else 'not installed'})",
+            file=sys.stderr,
+        )
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,402 @@
+"""Playthrough simulator: plays a game many times on the headless backend, pressing the
+buttons of each passage (randomly, or all of them in turn), and gathers statistics
+about the passages that were run.
+
+Playthroughs are spread across worker processes, each of which loads the entry module
+of the game once and records the game started by its call to `run_game`."""
+
+import importlib
+import json
+import os
+import random
+import statistics
+import sys
+import time
+import traceback
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Iterator
+
+import troubadour.backend as be
+import troubadour.game as gm
+import troubadour.lazy as lz
+import troubadour.save as sv
+import troubadour.trace as tr
+from troubadour.app.lazy import module_index
+from troubadour.definitions import Eid
+from troubadour.passages import function_path, resolve_passage
+
+DEFAULT_TEXT_INPUTS = ["", "test", "42"]
+"Values typed in text inputs when no other values are given."
+
+PATH_TAGS = ("py/object", "py/type", "py/function")
+"Tags of jsonpickle whose value is the import path of a class or function."
+
+
+@dataclass
+class SimulationStats:
+    "Statistics of a set of playthroughs, can be merged with others."
+    runs: int = 0
+    steps: int = 0
+    truncated: int = 0
+    "Playthroughs stopped because they reached the maximum number of steps."
+    visits: Counter = field(default_factory=Counter)
+    "Number of times each passage was run, by passage name."
+    dead_ends: Counter = field(default_factory=Counter)
+    "Passages that ended a playthrough without offering any continuation."
+    exceptions: Counter = field(default_factory=Counter)
+    "Exceptions raised by passages, by passage name and exception."
+    timings: dict[str, list[float]] = field(default_factory=dict)
+    "Execution times (run and render, in seconds) of each passage."
+    transitions: Counter = field(default_factory=Counter)
+    "Number of times each passage led to another one, by (passage, next passage)."
+    starts: Counter = field(default_factory=Counter)
+    "Passages that started playthroughs."
+
+    def merge(self, other: "SimulationStats") -> None:
+        self.runs += other.runs
+        self.steps += other.steps
+        self.truncated += other.truncated
+        self.visits.update(other.visits)
+        self.dead_ends.update(other.dead_ends)
+        self.exceptions.update(other.exceptions)
+        self.transitions.update(other.transitions)
+        self.starts.update(other.starts)
+        for name, timings in other.timings.items():
+            self.timings.setdefault(name, []).extend(timings)
+
+    def report(self) -> str:
+        lines = [
+            f"{self.runs} playthroughs, {self.steps} passages run,"
+            f" {self.truncated} stopped at the maximum number of steps",
+            "",
+            f"{'passage':<40} {'visits':>8} {'median':>9} {'p95':>9} {'max':>9}",
+        ]
+        for name, count in self.visits.most_common():
+            timings = sorted(self.timings.get(name, [0.0]))
+            p95 = timings[min(int(len(timings) * 0.95), len(timings) - 1)]
+            lines.append(
+                f"{name:<40} {count:>8} {statistics.median(timings) * 1000:>7.2f}ms"
+                f" {p95 * 1000:>7.2f}ms {timings[-1] * 1000:>7.2f}ms"
+            )
+        lines += ["", "Dead ends (passages without continuations):"]
+        lines += [f"  {name}: {count}" for name, count in self.dead_ends.most_common()]
+        lines += ["", "Exceptions:"]
+        lines += [f"  {name}: {count}" for name, count in self.exceptions.most_common()]
+        return "\n".join(lines)
+
+
+class SimulatedGame(gm.GameImpl):
+    "Game that records the passages it runs in `stats`."
+
+    stats: SimulationStats
+    running = ""
+    "Name of the passage being run (or run last)."
+
+    def run_passage(
+        self, passage: Callable | str, *, kwargs: dict[str, object] | None = None
+    ) -> None:
+        if isinstance(passage, str):
+            passage = resolve_passage(passage)
+        name = function_path(passage)
+        if self.running:
+            self.stats.transitions[(self.running, name)] += 1
+        else:
+            self.stats.starts[name] += 1
+        self.running = name
+        self.stats.visits[name] += 1
+        self.stats.steps += 1
+        # the checkpoint of the previous passage is deferred to the next one, it
+        # must not be charged to this one
+        if self._history is not None:
+            self._history.flush()
+        start = time.perf_counter()
+        try:
+            super().run_passage(passage, kwargs=kwargs)
+        finally:
+            self.stats.timings.setdefault(name, []).append(time.perf_counter() - start)
+
+
+# -~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~
+def entry_module(entry_point: str) -> str:
+    "Name of the entry module (which runs as __main__ in the page)."
+    return ".".join(Path(entry_point).with_suffix("").parts)
+
+
+def load_entry(src_dir: Path, entry_point: str) -> tuple[type, Callable]:
+    """Imports the entry module of a game on the headless backend, returns the state
+    class and the start passage it gave to `run_game`."""
+    be.use_backend("headless")
+    if gm.game_entry is None:
+        sys.path.insert(0, str(src_dir.absolute()))
+        importlib.import_module(entry_module(entry_point))
+        # passages given by id may be defined in modules that are not imported yet
+        index, _ = module_index(src_dir, entry_point, src_dir.absolute())
+        lz.install(lz.ModuleIndex(**index))
+    assert gm.game_entry is not None, "The entry point did not call run_game!"
+    return gm.game_entry
+
+
+@dataclass
+class Choice:
+    "Continuation that can be chosen: a button, and possibly a text to type before."
+    button: Eid
+    text_input: Eid | None = None
+    text: str | None = None
+
+    def make(self) -> None:
+        if self.text_input is not None:
+            be.set_value(self.text_input, self.text or "")
+        be.click(self.button)
+
+
+def choices(game: gm.GameImpl, texts: list[str]) -> list[Choice]:
+    "Continuations offered by the last passage of `game`."
+    if not game._rendered:  # pylint: disable=W0212
+        return []
+    controls = game._rendered[-1].controls  # pylint: disable=W0212
+    result = []
+    for eid in controls:
+        if not eid.endswith("__button"):
+            continue
+        text_input = Eid(eid.removesuffix("__button") + "__textinput")
+        if text_input in controls:
+            result += [Choice(eid, text_input, text) for text in texts]
+        else:
+            result.append(Choice(eid))
+    return result
+
+
+def play(
+    entry: tuple[type, Callable],
+    pick: Callable[[list[Choice], int], Choice | None],
+    stats: SimulationStats,
+    max_steps: int,
+    texts: list[str],
+) -> None:
+    """Plays one game on a fresh headless backend, `pick` selects the continuation
+    to take among those available at each step (or None to stop)."""
+    be.use_backend("headless")
+    state_cls, start = entry
+    game = SimulatedGame(state_cls())
+    game.stats = stats
+    stats.runs += 1
+    tr.recorder.trace = None
+    try:
+        game.run_passage(start)
+        for step in range(max_steps):
+            available = choices(game, texts)
+            if not available:
+                stats.dead_ends[game.running] += 1
+                return
+            choice = pick(available, step)
+            if choice is None:
+                return
+            choice.make()
+        stats.truncated += 1
+    except Exception as error:  # pylint: disable=W0718
+        frame = traceback.extract_tb(error.__traceback__)[-1]
+        stats.exceptions[
+            f"{game.running}: {type(error).__name__}: {error}"
+            f" ({frame.filename}:{frame.lineno})"
+        ] += 1
+
+
+def random_runs(
+    src_dir: Path,
+    entry_point: str,
+    seeds: range,
+    max_steps: int,
+    texts: list[str],
+) -> SimulationStats:
+    "Plays one game per seed, choosing continuations at random."
+    entry = load_entry(src_dir, entry_point)
+    stats = SimulationStats()
+    for seed in seeds:
+        rng = random.Random(seed)
+        play(entry, lambda available, _: rng.choice(available), stats, max_steps, texts)
+    return stats
+
+
+def explore(
+    entry: tuple[type, Callable],
+    path: list[int],
+    max_steps: int,
+    texts: list[str],
+) -> tuple[SimulationStats, int]:
+    """Plays the game following choices `path` (indices in the available choices).
+    Returns the statistics of the playthrough and, if it was not over at the end of
+    the path, the number of choices available next (otherwise 0)."""
+    stats = SimulationStats()
+    branching = 0
+
+    def pick(available: list[Choice], step: int) -> Choice | None:
+        nonlocal branching
+        if step < len(path):
+            return available[path[step]]
+        branching = len(available)
+        return None
+
+    play(entry, pick, stats, max_steps, texts)
+    return stats, branching
+
+
+def exhaustive_runs(
+    src_dir: Path,
+    entry_point: str,
+    prefix: list[int],
+    max_steps: int,
+    texts: list[str],
+) -> SimulationStats:
+    """Plays all the games whose first choices are `prefix`, up to `max_steps` steps.
+    Each path is replayed from the start (so that states need not be copied), only
+    complete playthroughs are counted."""
+    entry = load_entry(src_dir, entry_point)
+    stats = SimulationStats()
+    pending = [prefix]
+    while pending:
+        path = pending.pop()
+        path_stats, branching = explore(entry, path, max_steps, texts)
+        if branching == 0:
+            stats.merge(path_stats)
+        pending += [path + [index] for index in range(branching)]
+    return stats
+
+
+def simulate(
+    src_dir: Path,
+    entry_point: str,
+    runs: int = 1000,
+    workers: int | None = None,
+    seed: int = 0,
+    max_steps: int = 100,
+    texts: list[str] | None = None,
+    exhaustive: bool = False,
+) -> SimulationStats:
+    """Simulates playthroughs of a game in worker processes.
+
+    Args:
+        src_dir (Path): folder containing the game source files.
+        entry_point (str): main file of the game, relative to `src_dir`.
+        runs (int): number of random playthroughs.
+        workers (int | None): number of processes (defaults to the number of CPUs).
+        seed (int): seed of the first random playthrough.
+        max_steps (int): maximum number of passages of a playthrough.
+        texts (list[str] | None): values to type in text inputs.
+        exhaustive (bool): if True, plays every sequence of choices (up to
+            `max_steps`) instead of random playthroughs.
+
+    Returns:
+        SimulationStats: merged statistics of all playthroughs.
+    """
+    texts = texts if texts else DEFAULT_TEXT_INPUTS
+    stats = SimulationStats()
+    with ProcessPoolExecutor(workers) as pool:
+        if exhaustive:
+            # one task per first choice
+            entry = load_entry(src_dir, entry_point)
+            first_stats, branching = explore(entry, [], max_steps, texts)
+            if branching == 0:
+                stats.merge(first_stats)
+            futures = [
+                pool.submit(
+                    exhaustive_runs, src_dir, entry_point, prefix, max_steps, texts
+                )
+                for prefix in ([index] for index in range(branching))
+            ]
+        else:
+            futures = [
+                pool.submit(random_runs, src_dir, entry_point, seeds, max_steps, texts)
+                for seeds in chunks(range(seed, seed + runs), workers or os.cpu_count())
+            ]
+        for future in futures:
+            stats.merge(future.result())
+    return stats
+
+
+def replay_trace(
+    src_dir: Path,
+    entry_point: str,
+    trace: "tr.Trace",
+    repeat: int = 1,
+) -> tuple[SimulationStats, gm.GameImpl]:
+    """Replays a trace recorded in the page `repeat` times, on the headless backend.
+
+    Returns:
+        tuple[SimulationStats, GameImpl]: statistics of the replays (with passage
+            execution times), and the game rebuilt by the trace.
+    """
+    state_cls, _ = load_entry(src_dir, entry_point)
+    # the entry point runs as the __main__ module in the page
+    aliases = {"__main__": entry_module(entry_point)}
+    stats = SimulationStats()
+    for _ in range(repeat):
+        be.use_backend("headless")
+        tr.recorder.trace = None
+        game = SimulatedGame(state_cls())
+        game.stats = stats
+        stats.runs += 1
+        tr.replay(trace, game, aliases=aliases)
+    # plain game, that can be exported
+    be.use_backend("headless")
+    rebuilt = gm.GameImpl(state_cls())
+    tr.replay(trace, rebuilt, aliases=aliases)
+    return stats, rebuilt
+
+
+def rename_module(tree: Any, module: str, alias: str) -> Any:
+    """Renames module `module` to `alias` in the import paths of an encoded save (see
+    `troubadour.save.CompactCodec`): paths of classes and functions pickled by
+    jsonpickle (module.qualname), of the class of the game and of passages given to
+    buttons (module:qualname)."""
+    if isinstance(tree, str):
+        for separator in ".:":
+            if tree.startswith(module + separator):
+                return alias + tree[len(module) :]
+        return tree
+    if isinstance(tree, dict):
+        return {
+            key: (
+                rename_module(value, module, alias)
+                if key in PATH_TAGS or key == "cls" or not isinstance(value, str)
+                else value
+            )
+            for key, value in tree.items()
+        }
+    if isinstance(tree, list):
+        match tree:
+            case ["b", txt, ref, *rest]:
+                tree = ["b", txt, rename_module(ref, module, alias), *rest]
+            case ["tb", txt, ref, value_kw, kwargs, convertor, target]:
+                tree = [
+                    "tb",
+                    txt,
+                    rename_module(ref, module, alias),
+                    value_kw,
+                    kwargs,
+                    rename_module(convertor, module, alias),
+                    target,
+                ]
+        return [
+            item if isinstance(item, str) else rename_module(item, module, alias)
+            for item in tree
+        ]
+    return tree
+
+
+def export_replay(game: gm.GameImpl, entry_point: str) -> str:
+    """Encodes `game`, rebuilt by `replay_trace`, as an exported save of the page: the
+    classes and passages of the entry module are pickled under its name, but the page
+    runs it as __main__."""
+    tree = json.loads(sv.export_codec.encode(game))
+    tree = rename_module(tree, entry_module(entry_point), "__main__")
+    return json.dumps(tree, separators=(",", ":"))
+
+
+def chunks(seeds: range, nb_workers: int | None) -> Iterator[range]:
+    "Splits `seeds` in chunks, a few per worker so that the load is balanced."
+    size = max(1, len(seeds) // ((nb_workers or 1) * 4))
+    for start in range(0, len(seeds), size):
+        yield seeds[start : start + size]
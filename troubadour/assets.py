@@ -0,0 +1,23 @@
+"""Lookup of the assets of the game (images, stylesheets). `troubadour build` writes
+them with a hash of their content in their file name, and embeds the mapping from
+their source path to their url in the page."""
+
+import json
+
+import troubadour.backend as be
+
+ASSETS_META = "troubadour-assets"
+"Meta tag holding the asset manifest of the build."
+
+_manifest: tuple[str | None, dict[str, str]] = (None, {})
+"Last asset manifest read, with the content of the meta tag it was read from."
+
+
+def asset_url(path: str) -> str:
+    """Returns the url of asset `path` (relative to the source folder of the game).
+    Paths that are not assets of the build (e.g., external urls) are returned as is."""
+    global _manifest  # pylint: disable=W0603
+    raw = be.get_meta(ASSETS_META)
+    if raw != _manifest[0]:
+        _manifest = (raw, json.loads(raw) if raw else {})
+    return _manifest[1].get(path, path)
@@ -1,20 +1,76 @@
-"Module that provides many functions to interact with the web page."
+"""Module that provides many functions to interact with the web page.
 
+The functions forward to the active backend: the pyscript backend in the browser, and
+an in-memory headless backend elsewhere. The backend can be forced with the
+`TROUBADOUR_BACKEND` environment variable ("browser" or "headless") or changed at
+run time with `use_backend`."""
+
+import os
+import sys
 from typing import Any, Callable, Generic, Optional, Type, TypeVar
 
-import js  # type: ignore
 import jsonpickle as jsp
-import pyscript
-from pyodide.code import run_js  # type: ignore
-from pyodide.ffi import create_proxy  # type: ignore
-from pyscript import Element  # pylint: disable=E0611 # type: ignore
 
-from troubadour.definitions import Eid
+from troubadour.definitions import Backend, Eid
+
+
+def make_backend(name: str) -> Backend:
+    """Instantiates a backend from its name.
+
+    Args:
+        name (str): "browser" or "headless".
+
+    Returns:
+        Backend: a new backend.
+    """
+    if name == "browser":
+        from troubadour.backends.browser import (  # pylint: disable=C0415
+            BrowserBackend,
+        )
+
+        return BrowserBackend()
+    if name == "headless":
+        from troubadour.backends.headless import (  # pylint: disable=C0415
+            HeadlessBackend,
+        )
+
+        return HeadlessBackend()
+    raise ValueError(f"Unknown backend {name!r}")
+
+
+def default_backend_name() -> str:
+    "Name of the backend to use when none is specified."
+    if "TROUBADOUR_BACKEND" in os.environ:
+        return os.environ["TROUBADOUR_BACKEND"]
+    return "browser" if sys.platform == "emscripten" else "headless"
+
+
+_backend: Backend = make_backend(default_backend_name())
+"Active backend."
+
+
+def use_backend(backend: Backend | str) -> Backend:
+    """Changes the active backend.
+
+    Args:
+        backend (Backend | str): backend object or name of the backend.
+
+    Returns:
+        Backend: the new active backend.
+    """
+    global _backend  # pylint: disable=W0603
+    _backend = make_backend(backend) if isinstance(backend, str) else backend
+    return _backend
+
+
+def get_backend() -> Backend:
+    "Returns the active backend."
+    return _backend
 
 
 def pyscript_version() -> str:
     "Returns the version of pyscript currently running."
-    return pyscript.__version__
+    return _backend.version()
 
 
 def onclick(eid: Eid, func: Callable[[Any], None]) -> None:
@@ -24,27 +80,40 @@ def onclick(eid: Eid, func: Callable[[Any], None]) -> None:
         id (str): html id of element.
         func (Callable[[Any], None]): callback.
     """
-    Element(eid).element.addEventListener("click", create_proxy(func))
+    _backend.add_listener(eid, "click", func)
+
+
+def delegate(eid: Eid, event: str, func: Callable[[Eid, Any], None]) -> None:
+    """Add a single callback to element for events happening on any of its
+    descendants.
+
+    Args:
+        eid (Eid): html id of the ancestor element.
+        event (str): name of the event.
+        func (Callable[[Eid, Any], None]): callback, receives the id of the closest
+            element with an id around the event target, and the event.
+    """
+    _backend.delegate(eid, event, func)
 
 
 def onload(eid: Eid, func: Callable[[Any], None]) -> None:
-    Element(eid).element.addEventListener("load", create_proxy(func))
+    _backend.add_listener(eid, "load", func)
 
 
 def insert_end(eid: Eid, html: str) -> None:
-    Element(eid).element.insertAdjacentHTML("beforeend", html)
+    _backend.insert_end(eid, html)
 
 
 def set_html(eid: Eid, html: str) -> None:
-    Element(eid).element.innerHTML = html
+    _backend.set_html(eid, html)
 
 
 def get_html(eid: Eid) -> str:
-    return Element(eid).element.innerHTML
+    return _backend.get_html(eid)
 
 
 def remove(eid: Eid) -> None:
-    Element(eid).element.remove()
+    _backend.remove(eid)
 
 
 def clear(eid: Eid) -> None:
@@ -52,53 +121,98 @@ def clear(eid: Eid) -> None:
 
 
 def click(eid: Eid) -> None:
-    Element(eid).element.click()
+    _backend.click(eid)
 
 
 def set_src(eid: Eid, value: str) -> None:
-    Element(eid).element.src = value
+    _backend.set_attribute(eid, "src", value)
 
 
 def set_alt(eid: Eid, value: str) -> None:
-    Element(eid).element.alt = value
+    _backend.set_attribute(eid, "alt", value)
 
 
 def get_value(eid: Eid) -> str:
-    return Element(eid).element.value
+    return _backend.get_value(eid)
+
+
+def set_value(eid: Eid, value: str) -> None:
+    _backend.set_value(eid, value)
 
 
 def add_class(eid: Eid, cls: str) -> None:
-    Element(eid).add_class(cls)
+    _backend.add_class(eid, cls)
 
 
 def remove_class(eid: Eid, cls: str) -> None:
-    Element(eid).remove_class(cls)
+    _backend.remove_class(eid, cls)
 
 
 def set_display(eid: Eid, display: str) -> None:
-    Element(eid).element.style.display = display
+    _backend.set_display(eid, display)
 
 
 def disable(eid: Eid) -> None:
-    Element(eid).element.disabled = "disabled"
+    _backend.set_attribute(eid, "disabled", "disabled")
 
 
 def enable(eid: Eid) -> None:
-    Element(eid).element.disabled = None
+    _backend.set_attribute(eid, "disabled", None)
+
+
+def get_meta(name: str) -> Optional[str]:
+    "Returns the content of the meta tag `name` of the page, if any."
+    return _backend.get_meta(name)
 
 
 def scroll_to_bottom(eid: Eid) -> None:
-    tgt = Element(eid).element
-    tgt.scrollTop = tgt.scrollHeight
+    _backend.scroll_to_bottom(eid)
 
 
 def scroll_into_view(eid: Eid) -> None:
-    tgt = Element(eid).element
-    tgt.scrollIntoView(behavior="smooth")
+    _backend.scroll_into_view(eid)
 
 
 def refresh_page() -> None:
-    run_js("location.reload();")
+    _backend.refresh_page()
+
+
+def set_timeout(delay: int, func: Callable[[], None]) -> None:
+    """Calls `func` once after `delay` milliseconds, outside of the current event
+    handler."""
+    _backend.set_timeout(delay, func)
+
+
+def on_page_hide(func: Callable[[], None]) -> None:
+    "Calls `func` when the page is hidden or about to be unloaded."
+    _backend.on_page_hide(func)
+
+
+def fetch_text(url: str) -> str:
+    "Downloads the text file at `url` (blocks until it is received)."
+    return _backend.fetch_text(url)
+
+
+def fetch_text_async(url: str, func: Callable[[str], None]) -> None:
+    "Downloads the text file at `url` in the background, then calls `func` with it."
+    _backend.fetch_text_async(url, func)
+
+
+def on_server_event(url: str, func: Callable[[str], None]) -> None:
+    "Calls `func` with the data of each event sent by the server on stream `url`."
+    _backend.on_server_event(url, func)
+
+
+def console_log(message: str) -> None:
+    _backend.console_log(message)
+
+
+def performance_mark(name: str) -> None:
+    _backend.performance_mark(name)
+
+
+def performance_measure(name: str, start: str, end: str) -> None:
+    _backend.performance_measure(name, start, end)
 
 
 T = TypeVar("T")
@@ -109,16 +223,20 @@ class LocalStorage:
     square brackets)."""
 
     def __getitem__(self, key: str) -> Optional[str]:
-        return js.localStorage.getItem(key)
+        return _backend.storage_get(key)
 
     def __setitem__(self, key: str, value: Any) -> None:
-        js.localStorage.setItem(key, jsp.encode(value))
+        _backend.storage_set(key, jsp.encode(value))
+
+    def set_raw(self, key: str, value: str) -> None:
+        "Stores string `value` as is (without encoding it)."
+        _backend.storage_set(key, value)
 
     def has_key(self, key: str) -> bool:
         return self[key] is not None
 
     def remove(self, key: str) -> None:
-        js.localStorage.removeItem(key)
+        _backend.storage_remove(key)
 
     def __call__(self, cls: Type[T]) -> "TypedLocalStorage[T]":
         """Helper interface to provided typed access to local storage. Usage is
@@ -140,7 +258,7 @@ class TypedLocalStorage(Generic[T]):
         self.cls = cls
 
     def __getitem__(self, key: str) -> T:
-        result = js.localStorage.getItem(key)
+        result = _backend.storage_get(key)
         if result is not None:
             decoded_result = jsp.decode(result)
             assert isinstance(decoded_result, self.cls)
@@ -153,17 +271,9 @@ local_storage = LocalStorage()
 "Global local storage object."
 
 
-def file_download_button(eid: Eid, content: str, filename: str) -> None:
-    run_js(
-        f"""
-const blob = new Blob(
-    [`{content.encode("unicode_escape").decode("utf-8")}`], {{type: 'text/json'}});
-const button = document.getElementById("{eid}");
-button.href = URL.createObjectURL(blob);
-button.download = "{filename}";
-        """
-    )
-    # FIXME revoke url
+def download(content: str, filename: str) -> None:
+    "Makes the browser download a file named `filename` with content `content`."
+    _backend.download(content, filename)
 
 
 def on_file_upload(
@@ -171,16 +281,12 @@ def on_file_upload(
     callback: Callable[[str], None] | Callable[[T], None],
     cls: Optional[Type[T]] = None,
 ) -> None:
-    async def event_handler(event: Any, callback: Callable = callback) -> None:
-        file_list = event.target.files.to_py()
-        for file in file_list:
-            raw = await file.text()
-            if cls is None:
-                callback(raw)
-            else:
-                decoded = jsp.decode(raw)
-                assert isinstance(decoded, cls)
-                callback(decoded)
-        Element(eid).element.value = ""
-
-    Element(eid).element.addEventListener("change", create_proxy(event_handler))
+    def raw_callback(raw: str, callback: Callable = callback) -> None:
+        if cls is None:
+            callback(raw)
+        else:
+            decoded = jsp.decode(raw)
+            assert isinstance(decoded, cls)
+            callback(decoded)
+
+    _backend.on_file_upload(eid, raw_callback)
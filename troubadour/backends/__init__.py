@@ -0,0 +1 @@
+"Implementations of the `troubadour.definitions.Backend` interface."
@@ -0,0 +1,157 @@
+"Backend that interacts with the actual web page through pyscript and pyodide."
+
+from typing import Any, Callable
+
+import asyncio
+
+import js  # type: ignore
+import pyscript
+from pyodide.code import run_js  # type: ignore
+from pyodide.ffi import create_once_callable, create_proxy, to_js  # type: ignore
+from pyodide.http import open_url, pyfetch  # type: ignore
+from pyscript import Element  # pylint: disable=E0611 # type: ignore
+
+from troubadour.definitions import Backend, Eid
+
+DOWNLOAD_URL_LIFETIME = 60_000
+"Time (in milliseconds) after which the object url of a download is revoked."
+
+
+class BrowserBackend(Backend):
+    "Backend for the pyscript runtime, in the browser."
+
+    def __init__(self) -> None:
+        self._metas: dict[str, str | None] = {}
+
+    def version(self) -> str:
+        return pyscript.__version__
+
+    def add_listener(self, eid: Eid, event: str, func: Callable[[Any], None]) -> None:
+        Element(eid).element.addEventListener(event, create_proxy(func))
+
+    def delegate(self, eid: Eid, event: str, func: Callable[[Eid, Any], None]) -> None:
+        def handler(evt: Any) -> None:
+            target = evt.target.closest("[id]")
+            if target is not None:
+                func(Eid(target.id), evt)
+
+        # capture is needed for events that do not bubble (e.g., load)
+        Element(eid).element.addEventListener(event, create_proxy(handler), True)
+
+    def insert_end(self, eid: Eid, html: str) -> None:
+        Element(eid).element.insertAdjacentHTML("beforeend", html)
+
+    def set_html(self, eid: Eid, html: str) -> None:
+        Element(eid).element.innerHTML = html
+
+    def get_html(self, eid: Eid) -> str:
+        return Element(eid).element.innerHTML
+
+    def remove(self, eid: Eid) -> None:
+        Element(eid).element.remove()
+
+    def click(self, eid: Eid) -> None:
+        Element(eid).element.click()
+
+    def set_attribute(self, eid: Eid, name: str, value: str | None) -> None:
+        if value is None:
+            Element(eid).element.removeAttribute(name)
+        else:
+            Element(eid).element.setAttribute(name, value)
+
+    def get_value(self, eid: Eid) -> str:
+        return Element(eid).element.value
+
+    def set_value(self, eid: Eid, value: str) -> None:
+        Element(eid).element.value = value
+
+    def add_class(self, eid: Eid, cls: str) -> None:
+        Element(eid).add_class(cls)
+
+    def remove_class(self, eid: Eid, cls: str) -> None:
+        Element(eid).remove_class(cls)
+
+    def set_display(self, eid: Eid, display: str) -> None:
+        Element(eid).element.style.display = display
+
+    def scroll_to_bottom(self, eid: Eid) -> None:
+        tgt = Element(eid).element
+        tgt.scrollTop = tgt.scrollHeight
+
+    def scroll_into_view(self, eid: Eid) -> None:
+        tgt = Element(eid).element
+        tgt.scrollIntoView(behavior="smooth")
+
+    def get_meta(self, name: str) -> str | None:
+        # meta tags do not change once the page is loaded
+        if name not in self._metas:
+            meta = js.document.querySelector(f"meta[name='{name}']")
+            self._metas[name] = meta.content if meta is not None else None
+        return self._metas[name]
+
+    def refresh_page(self) -> None:
+        run_js("location.reload();")
+
+    def set_timeout(self, delay: int, func: Callable[[], None]) -> None:
+        js.setTimeout(create_once_callable(func), delay)
+
+    def on_page_hide(self, func: Callable[[], None]) -> None:
+        def on_visibility_change(_: Any) -> None:
+            if js.document.visibilityState == "hidden":
+                func()
+
+        js.window.addEventListener("beforeunload", create_proxy(lambda _: func()))
+        js.document.addEventListener(
+            "visibilitychange", create_proxy(on_visibility_change)
+        )
+
+    def storage_get(self, key: str) -> str | None:
+        return js.localStorage.getItem(key)
+
+    def storage_set(self, key: str, value: str) -> None:
+        js.localStorage.setItem(key, value)
+
+    def storage_remove(self, key: str) -> None:
+        js.localStorage.removeItem(key)
+
+    def download(self, content: str, filename: str) -> None:
+        blob = js.Blob.new(to_js([content]), to_js({"type": "text/json"}))
+        url = js.URL.createObjectURL(blob)
+        link = js.document.createElement("a")
+        link.href = url
+        link.download = filename
+        link.click()
+        # revoking the url right away can cancel the download (Firefox, Safari)
+        self.set_timeout(DOWNLOAD_URL_LIFETIME, lambda: js.URL.revokeObjectURL(url))
+
+    def on_file_upload(self, eid: Eid, callback: Callable[[str], None]) -> None:
+        async def event_handler(event: Any) -> None:
+            file_list = event.target.files.to_py()
+            for file in file_list:
+                callback(await file.text())
+            Element(eid).element.value = ""
+
+        Element(eid).element.addEventListener("change", create_proxy(event_handler))
+
+    def fetch_text(self, url: str) -> str:
+        return open_url(url).read()
+
+    def fetch_text_async(self, url: str, func: Callable[[str], None]) -> None:
+        async def fetch() -> None:
+            response = await pyfetch(url)
+            func(await response.string())
+
+        asyncio.ensure_future(fetch())
+
+    def on_server_event(self, url: str, func: Callable[[str], None]) -> None:
+        source = js.EventSource.new(url)
+        source.onmessage = create_proxy(lambda event: func(event.data))
+
+    def console_log(self, message: str) -> None:
+        js.console.log(message)
+
+    def performance_mark(self, name: str) -> None:
+        js.performance.mark(name)
+
+    def performance_measure(self, name: str, start: str, end: str) -> None:
+        js.performance.measure(name, start, end)
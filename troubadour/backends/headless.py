@@ -0,0 +1,349 @@
+"""Backend that keeps the page and the storage in memory, so that games can run under
+plain CPython (for tests, benchmarks and tooling)."""
+
+from dataclasses import dataclass, field
+from html.parser import HTMLParser
+from typing import Any, Callable
+
+from troubadour.definitions import Backend, Eid
+
+VOID_ELEMENTS = frozenset(
+    ["area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta"]
+    + ["source", "track", "wbr"]
+)
+"Elements that have no closing tag."
+
+PAGE_SKELETON = """
+<div id="box">
+    <div id="menu">
+        <button id="rewind"> Back </button>
+        <a id="export" href="#"><button>Export</button></a>
+        <label id="import-label">
+            <input id="import" type="file" style="display:none" />
+            <button style="pointer-events: none;">Import</button>
+        </label>
+        <button id="reset"> Reset </button>
+    </div>
+    <div id="output-container">
+        <div id="output"> </div>
+    </div>
+</div>
+<div id="modal-bg" style="display: none;">
+    <div id="modal">
+        <button id="reset-button">Reset</button>
+        <button id="reset-cancel-button">Cancel</button>
+    </div>
+</div>
+"""
+"Elements of the page that troubadour expects (see the main html template)."
+
+
+@dataclass(eq=False)
+class Node:
+    "Element of the in-memory page."
+    tag: str
+    attrs: dict[str, str | None] = field(default_factory=dict)
+    children: list["Node | str"] = field(default_factory=list)
+    parent: "Node | None" = None
+    listeners: dict[str, list[Callable[[Any], None]]] = field(default_factory=dict)
+
+    @property
+    def id(self) -> str | None:  # pylint: disable=C0103
+        return self.attrs.get("id")
+
+    def closest_id(self) -> Eid | None:
+        "Returns the id of the closest element with an id, starting from this one."
+        node: Node | None = self
+        while node is not None:
+            if node.id is not None:
+                return Eid(node.id)
+            node = node.parent
+        return None
+
+    def elements(self) -> list["Node"]:
+        "Returns this node and all its descendant elements, in document order."
+        result = [self]
+        for child in self.children:
+            if isinstance(child, Node):
+                result.extend(child.elements())
+        return result
+
+    def inner_html(self) -> str:
+        return "".join(
+            child.outer_html() if isinstance(child, Node) else child
+            for child in self.children
+        )
+
+    def outer_html(self) -> str:
+        attrs = "".join(
+            f" {key}" if value is None else f' {key}="{value}"'
+            for key, value in self.attrs.items()
+        )
+        if self.tag in VOID_ELEMENTS:
+            return f"<{self.tag}{attrs}>"
+        return f"<{self.tag}{attrs}>{self.inner_html()}</{self.tag}>"
+
+
+@dataclass
+class Event:
+    "Event dispatched in the in-memory page."
+    type: str
+    target: Node
+
+
+class _FragmentParser(HTMLParser):
+    """Parses an html fragment into nodes, closing unclosed elements at the end of
+    the fragment like `insertAdjacentHTML` does."""
+
+    def __init__(self) -> None:
+        super().__init__(convert_charrefs=False)
+        self.root = Node("#fragment")
+        self.stack = [self.root]
+
+    def handle_starttag(self, tag: str, attrs: list[tuple[str, str | None]]) -> None:
+        node = Node(tag, dict(attrs), parent=self.stack[-1])
+        self.stack[-1].children.append(node)
+        if tag not in VOID_ELEMENTS:
+            self.stack.append(node)
+
+    def handle_startendtag(self, tag: str, attrs: list[tuple[str, str | None]]) -> None:
+        node = Node(tag, dict(attrs), parent=self.stack[-1])
+        self.stack[-1].children.append(node)
+
+    def handle_endtag(self, tag: str) -> None:
+        for index in range(len(self.stack) - 1, 0, -1):
+            if self.stack[index].tag == tag:
+                del self.stack[index:]
+                return
+        # end tags without a matching start tag are ignored
+
+    def handle_data(self, data: str) -> None:
+        self.stack[-1].children.append(data)
+
+    def handle_entityref(self, name: str) -> None:
+        self.stack[-1].children.append(f"&{name};")
+
+    def handle_charref(self, name: str) -> None:
+        self.stack[-1].children.append(f"&#{name};")
+
+
+def parse_fragment(html: str) -> list[Node | str]:
+    "Parses an html fragment into a list of nodes and text."
+    parser = _FragmentParser()
+    parser.feed(html)
+    parser.close()
+    return parser.root.children
+
+
+class HeadlessBackend(Backend):
+    """In-memory stand-in for the web page and the browser local storage.
+
+    Args:
+        metas (dict[str, str] | None): content of the meta tags of the page.
+    """
+
+    def __init__(self, metas: dict[str, str] | None = None) -> None:
+        self.document = Node("body")
+        self._index: dict[str, Node] = {}
+        self._append(self.document, parse_fragment(PAGE_SKELETON))
+        self.metas = metas if metas is not None else {}
+        self.storage: dict[str, str] = {}
+        self.downloads: dict[str, str] = {}
+        "Content of the downloaded files, by filename."
+        self.uploads: dict[Eid, Callable[[str], None]] = {}
+        "Callbacks of the file upload inputs, by element id."
+        self.timers: list[Callable[[], None]] = []
+        "Callbacks waiting for their timeout, see `run_timers`."
+        self.page_hide_callbacks: list[Callable[[], None]] = []
+        self.served: dict[str, str] = {}
+        "Content of the files that can be fetched, by url (see also `run_timers`)."
+        self.server_events: dict[str, list[Callable[[str], None]]] = {}
+        "Callbacks of the server event streams, by url, see `send_server_event`."
+        self.console: list[str] = []
+        "Messages logged to the console."
+        self.performance: list[tuple[str, ...]] = []
+        "Performance marks (name,) and measures (name, start mark, end mark)."
+        self.scrolled_to: Eid | None = None
+        "Last element scrolled into view."
+        self.nb_refresh = 0
+
+    # -~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~
+    def element(self, eid: Eid) -> Node:
+        "Returns the element with id `eid`, raises KeyError if there is none."
+        return self._index[eid]
+
+    def has_element(self, eid: Eid) -> bool:
+        return eid in self._index
+
+    def find_all(self, tag: str, root: Eid = Eid("output")) -> list[Node]:
+        "Returns all elements with tag `tag` inside element `root`."
+        return [node for node in self.element(root).elements() if node.tag == tag]
+
+    def dispatch(self, eid: Eid, event: str) -> None:
+        """Dispatches `event` on element `eid`. Listeners of the ancestors are called
+        first, then those of the element itself. Disabled elements get no event."""
+        target = self.element(eid)
+        if "disabled" in target.attrs:
+            return
+        path = []
+        node: Node | None = target
+        while node is not None:
+            path.append(node)
+            node = node.parent
+        evt = Event(event, target)
+        for node in reversed(path):
+            for listener in list(node.listeners.get(event, [])):
+                listener(evt)
+
+    def run_timers(self) -> None:
+        "Calls all the callbacks waiting for a timeout, as if time had passed."
+        while self.timers:
+            self.timers.pop(0)()
+
+    def hide_page(self) -> None:
+        "Simulates the page being hidden."
+        for func in self.page_hide_callbacks:
+            func()
+
+    def upload(self, eid: Eid, content: str) -> None:
+        "Simulates the upload of a file with content `content` to input `eid`."
+        self.uploads[eid](content)
+
+    def send_server_event(self, url: str, data: str) -> None:
+        "Simulates the server sending an event with `data` on stream `url`."
+        for func in self.server_events.get(url, []):
+            func(data)
+
+    def _append(self, parent: Node, nodes: list[Node | str]) -> None:
+        for node in nodes:
+            if isinstance(node, Node):
+                node.parent = parent
+                for element in node.elements():
+                    if element.id is not None:
+                        self._index[element.id] = element
+        parent.children.extend(nodes)
+
+    def _unindex(self, node: Node) -> None:
+        for element in node.elements():
+            if element.id is not None and self._index.get(element.id) is element:
+                del self._index[element.id]
+
+    # -~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~=~-~
+    def version(self) -> str:
+        return "headless"
+
+    def add_listener(self, eid: Eid, event: str, func: Callable[[Any], None]) -> None:
+        self.element(eid).listeners.setdefault(event, []).append(func)
+
+    def delegate(self, eid: Eid, event: str, func: Callable[[Eid, Any], None]) -> None:
+        def handler(evt: Event) -> None:
+            target = evt.target.closest_id()
+            if target is not None:
+                func(target, evt)
+
+        self.add_listener(eid, event, handler)
+
+    def insert_end(self, eid: Eid, html: str) -> None:
+        self._append(self.element(eid), parse_fragment(html))
+
+    def set_html(self, eid: Eid, html: str) -> None:
+        node = self.element(eid)
+        for child in node.children:
+            if isinstance(child, Node):
+                self._unindex(child)
+        node.children = []
+        self._append(node, parse_fragment(html))
+
+    def get_html(self, eid: Eid) -> str:
+        return self.element(eid).inner_html()
+
+    def remove(self, eid: Eid) -> None:
+        node = self.element(eid)
+        self._unindex(node)
+        if node.parent is not None:
+            node.parent.children.remove(node)
+            node.parent = None
+
+    def click(self, eid: Eid) -> None:
+        self.dispatch(eid, "click")
+
+    def set_attribute(self, eid: Eid, name: str, value: str | None) -> None:
+        attrs = self.element(eid).attrs
+        if value is None:
+            attrs.pop(name, None)
+        else:
+            attrs[name] = value
+
+    def get_value(self, eid: Eid) -> str:
+        return self.element(eid).attrs.get("value") or ""
+
+    def set_value(self, eid: Eid, value: str) -> None:
+        self.element(eid).attrs["value"] = value
+
+    def add_class(self, eid: Eid, cls: str) -> None:
+        attrs = self.element(eid).attrs
+        classes = (attrs.get("class") or "").split()
+        if cls not in classes:
+            attrs["class"] = " ".join(classes + [cls])
+
+    def remove_class(self, eid: Eid, cls: str) -> None:
+        attrs = self.element(eid).attrs
+        classes = (attrs.get("class") or "").split()
+        attrs["class"] = " ".join(c for c in classes if c != cls)
+
+    def set_display(self, eid: Eid, display: str) -> None:
+        self.element(eid).attrs["style"] = f"display: {display};"
+
+    def scroll_to_bottom(self, eid: Eid) -> None:
+        self.element(eid)  # checks that the element exists
+
+    def scroll_into_view(self, eid: Eid) -> None:
+        self.element(eid)
+        self.scrolled_to = eid
+
+    def get_meta(self, name: str) -> str | None:
+        return self.metas.get(name)
+
+    def refresh_page(self) -> None:
+        self.nb_refresh += 1
+
+    def set_timeout(self, delay: int, func: Callable[[], None]) -> None:
+        self.timers.append(func)
+
+    def on_page_hide(self, func: Callable[[], None]) -> None:
+        self.page_hide_callbacks.append(func)
+
+    def storage_get(self, key: str) -> str | None:
+        return self.storage.get(key)
+
+    def storage_set(self, key: str, value: str) -> None:
+        self.storage[key] = value
+
+    def storage_remove(self, key: str) -> None:
+        self.storage.pop(key, None)
+
+    def download(self, content: str, filename: str) -> None:
+        self.downloads[filename] = content
+
+    def on_file_upload(self, eid: Eid, callback: Callable[[str], None]) -> None:
+        self.element(eid)
+        self.uploads[eid] = callback
+
+    def fetch_text(self, url: str) -> str:
+        return self.served[url]
+
+    def fetch_text_async(self, url: str, func: Callable[[str], None]) -> None:
+        # received when the timers run
+        self.timers.append(lambda: func(self.served[url]))
+
+    def on_server_event(self, url: str, func: Callable[[str], None]) -> None:
+        self.server_events.setdefault(url, []).append(func)
+
+    def console_log(self, message: str) -> None:
+        self.console.append(message)
+
+    def performance_mark(self, name: str) -> None:
+        self.performance.append((name,))
+
+    def performance_measure(self, name: str, start: str, end: str) -> None:
+        self.performance.append((name, start, end))
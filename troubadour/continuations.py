@@ -4,62 +4,67 @@ from dataclasses import dataclass, field
 from typing import Any, Callable
 
 import troubadour.backend as be
-from troubadour.definitions import Game, Continuation, Eid
-from troubadour.unique_id import get_unique_element_id
+from troubadour.definitions import ClickHandlers, Continuation, Eid, Game
 
 
 @dataclass
 class Button(Continuation):
     txt: str
-    passage: Callable
+    passage: Callable | str
+    "Passage, or its name (id or module:qualname) to load it on first use."
     kwargs: dict[str, object] = field(default_factory=dict)
     dialog: bool = False
 
-    def setup(
-        self, game: Game, target: Eid = Eid("output"), disabled: bool = False
-    ) -> None:
-        button_id = get_unique_element_id("button")
-        be.insert_end(
-            target, f"<button type='button' id='{button_id}'>{self.txt}</button>"
+    def render(
+        self, game: Game, base_id: Eid, disabled: bool = False
+    ) -> tuple[str, ClickHandlers, list[Eid]]:
+        if disabled:
+            return f"<button type='button' disabled>{self.txt}</button>", {}, []
+
+        button_id = Eid(f"{base_id}__button")
+        html = f"<button type='button' id='{button_id}'>{self.txt}</button>"
+        return (
+            html,
+            {button_id: lambda _: game.run_passage(self.passage, kwargs=self.kwargs)},
+            [button_id],
         )
-        if not disabled:
-            be.onclick(
-                button_id,
-                lambda _: game.run_passage(self.passage, kwargs=self.kwargs),
-            )
-        else:
-            be.disable(button_id)
 
 
 @dataclass
 class TextButton(Continuation):
     txt: str
-    passage: Callable
+    passage: Callable | str
+    "Passage, or its name (id or module:qualname) to load it on first use."
     value_kw: str
     kwargs: dict[str, object] = field(default_factory=dict)
-    convertor: Callable[[Any], str] = str
+    convertor: Callable[[str], Any] = str
+    "Converts the typed text to the value passed as `value_kw`."
+
+    def render(
+        self, game: Game, base_id: Eid, disabled: bool = False
+    ) -> tuple[str, ClickHandlers, list[Eid]]:
+        if disabled:
+            return (
+                (
+                    "<input type='text' disabled></input>"
+                    "<button class='textbutton' type='button' disabled>"
+                    f"{self.txt}</button>"
+                ),
+                {},
+                [],
+            )
 
-    def setup(
-        self, game: Game, target: Eid = Eid("output"), disabled: bool = False
-    ) -> None:
-        text_id = get_unique_element_id("textinput")
-        button_id = get_unique_element_id("button")
-        be.insert_end(target, f"<input type='text' id='{text_id}'></input>")
-        be.insert_end(
-            target,
-            (
-                "<button class='textbutton' type='button' "
-                f"id='{button_id}'>{self.txt}</button>"
-            ),
+        text_id = Eid(f"{base_id}__textinput")
+        button_id = Eid(f"{base_id}__button")
+        html = (
+            f"<input type='text' id='{text_id}'></input>"
+            "<button class='textbutton' type='button' "
+            f"id='{button_id}'>{self.txt}</button>"
         )
-        if not disabled:
 
-            def callback(_):
-                value = self.convertor(be.get_value(text_id))
-                full_kwargs = {self.value_kw: value, **self.kwargs}
-                game.run_passage(self.passage, kwargs=full_kwargs)
+        def callback(_):
+            value = self.convertor(be.get_value(text_id))
+            full_kwargs = {self.value_kw: value, **self.kwargs}
+            game.run_passage(self.passage, kwargs=full_kwargs)
 
-            be.onclick(button_id, callback)
-        else:
-            be.disable(button_id)
-            be.disable(text_id)
+        return html, {button_id: callback}, [text_id, button_id]
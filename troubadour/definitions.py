@@ -1,6 +1,14 @@
 "Global protocol and interface definitions."
 
-from typing import Callable, Generic, NewType, Protocol, TypeVar, runtime_checkable
+from typing import (
+    Any,
+    Callable,
+    Generic,
+    NewType,
+    Protocol,
+    TypeVar,
+    runtime_checkable,
+)
 
 Eid = NewType("Eid", str)
 "Id of an element on the page (typically, a HTML tag)."
@@ -11,15 +19,23 @@ Lid = NewType("Lid", int)
 Target = Lid | None
 
 
+ClickHandlers = dict[Eid, Callable[[Any], None]]
+"Click callbacks to attach to elements, by element id."
+
+
 class Continuation(Protocol):
     "Inputs are user interface elements"
 
-    def setup(
+    def render(
         self,
         game: "Game",
-        target: "Eid" = Eid("output"),
+        base_id: Eid,
         disabled: bool = False,
-    ) -> None:
+    ) -> tuple[str, ClickHandlers, list[Eid]]:
+        """Returns the html of the continuation along with the click callbacks to
+        attach once the html is in the page and the ids of the elements to disable
+        once the passage is over. Element ids should be derived from `base_id` which
+        is unique to the continuation."""
         ...
 
 
@@ -36,6 +52,7 @@ class Output(Protocol):
         ...
 
     def img(self, src: str = "") -> None:
+        "Adds an image, `src` is an url or the path of an asset of the game."
         ...
 
     def continuation(self, continuation: Continuation) -> None:
@@ -57,8 +74,119 @@ class Game(Output, Protocol, Generic[T]):
 
     def run_passage(
         self,
-        passage: Callable,
+        passage: Callable | str,
         *,
         kwargs: dict[str, object] | None = None,
     ) -> None:
         ...
+
+    def rewind(self, steps: int = 1) -> None:
+        "Goes back `steps` passages, restoring the state the game had then."
+        ...
+
+
+class Backend(Protocol):
+    """Low-level interface to the page and to the browser storage. The functions of
+    `troubadour.backend` forward to the active backend."""
+
+    def version(self) -> str:
+        ...
+
+    def add_listener(self, eid: Eid, event: str, func: Callable[[Any], None]) -> None:
+        ...
+
+    def delegate(self, eid: Eid, event: str, func: Callable[[Eid, Any], None]) -> None:
+        ...
+
+    def insert_end(self, eid: Eid, html: str) -> None:
+        ...
+
+    def set_html(self, eid: Eid, html: str) -> None:
+        ...
+
+    def get_html(self, eid: Eid) -> str:
+        ...
+
+    def remove(self, eid: Eid) -> None:
+        ...
+
+    def click(self, eid: Eid) -> None:
+        ...
+
+    def set_attribute(self, eid: Eid, name: str, value: str | None) -> None:
+        "Sets (or removes if `value` is None) an attribute of an element."
+        ...
+
+    def get_value(self, eid: Eid) -> str:
+        ...
+
+    def set_value(self, eid: Eid, value: str) -> None:
+        ...
+
+    def add_class(self, eid: Eid, cls: str) -> None:
+        ...
+
+    def remove_class(self, eid: Eid, cls: str) -> None:
+        ...
+
+    def set_display(self, eid: Eid, display: str) -> None:
+        ...
+
+    def scroll_to_bottom(self, eid: Eid) -> None:
+        ...
+
+    def scroll_into_view(self, eid: Eid) -> None:
+        ...
+
+    def get_meta(self, name: str) -> str | None:
+        ...
+
+    def refresh_page(self) -> None:
+        ...
+
+    def set_timeout(self, delay: int, func: Callable[[], None]) -> None:
+        "Calls `func` once, after `delay` milliseconds, outside of the current task."
+        ...
+
+    def on_page_hide(self, func: Callable[[], None]) -> None:
+        "Calls `func` when the page is hidden or about to be unloaded."
+        ...
+
+    def storage_get(self, key: str) -> str | None:
+        ...
+
+    def storage_set(self, key: str, value: str) -> None:
+        ...
+
+    def storage_remove(self, key: str) -> None:
+        ...
+
+    def download(self, content: str, filename: str) -> None:
+        "Makes the browser download a file with content `content`."
+        ...
+
+    def on_file_upload(self, eid: Eid, callback: Callable[[str], None]) -> None:
+        ...
+
+    def fetch_text(self, url: str) -> str:
+        "Downloads the text file at `url` (blocks until it is received)."
+        ...
+
+    def fetch_text_async(self, url: str, func: Callable[[str], None]) -> None:
+        "Downloads the text file at `url` in the background, then calls `func` with it."
+        ...
+
+    def on_server_event(self, url: str, func: Callable[[str], None]) -> None:
+        "Calls `func` with the data of each event sent by the server on stream `url`."
+        ...
+
+    def console_log(self, message: str) -> None:
+        ...
+
+    def performance_mark(self, name: str) -> None:
+        "Adds a mark named `name` to the performance timeline."
+        ...
+
+    def performance_measure(self, name: str, start: str, end: str) -> None:
+        "Adds a measure named `name` between marks `start` and `end` to the timeline."
+        ...
@@ -0,0 +1,56 @@
+"Delegated event handling for the elements inside the game output."
+
+from dataclasses import dataclass, field
+from typing import Any, Callable
+
+import troubadour.backend as be
+from troubadour.definitions import Backend, Eid
+
+
+@dataclass
+class EventRegistry:
+    """Routes events happening on the elements inside a root element to python
+    callbacks, through a registry keyed by element id. A single listener is attached
+    to the root element for each type of event, so no javascript proxy is created
+    per element and no proxy is leaked when elements are removed."""
+
+    root: Eid = Eid("output")
+    _handlers: dict[str, dict[Eid, Callable[[Any], None]]] = field(default_factory=dict)
+    _backend: Backend | None = None
+    "Backend in which the listeners are attached."
+
+    def register(self, event: str, eid: Eid, handler: Callable[[Any], None]) -> None:
+        """Calls `handler` every time `event` happens on element `eid`.
+
+        Args:
+            event (str): name of the event (e.g., "click").
+            eid (Eid): id of an element inside the root element.
+            handler (Callable[[Any], None]): callback, receives the event.
+        """
+        if be.get_backend() is not self._backend:  # the page has changed
+            self._handlers = {}
+            self._backend = be.get_backend()
+        if event not in self._handlers:
+            self._handlers[event] = {}
+            be.delegate(
+                self.root, event, lambda eid, evt: self.dispatch(event, eid, evt)
+            )
+        self._handlers[event][eid] = handler
+
+    def unregister(self, eid: Eid) -> None:
+        "Removes all the callbacks of element `eid`, if any."
+        for handlers in self._handlers.values():
+            handlers.pop(eid, None)
+
+    def dispatch(self, event: str, eid: Eid, evt: Any) -> None:
+        handler = self._handlers.get(event, {}).get(eid)
+        if handler is not None:
+            handler(evt)
+
+    def __len__(self) -> int:
+        "Number of live callbacks."
+        return sum(len(handlers) for handlers in self._handlers.values())
+
+
+output_events = EventRegistry()
+"Global registry for the events of the game output."
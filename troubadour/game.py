@@ -1,13 +1,43 @@
 "Main troubadour module that implements the Game class."
 
 import datetime
+import sys
 from dataclasses import dataclass, field
 from typing import Callable, TypeVar
 
 import troubadour.backend as be
+import troubadour.instrumentation as ins
+import troubadour.lazy as lz
+import troubadour.prerender as pr
 import troubadour.save as sv
-from troubadour.definitions import Continuation, Eid, Game, Lid, Output, Target
-from troubadour.unique_id import IdProvider, get_unique_element_id
+from troubadour.assets import asset_url
+from troubadour.events import output_events
+from troubadour.passages import function_path, resolve_passage
+from troubadour.definitions import (
+    ClickHandlers,
+    Continuation,
+    Eid,
+    Game,
+    Lid,
+    Output,
+    Target,
+)
+from troubadour.unique_id import IdProvider
+
+# optional features, whose modules are only shipped with the pages that use them
+# (see `troubadour build --rewind --trace --watch`)
+try:
+    import troubadour.rewind as rw
+except ImportError:
+    rw = None  # type: ignore
+try:
+    import troubadour.trace as tr
+except ImportError:
+    tr = None  # type: ignore
+try:
+    import troubadour.hotswap as hs
+except ImportError:
+    hs = None  # type: ignore
 
 T = TypeVar("T")
 
@@ -44,25 +74,30 @@ class Element(Output):
         return self.game.columns(nb_col, html, target=self.local_id)
 
 
-@dataclass
+# Passage elements are retained in history and in saves, so they are kept small:
+# immutable records without per-instance dict, sharing interned markup strings. Each
+# container has its own css dict: a shared one could be changed through any of them.
+
+
+@dataclass(frozen=True, slots=True)
 class TimeStamp:
     date: datetime.datetime
     target: Target
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class RawHTML:
     html: str
     target: Target
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class Image:
     src: str
     target: Target
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class Container:
     markup: str
     html: str
@@ -71,7 +106,7 @@ class Container:
     local_id: Lid
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class ContinuationElement:
     continuation: Continuation
     target: Target
@@ -80,21 +115,55 @@ class ContinuationElement:
 PassageElement = RawHTML | TimeStamp | Container | ContinuationElement | Image
 
 
+RENDER_FORMAT = 1
+"Version of the html produced for passages, to bump when rendering changes."
+
+
+def render_cache_key() -> str:
+    """Returns the key under which rendered passages are cached. It changes with the
+    rendering code and with the build of the page (library and stylesheets)."""
+    return f"{RENDER_FORMAT}:{be.get_meta('troubadour-build') or ''}"
+
+
+def passage_eid(number: int) -> Eid:
+    """Id of the element of the `number`-th passage of the game. It only depends on
+    the position of the passage, so that the output can be rendered somewhere else
+    (at build time, or in a previous visit) and hydrated (see `troubadour.prerender`).
+    """
+    return Eid(f"troubadour__passage__{number}")
+
+
 @dataclass
 class PassageOutput:
     contents: list[PassageElement] = field(default_factory=list)
+    html: str | None = None
+    "Cached html of the passage once disabled."
+    html_key: str | None = None
+    "Value of `render_cache_key` when `html` was rendered."
 
 
 @dataclass
 class PassageContext:
     output: PassageOutput = field(default_factory=PassageOutput)
-    lid_to_eid: dict[Lid, Eid] = field(default_factory=dict)
     _id_provider: IdProvider = field(default_factory=IdProvider)
 
     def new_lid(self) -> Lid:
         return Lid(self._id_provider.get())
 
 
+@dataclass
+class RenderedPassage:
+    "Record of the elements of a passage that is currently on the page."
+    eid: Eid
+    controls: list[Eid] = field(default_factory=list)
+    listeners: list[Eid] = field(default_factory=list)
+
+
+def new_history() -> "rw.StateHistory | None":
+    "History of the state of a new game, None if the page cannot rewind."
+    return rw.StateHistory() if rw is not None else None
+
+
 @dataclass
 class GameImpl(Game[T]):
     """The core troubadour class: encapsulates game and output state and provides
@@ -105,7 +174,27 @@ class GameImpl(Game[T]):
     max_output_len: int = 15
     _output: list[PassageOutput] = field(default_factory=list)
     _current_passage: PassageContext = field(default_factory=PassageContext)
-    _last_passage: Eid | None = None
+    _passage_count: int = 0
+    "Number of passages run since the start of the game."
+    _rendered: list[RenderedPassage] = field(default_factory=list)
+    _history: "rw.StateHistory | None" = field(default_factory=new_history)
+    "Checkpoints of the state after the last passages, to rewind the game."
+
+    def __getstate__(self) -> dict:
+        # what is currently on the page and the history of the state are not part
+        # of the saved game
+        state = self.__dict__.copy()
+        state.pop("_rendered", None)
+        state.pop("_history", None)
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        # saves from older versions
+        state.pop("_last_passage", None)
+        state.setdefault("_passage_count", len(state.get("_output", [])))
+        self.__dict__.update(state)
+        self._rendered = []
+        self._history = new_history()
 
     def paragraph(
         self, html: str = "", css: dict[str, str] | None = None, target: Target = None
@@ -121,7 +210,7 @@ class GameImpl(Game[T]):
     ) -> Element:
         local_id = self._current_passage.new_lid()
         self._current_passage.output.contents.append(
-            Container(markup, html, (css if css is not None else {}), target, local_id)
+            Container(sys.intern(markup), html, dict(css or {}), target, local_id)
         )
         return Element(local_id, self)
 
@@ -157,85 +246,285 @@ class GameImpl(Game[T]):
         for continuation in continuations:
             zone.continuation(continuation)
 
-    def _timestamp(self) -> None:
-        timestamp = datetime.datetime.now()
+    def _timestamp(self, timestamp: datetime.datetime) -> None:
         self._current_passage.output.contents.append(TimeStamp(timestamp, target=None))
 
-    def _render_passage(self, passage: PassageOutput, disabled: bool = False) -> None:
-        context = PassageContext(passage)
-        passage_id = get_unique_element_id("passage")
-        self._last_passage = passage_id
-        be.insert_end(Eid("output"), f"<div class='passage' id={passage_id}>")
-        for out in passage.contents:
-            eid_target = (
-                context.lid_to_eid[out.target]
-                if out.target is not None
-                else Eid(passage_id)
-            )
+    def _passage_body(
+        self, passage: PassageOutput, passage_id: Eid, disabled: bool = False
+    ) -> tuple[str, ClickHandlers, list[Eid]]:
+        """Builds the full html tree of a passage from the nesting of its elements,
+        without touching the page. Disabled passages contain no element id.
+
+        Returns:
+            tuple[str, ClickHandlers, list[Eid]]: the inner html of the passage, the
+                click callbacks of its continuations and the ids of its inputs.
+        """
+        children: dict[Target, list[str | Container]] = {None: []}
+        handlers: ClickHandlers = {}
+        controls: list[Eid] = []
+        for index, out in enumerate(passage.contents):
+            fragment: str | Container
             match out:
                 case TimeStamp(date=date):
                     t = date.strftime(r"%Y - %b %d - %H:%M:%S")
-                    be.insert_end(eid_target, f"<div class='timestamp'>{t}</div>")
+                    fragment = f"<div class='timestamp'>{t}</div>"
                 case RawHTML(html=html):
-                    be.insert_end(eid_target, html)
-                case Container(markup=markup, html=html, css=css, local_id=local_id):
-                    element_id = get_unique_element_id("container")
-                    context.lid_to_eid[local_id] = element_id
-                    rcss = " ".join(f"{key}={value}" for key, value in css.items())
-                    be.insert_end(
-                        eid_target,
-                        f"<{markup} {rcss} id='{element_id}'>{html}</{markup}>",
-                    )
+                    fragment = html
+                case Container(local_id=local_id):
+                    children[local_id] = []
+                    fragment = out
                 case ContinuationElement(continuation=continuation):
-                    continuation.setup(self, eid_target, disabled)
+                    fragment, new_handlers, new_controls = continuation.render(
+                        self, Eid(f"{passage_id}__{index}"), disabled
+                    )
+                    handlers.update(new_handlers)
+                    controls.extend(new_controls)
                 case Image(src=src):
-                    img_id = get_unique_element_id("image")
-                    be.insert_end(eid_target, f"<img id='{img_id}' src='{src}' />")
-                    be.onload(
-                        img_id, lambda _: be.scroll_to_bottom(Eid("output-container"))
+                    fragment = f"<img src='{asset_url(src)}' />"
+            children[out.target].append(fragment)
+
+        def join(target: Target) -> str:
+            parts = []
+            for fragment in children[target]:
+                if isinstance(fragment, Container):
+                    markup = fragment.markup
+                    rcss = "".join(
+                        f" {key}={value}" for key, value in fragment.css.items()
                     )
+                    inner = join(fragment.local_id)
+                    parts.append(f"<{markup}{rcss}>{fragment.html}{inner}</{markup}>")
+                else:
+                    parts.append(fragment)
+            return "".join(parts)
+
+        return join(None), handlers, controls
+
+    def _disabled_body(self, passage: PassageOutput) -> str:
+        "Returns the inner html of a disabled passage, from cache if up to date."
+        key = render_cache_key()
+        if passage.html is None or passage.html_key != key:
+            passage.html, _, _ = self._passage_body(passage, Eid(""), disabled=True)
+            passage.html_key = key
+        return passage.html
+
+    def _passage_html(
+        self, passage: PassageOutput, number: int, disabled: bool = False
+    ) -> tuple[str, ClickHandlers, RenderedPassage]:
+        """Builds the html of the `number`-th passage of the game, including the
+        passage element itself.
+
+        Returns:
+            tuple[str, ClickHandlers, RenderedPassage]: the html of the passage, the
+                click callbacks of its continuations and the record of its elements.
+        """
+        passage_id = passage_eid(number)
+        handlers: ClickHandlers
+        controls: list[Eid]
+        if disabled:
+            body, handlers, controls = self._disabled_body(passage), {}, []
+        else:
+            body, handlers, controls = self._passage_body(passage, passage_id)
+        html = f"<div class='passage' id='{passage_id}'>{body}</div>"
+        return html, handlers, RenderedPassage(passage_id, controls)
+
+    def _wire_passage(self, handlers: ClickHandlers, rendered: RenderedPassage) -> None:
+        "Attaches callbacks to the elements of a passage that is already in the page."
+        for eid, handler in handlers.items():
+            output_events.register("click", eid, handler)
+            rendered.listeners.append(eid)
+        # images have no id so their load events are routed to the passage element
+        output_events.register(
+            "load", rendered.eid, lambda _: be.scroll_to_bottom(Eid("output-container"))
+        )
+
+    def _unwire_passage(self, rendered: RenderedPassage) -> None:
+        for eid in rendered.listeners:
+            output_events.unregister(eid)
+        rendered.listeners.clear()
+
+    def _render_passage(self, passage: PassageOutput, number: int) -> int:
+        """Renders the new `number`-th passage at the end of the page.
+
+        Returns:
+            int: size of the html of the passage.
+        """
+        html, handlers, rendered = self._passage_html(passage, number)
+        be.insert_end(Eid("output"), html)
+        self._wire_passage(handlers, rendered)
+        self._rendered.append(rendered)
+        return len(html)
+
+    def _disable_passage(
+        self, rendered: RenderedPassage, passage: PassageOutput
+    ) -> None:
+        """Disables the inputs of a passage that is already in the page, and caches
+        its disabled html now that it is finished."""
+        self._unwire_passage(rendered)
+        for eid in rendered.controls:
+            be.disable(eid)
+        rendered.controls.clear()
+        self._disabled_body(passage)
+
+    def _remove_passage(self, rendered: RenderedPassage) -> None:
+        self._unwire_passage(rendered)
+        output_events.unregister(rendered.eid)
+        be.remove(rendered.eid)
 
     def _render(self) -> None:
-        be.clear(Eid("output"))
-        for passage in self._output[:-1]:
-            self._render_passage(passage, disabled=True)
-        self._render_passage(self._output[-1])
+        """Replaces the whole page output with the retained passages. Disabled
+        passages are taken from the html cache when possible."""
+        first = self._first_number()
+        pages = [
+            self._passage_html(
+                passage, first + index, disabled=index < len(self._output) - 1
+            )
+            for index, passage in enumerate(self._output)
+        ]
+        for rendered in self._rendered:
+            self._unwire_passage(rendered)
+            output_events.unregister(rendered.eid)
+        be.set_html(Eid("output"), "".join(html for html, _, _ in pages))
+        self._rendered = []
+        for _, handlers, rendered in pages:
+            self._wire_passage(handlers, rendered)
+            self._rendered.append(rendered)
+        be.scroll_to_bottom(Eid("output-container"))
+
+    def _first_number(self) -> int:
+        "Number of the oldest retained passage."
+        return self._passage_count - len(self._output) + 1
+
+    def _hydrate(self) -> None:
+        """Attaches the callbacks of the retained passages to their elements, which
+        are already in the page (see `troubadour.prerender`), instead of rendering
+        them again like `_render` does."""
+        first = self._first_number()
+        self._rendered = []
+        for index, passage in enumerate(self._output):
+            eid = passage_eid(first + index)
+            handlers: ClickHandlers = {}
+            controls: list[Eid] = []
+            if index == len(self._output) - 1:
+                _, handlers, controls = self._passage_body(passage, eid)
+            rendered = RenderedPassage(eid, controls)
+            self._wire_passage(handlers, rendered)
+            self._rendered.append(rendered)
         be.scroll_to_bottom(Eid("output-container"))
 
-    def _trim_output(self) -> None:
-        if len(self._output) > self.max_output_len:
-            trim_index = -self.max_output_len
-            self._output = self._output[trim_index:]
-            self._render()
+    def _trim_output(self) -> int:
+        """Drops the oldest passages, both from the history and from the page.
+
+        Returns:
+            int: number of passages dropped.
+        """
+        if len(self._output) <= self.max_output_len:
+            return 0
+        nb_trimmed = len(self._output) - self.max_output_len
+        self._output = self._output[nb_trimmed:]
+        for rendered in self._rendered[:nb_trimmed]:
+            self._remove_passage(rendered)
+        self._rendered = self._rendered[nb_trimmed:]
+        return nb_trimmed
 
     def run_passage(
         self,
-        passage: Callable,
+        passage: Callable | str,
         *,
         kwargs: dict[str, object] | None = None,
     ) -> None:
+        if isinstance(passage, str):
+            passage = resolve_passage(passage)
+        if self._history is not None:
+            self._history.flush()  # before the passage changes the state
+            self._history.watch(self.state)
+        kwargs = kwargs if kwargs is not None else {}
+        if tr is not None:
+            time = tr.recorder.begin(passage, kwargs).time
+        else:
+            time = datetime.datetime.now()
+        instrumentation = ins.instrumentation
+        instrumentation.passage = function_path(passage)
+
         # disable previous passage
-        if self._last_passage is not None:
-            be.remove(self._last_passage)
-            self._render_passage(self._output[-1], disabled=True)
+        if self._rendered:
+            with instrumentation.phase("disable") as record:
+                record.elements = len(self._output[-1].contents)
+                self._disable_passage(self._rendered[-1], self._output[-1])
 
         # new empty passage
         self._current_passage = PassageContext()
+        output = self._current_passage.output
 
-        anchor_id = get_unique_element_id("anchor")
-        self.raw_html(f"<span id='{anchor_id}'>")
-        self._timestamp()
-        passage(self, **(kwargs if kwargs is not None else {}))
+        with instrumentation.phase("passage") as record:
+            self._timestamp(time)
+            passage(self, **kwargs)
+            record.elements = len(output.contents)
 
         # render the passage and scroll to bottom of page
-        self._render_passage(self._current_passage.output)
-        be.scroll_into_view(Eid(anchor_id))
+        with instrumentation.phase("render") as record:
+            record.elements = len(output.contents)
+            record.size = self._render_passage(output, self._passage_count + 1)
+            be.scroll_into_view(self._rendered[-1].eid)
         # be.scroll_to_bottom(Eid("output-container"))
 
-        self._output.append(self._current_passage.output)
+        self._output.append(output)
+        self._passage_count += 1
         self._current_passage = PassageContext()
-        self._trim_output()
-        sv.save_game(self)
+        with instrumentation.phase("trim") as record:
+            record.elements = self._trim_output()
+        if lz.loader is not None:
+            lz.loader.after_passage(
+                passage,
+                [
+                    element.continuation
+                    for element in output.contents
+                    if isinstance(element, ContinuationElement)
+                ],
+            )
+        self._checkpoint()
+        sv.save_scheduler.schedule(self)
+
+    def _checkpoint(self) -> None:
+        "Records the current state in the history, after the last passage."
+        if self._output and self._history is not None:
+            self._history.schedule(self.state, self._passage_count, self._output[-1])
+
+    def can_rewind(self, steps: int = 1) -> bool:
+        if self._history is None:
+            return False
+        self._history.flush()
+        return 0 < steps < len(self._history)
+
+    def rewind(self, steps: int = 1) -> None:
+        """Goes back `steps` passages: restores the state as it was after that passage
+        and displays it again with its continuations.
+
+        Raises:
+            ValueError: if the history does not go back that far (or the page
+                cannot rewind).
+        """
+        if self._history is None:
+            raise ValueError("Rewind is not enabled (see troubadour build --rewind)")
+        self.state, outputs, self._passage_count = self._history.rewind(
+            self.state, steps
+        )
+        if tr is not None:
+            tr.recorder.rewound(steps)
+        self._output = outputs[-self.max_output_len :]
+        self._render()
+        sv.save_scheduler.schedule(self)
+
+
+def setup_rewind_button(game: GameImpl) -> None:
+    def rewind(_) -> None:
+        if game.can_rewind():
+            game.rewind()
+
+    be.onclick(Eid("rewind"), rewind)
+
+
+game_entry: tuple[type, Callable] | None = None
+"State class and start passage of the last game started with `run_game`."
 
 
 def run_game(StateCls: type, start_passage: Callable) -> None:  # pylint: disable=C0103
@@ -248,17 +537,37 @@ def run_game(StateCls: type, start_passage: Callable) -> None:  # pylint: disabl
             start a new game.
         `start_passage` (`Callable`): passage to run at the start of the new game.
     """
+    global game_entry  # pylint: disable=W0603
+    game_entry = (StateCls, start_passage)
+    ins.setup_sinks()
+    lz.install()
+
     if not sv.state_exists():  # if there is no state in storage, start new game
-        game = GameImpl(StateCls())
-        game.run_passage(start_passage)
+        prerendered = pr.prerendered_game(GameImpl, StateCls)
+        if prerendered is not None:  # the start passage was run at build time
+            game = prerendered
+            game._hydrate()  # pylint: disable=W0212
+            game._checkpoint()  # pylint: disable=W0212
+            sv.save_scheduler.schedule(game)
+        else:
+            game = GameImpl(StateCls())
+            if tr is not None:
+                tr.recorder.start(StateCls)
+            game.run_passage(start_passage)
     else:  # otherwise try to start from stored state
         try:
             game = sv.load_game(GameImpl)
-            game._render()  # pylint: disable=W0212
+            if pr.snapshot_matches(game):  # the page shows the last visit
+                game._hydrate()  # pylint: disable=W0212
+            else:
+                game._render()  # pylint: disable=W0212
+            game._checkpoint()  # pylint: disable=W0212
+            if tr is not None:
+                tr.recorder.resume(game)
         except Exception:  # pylint: disable=W0718
             # if something went wrong during loading, display a massage and offer
-            # the option to restart
-            be.insert_end(
+            # the option to restart (in place of the output of the last visit)
+            be.set_html(
                 Eid("output"),
                 (
                     "<h1> Something went wrong during loading</h1>"
@@ -275,3 +584,7 @@ def run_game(StateCls: type, start_passage: Callable) -> None:  # pylint: disabl
     sv.setup_export_button(game)
     sv.setup_import_button(GameImpl)
     sv.setup_reset_button()
+    if rw is not None:
+        setup_rewind_button(game)
+    if hs is not None:
+        hs.setup_live_reload(game)
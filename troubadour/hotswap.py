@@ -0,0 +1,92 @@
+"""Live reload of games during development (see `troubadour build --watch`).
+
+Pages built in watch mode point to an event stream of the development server, which
+sends a notification after each rebuild. When only user modules changed, they are
+downloaded and reloaded in the running interpreter, and the passages and classes
+referenced by the game are replaced by their new version. Otherwise (e.g., when the
+entry point, the library or the page changed), the page is reloaded."""
+
+import importlib
+import json
+import sys
+from dataclasses import fields, is_dataclass
+from pathlib import Path
+from types import FunctionType, ModuleType
+from typing import Any
+
+import troubadour.backend as be
+import troubadour.game as gm
+
+LIVE_RELOAD_META = "troubadour-live-reload"
+"Meta tag holding the url of the event stream of the development server."
+
+
+def setup_live_reload(game: "gm.GameImpl") -> None:
+    "Listens to rebuild notifications, if the page was built in watch mode."
+    url = be.get_meta(LIVE_RELOAD_META)
+    if url is not None:
+        be.on_server_event(url, lambda data: on_rebuild(game, json.loads(data)))
+
+
+def on_rebuild(game: "gm.GameImpl", notification: dict) -> None:
+    """Applies a rebuild notification: hot swaps the changed modules if possible,
+    reloads the page otherwise."""
+    if notification.get("full", True):
+        be.refresh_page()
+        return
+    try:
+        hotswap(game, notification["files"])
+    except Exception:  # pylint: disable=W0718
+        be.refresh_page()
+
+
+def modules_of(files: list[str]) -> list[ModuleType]:
+    "Loaded modules whose source is one of `files`, raises ValueError if one is not."
+    paths = {Path(file).resolve(): file for file in files}
+    modules = {}
+    for module in list(sys.modules.values()):
+        source = getattr(module, "__file__", None)
+        if source is not None:
+            modules[Path(source).resolve()] = module
+    missing = [file for path, file in paths.items() if path not in modules]
+    if missing:
+        raise ValueError(f"Files {missing} are not loaded modules")
+    return [modules[path] for path in paths]
+
+
+def hotswap(game: "gm.GameImpl", files: list[str]) -> None:
+    """Downloads the new version of `files` (paths of python modules relative to the
+    page), reloads the corresponding modules and updates the game to use them."""
+    modules = modules_of(files)
+    for file in files:
+        Path(file).write_text(be.fetch_text(file), encoding="utf-8")
+    importlib.invalidate_caches()
+    for module in modules:
+        importlib.reload(module)
+    names = {module.__name__ for module in modules}
+    for passage in game._output:  # pylint: disable=W0212
+        for element in passage.contents:
+            if isinstance(element, gm.ContinuationElement):
+                rebind_fields(element.continuation, names)
+    game.state.__class__ = latest(game.state.__class__, names)
+
+
+def latest(obj: Any, names: set[str]) -> Any:
+    "New version of function or class `obj` if it comes from a reloaded module."
+    module = getattr(obj, "__module__", None)
+    if module not in names:
+        return obj
+    new: Any = sys.modules[module]
+    for part in obj.__qualname__.split("."):
+        new = getattr(new, part, None)
+    return new if new is not None else obj
+
+
+def rebind_fields(obj: Any, names: set[str]) -> None:
+    "Replaces the passages referenced by the fields of dataclass `obj` by new versions."
+    if not is_dataclass(obj):
+        return
+    for fld in fields(obj):
+        value = getattr(obj, fld.name)
+        if isinstance(value, (FunctionType, type)):
+            setattr(obj, fld.name, latest(value, names))
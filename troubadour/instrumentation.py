@@ -0,0 +1,168 @@
+"""Timing instrumentation of the game loop.
+
+Each passage goes through several phases: the previous passage is disabled, the
+passage is run, rendered, the history is trimmed, the state is checkpointed, and the
+game is saved (later, by the save scheduler). Sinks registered in `instrumentation`
+are called before and after each phase with a `PhaseRecord` holding its duration, the
+number of passage elements it handled and the size of what it produced. By default
+the records are kept in the ring buffer `history`; pages built with `troubadour build
+--profile` also log them to the console and/or to the performance timeline of the
+browser."""
+
+import time
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Iterator, Protocol
+
+import troubadour.backend as be
+
+PROFILE_META = "troubadour-profile"
+"Meta tag holding the sinks enabled at build time, separated by commas."
+
+PHASES = ("disable", "passage", "render", "trim", "checkpoint", "save")
+
+
+@dataclass(slots=True)
+class PhaseRecord:
+    "Measure of a phase of the game loop."
+    phase: str
+    passage: str
+    "Name (module:qualname) of the passage being run (or run last)."
+    start: float = 0.0
+    "Start of the phase, in milliseconds (see `time.perf_counter`)."
+    duration: float = 0.0
+    "Duration of the phase, in milliseconds."
+    elements: int = 0
+    "Number of passage elements handled by the phase."
+    size: int = 0
+    "Size (in characters) of the rendered html or of the saved payload."
+
+
+class Sink(Protocol):
+    "Receives the records of the phases of the game loop."
+
+    def before(self, record: PhaseRecord) -> None:
+        "Called when the phase starts, only `phase` and `passage` are set."
+        ...
+
+    def after(self, record: PhaseRecord) -> None:
+        "Called when the phase ends."
+        ...
+
+
+@dataclass
+class RingBuffer(Sink):
+    "Keeps the last `capacity` records in memory."
+    capacity: int = 500
+    records: deque[PhaseRecord] = field(init=False)
+
+    def __post_init__(self) -> None:
+        self.records = deque(maxlen=self.capacity)
+
+    def before(self, record: PhaseRecord) -> None:
+        pass
+
+    def after(self, record: PhaseRecord) -> None:
+        self.records.append(record)
+
+    def clear(self) -> None:
+        self.records.clear()
+
+    def summary(self) -> dict[tuple[str, str], tuple[int, float, float]]:
+        """Number of records, mean and maximum duration (in milliseconds), by passage
+        and phase."""
+        durations: dict[tuple[str, str], list[float]] = {}
+        for record in self.records:
+            durations.setdefault((record.passage, record.phase), []).append(
+                record.duration
+            )
+        return {
+            key: (len(values), sum(values) / len(values), max(values))
+            for key, values in durations.items()
+        }
+
+
+class ConsoleSink(Sink):
+    "Logs the records to the console."
+
+    def before(self, record: PhaseRecord) -> None:
+        pass
+
+    def after(self, record: PhaseRecord) -> None:
+        be.console_log(
+            f"[troubadour] {record.passage} {record.phase}:"
+            f" {record.duration:.2f}ms ({record.elements} elements,"
+            f" {record.size} characters)"
+        )
+
+
+class PerformanceSink(Sink):
+    """Adds the phases to the performance timeline of the browser (as marks and
+    measures), to be seen alongside the rest of the page activity in the profiler."""
+
+    def before(self, record: PhaseRecord) -> None:
+        be.performance_mark(f"troubadour:{record.phase}:start")
+
+    def after(self, record: PhaseRecord) -> None:
+        end = f"troubadour:{record.phase}:end"
+        be.performance_mark(end)
+        be.performance_measure(
+            f"troubadour {record.phase} {record.passage}",
+            f"troubadour:{record.phase}:start",
+            end,
+        )
+
+
+SINKS: dict[str, type[Sink]] = {
+    "console": ConsoleSink,
+    "performance": PerformanceSink,
+}
+"Sinks that can be enabled at build time, by name."
+
+
+@dataclass
+class Instrumentation:
+    "Measures the phases of the game loop and forwards the records to `sinks`."
+    sinks: list[Sink] = field(default_factory=list)
+    passage: str = ""
+    "Name of the passage being run (or run last)."
+
+    def add_sink(self, sink: Sink) -> None:
+        self.sinks.append(sink)
+
+    def remove_sink(self, sink: Sink) -> None:
+        self.sinks.remove(sink)
+
+    @contextmanager
+    def phase(self, phase: str) -> Iterator[PhaseRecord]:
+        """Measures the code run in the `with` block as phase `phase`. The block can
+        fill the `elements` and `size` fields of the record it gets."""
+        record = PhaseRecord(phase, self.passage)
+        if not self.sinks:
+            yield record
+            return
+        for sink in self.sinks:
+            sink.before(record)
+        record.start = time.perf_counter() * 1000
+        try:
+            yield record
+        finally:
+            record.duration = time.perf_counter() * 1000 - record.start
+            for sink in self.sinks:
+                sink.after(record)
+
+
+history = RingBuffer()
+"Global ring buffer of the last records."
+
+instrumentation = Instrumentation([history])
+"Global instrumentation object."
+
+
+def setup_sinks() -> None:
+    "Enables the sinks listed in the profile meta tag of the page, if any."
+    names = be.get_meta(PROFILE_META)
+    for name in names.split(",") if names else []:
+        if not any(isinstance(sink, SINKS[name]) for sink in instrumentation.sinks):
+            instrumentation.add_sink(SINKS[name]())
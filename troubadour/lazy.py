@@ -0,0 +1,138 @@
+"""Lazy loading of the modules of large games (see `troubadour build --lazy`).
+
+Pages built in lazy mode only fetch the entry point of the game and the modules it
+imports. The other modules are listed in an index embedded in the page, and are
+downloaded and imported the first time they are needed: when a passage refers to one
+of their passages by name (e.g., `Button("Next", "chapter2:intro")`), or when they are
+imported. After each passage, the modules that its continuations (and, according to
+the passage graph computed at build time, the passages of its module) lead to are
+downloaded in the background, so that they are ready when the player clicks."""
+
+import importlib.abc
+import importlib.util
+import json
+import sys
+from dataclasses import dataclass, field
+from pathlib import Path
+from types import ModuleType
+from typing import Any, Callable
+
+import troubadour.backend as be
+
+MODULES_META = "troubadour-modules"
+"Meta tag holding the module index of the build."
+
+
+@dataclass
+class ModuleIndex:
+    "Modules of a game built in lazy mode."
+    entry: str
+    "Name of the entry module (which runs as __main__)."
+    modules: dict[str, str] = field(default_factory=dict)
+    "Url of each module, by name (empty for folders without __init__.py)."
+    passages: dict[str, str] = field(default_factory=dict)
+    "Module of each registered passage (see `troubadour.passages`), by id."
+    next: dict[str, list[str]] = field(default_factory=dict)
+    "Modules that the passages of each module may lead to."
+
+
+class LazyLoader(importlib.abc.MetaPathFinder, importlib.abc.Loader):
+    "Imports the modules of the index, downloading them if they were not prefetched."
+
+    def __init__(self, index: ModuleIndex) -> None:
+        self.index = index
+        self.sources: dict[str, str] = {}
+        "Sources of the prefetched modules, by name."
+        self.pending: set[str] = set()
+        "Modules being prefetched."
+
+    def find_spec(self, fullname: str, path: Any = None, target: Any = None) -> Any:
+        url = self.index.modules.get(fullname)
+        if url is None:
+            return None
+        is_package = url == "" or url.endswith("__init__.py")
+        return importlib.util.spec_from_loader(fullname, self, is_package=is_package)
+
+    def create_module(self, spec: Any) -> ModuleType | None:
+        return None
+
+    def exec_module(self, module: ModuleType) -> None:
+        url = self.index.modules[module.__name__]
+        if url == "":  # folder without __init__.py
+            return
+        source = self.sources.pop(module.__name__, None)
+        if source is None:
+            # modules imported by the entry point were fetched with it
+            local = Path(url)
+            source = local.read_text("utf-8") if local.exists() else be.fetch_text(url)
+        module.__file__ = url
+        exec(compile(source, url, "exec"), module.__dict__)  # pylint: disable=W0122
+
+    def prefetch(self, name: str) -> None:
+        "Downloads module `name` in the background, if it is lazy and not loaded yet."
+        url = self.index.modules.get(name)
+        if (
+            not url
+            or Path(url).exists()  # local file, nothing to download
+            or name in sys.modules
+            or name in self.sources
+            or name in self.pending
+        ):
+            return
+        self.pending.add(name)
+
+        def received(source: str) -> None:
+            self.pending.discard(name)
+            if name not in sys.modules:
+                self.sources[name] = source
+
+        be.fetch_text_async(url, received)
+
+    def module_of(self, ref: str) -> str | None:
+        "Module of the passage that `ref` refers to (id or module:qualname)."
+        if ":" in ref:
+            return ref.split(":")[0]
+        return self.index.passages.get(ref)
+
+    def after_passage(self, passage: Callable, continuations: list[Any]) -> None:
+        """Prefetches the modules that the passage can lead to: those of the string
+        passages of its `continuations`, and those found by the passage graph."""
+        module = passage.__module__
+        module = self.index.entry if module == "__main__" else module
+        names = list(self.index.next.get(module, []))
+        for continuation in continuations:
+            ref = getattr(continuation, "passage", None)
+            if isinstance(ref, str):
+                names.append(self.module_of(ref) or "")
+        for name in names:
+            self.prefetch(name)
+
+
+loader: LazyLoader | None = None
+"Loader of the page, None if it was not built in lazy mode."
+
+
+def install(index: ModuleIndex | None = None) -> None:
+    """Installs the loader, if the page was built in lazy mode. Tools that run games
+    outside of a page give their own module `index` instead, so that passages given by
+    id can be found before their module is imported."""
+    global loader  # pylint: disable=W0603
+    if loader is not None:
+        return
+    if index is None:
+        raw = be.get_meta(MODULES_META)
+        if raw is None:
+            return
+        index = ModuleIndex(**json.loads(raw))
+        # importing the entry module by name must not run it again
+        if "__main__" in sys.modules:
+            sys.modules.setdefault(index.entry, sys.modules["__main__"])
+    loader = LazyLoader(index)
+    # after the regular finders, so that local files take precedence
+    sys.meta_path.append(loader)
+
+
+def import_passage_module(pid: str) -> None:
+    "Imports the module that defines registered passage `pid`, if it is lazy."
+    if loader is not None and pid in loader.index.passages:
+        importlib.import_module(loader.index.passages[pid])
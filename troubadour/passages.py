@@ -0,0 +1,109 @@
+"""Registry of passages, to refer to them compactly in saves and traces.
+
+Passages decorated with `passage` are registered under an id: the name given to the
+decorator, or their qualified name. Saves and traces refer to registered passages by
+their id, which is short and survives moving the passage to another module, and to
+other functions by their import path (module:qualname)."""
+
+import importlib
+from typing import Any, Callable, TypeVar, overload
+
+import troubadour.lazy as lz
+
+F = TypeVar("F", bound=Callable)
+
+_registry: dict[str, Callable] = {}
+"Registered passages, by id."
+
+_ids: dict[Callable, str] = {}
+"Ids of the registered passages."
+
+
+def function_path(func: Callable) -> str:
+    "Import path of `func` (module:qualname), its repr if it has none (e.g., partials)."
+    qualname = getattr(func, "__qualname__", None)
+    if qualname is None:
+        return repr(func)
+    return f"{func.__module__}:{qualname}"
+
+
+@overload
+def passage(func: F) -> F:
+    ...
+
+
+@overload
+def passage(*, name: str | None = None) -> Callable[[F], F]:
+    ...
+
+
+def passage(func: Callable | None = None, *, name: str | None = None) -> Any:
+    """Decorator that registers a passage, under id `name` (defaults to the qualified
+    name of the passage). Usage is `@passage` or `@passage(name="intro")`.
+
+    Raises:
+        ValueError: if the id is not valid or is used by another passage.
+    """
+
+    def register(func: F) -> F:
+        pid = name if name is not None else func.__qualname__
+        if ":" in pid:
+            raise ValueError(f"Passage id {pid!r} must not contain ':'")
+        previous = _registry.get(pid)
+        # a passage registered again when its module is reloaded keeps its id
+        if previous is not None and function_path(previous) != function_path(func):
+            raise ValueError(
+                f"Passage id {pid!r} is used by {function_path(previous)} and"
+                f" {function_path(func)}, use @passage(name=...) to rename one"
+            )
+        _registry[pid] = func
+        _ids[func] = pid
+        return func
+
+    return register if func is None else register(func)
+
+
+def passage_ref(func: Callable | str) -> str:
+    """Id of passage `func` if it is registered, its import path otherwise (passages
+    given by name are returned as is)."""
+    if isinstance(func, str):
+        return func
+    pid = _ids.get(func)
+    return pid if pid is not None else function_path(func)
+
+
+def resolve_passage(ref: str, aliases: dict[str, str] | None = None) -> Callable:
+    """Returns the function that `ref` (see `passage_ref`) refers to. Modules of import
+    paths can be renamed with `aliases` (e.g., the entry point of the game runs as
+    __main__ in the page).
+
+    Raises:
+        ValueError: if `ref` is the id of no registered passage.
+    """
+    if ":" not in ref:
+        if ref not in _registry:
+            lz.import_passage_module(ref)
+        if ref not in _registry:
+            raise ValueError(f"Unknown passage id {ref!r}")
+        return _registry[ref]
+    module, qualname = ref.split(":")
+    if aliases is not None:
+        module = aliases.get(module, module)
+    obj: Any = importlib.import_module(module)
+    for part in qualname.split("."):
+        obj = getattr(obj, part)
+    return obj
+
+
+def can_resolve(func: Callable) -> bool:
+    """Whether `resolve_passage(passage_ref(func))` returns `func` (lambdas and local
+    functions have no import path)."""
+    try:
+        return func in _ids or resolve_passage(function_path(func)) is func
+    except (AttributeError, ImportError, TypeError, ValueError):
+        return False
+
+
+def registered() -> dict[str, Callable]:
+    "Registered passages, by id."
+    return dict(_registry)
@@ -0,0 +1,103 @@
+"""Output displayed before Python is ready (see `troubadour build --prerender`).
+
+Pages built with --prerender show the start passage as soon as they are parsed: it is
+run at build time on the headless backend, its html is inlined in the page, and the
+game it leads to is embedded in a meta tag. Returning players see the output of their
+last visit in the same way: when the page is hidden, the save scheduler stores a
+snapshot of the html of the output in local storage (key "troubadour_snapshot"),
+which a script of the page displays when it was made by the same build. Saves made
+afterwards remove the snapshot, which no longer matches them.
+
+Once Python is ready, the game hydrates the output that is already in the page: it
+attaches the callbacks of the continuations to the existing elements instead of
+rendering the passages again. This works because the ids of the elements of a passage
+only depend on its position in the game (see `troubadour.game.passage_eid`)."""
+
+import json
+import sys
+from dataclasses import dataclass
+from typing import Any, TypeVar
+
+import troubadour.backend as be
+import troubadour.game as gm
+import troubadour.save as sv
+from troubadour.definitions import Eid, Game
+
+try:
+    import troubadour.trace as tr
+except ImportError:  # not shipped with the page (see `troubadour build --trace`)
+    tr = None  # type: ignore
+
+PRERENDER_META = "troubadour-prerender"
+"Meta tag holding the game after the start passage, in prerendered pages."
+
+SNAPSHOT_KEY = "troubadour_snapshot"
+"Local storage key of the snapshot of the output."
+
+G = TypeVar("G", bound=Game)
+
+
+@dataclass
+class Prerendered:
+    "Game of a prerendered page, after its start passage."
+    entry: str
+    "Name of the entry module at build time (which runs as __main__ in the page)."
+    game: str
+    "The game, encoded with the storage codec."
+    trace: list
+    "Trace entry of the start passage (see `troubadour.trace.TraceEntry.encode`)."
+
+
+def prerendered_game(game_type: type[G], state_cls: type) -> G | None:
+    """Returns the game embedded in the page, whose start passage is already displayed,
+    or None if the page was not prerendered. The trace of the game is started, if it is
+    recorded."""
+    raw = be.get_meta(PRERENDER_META)
+    if raw is None:
+        return None
+    prerendered = Prerendered(**json.loads(raw))
+    # the classes and passages of the entry module were pickled under its name
+    if "__main__" in sys.modules:
+        sys.modules.setdefault(prerendered.entry, sys.modules["__main__"])
+    game: Any = sv.codec.decode(prerendered.game)
+    if not isinstance(game, game_type) or type(game.state) is not state_cls:
+        be.clear(Eid("output"))  # not the game of this page, start it anew
+        return None
+    if tr is not None:
+        tr.recorder.start(state_cls)
+        tr.recorder.record(tr.TraceEntry.decode(prerendered.trace))
+    return game
+
+
+def enabled() -> bool:
+    "Snapshots are only kept by prerendered pages, which display them."
+    return be.get_meta(PRERENDER_META) is not None
+
+
+def store_snapshot(game: "gm.GameImpl") -> None:
+    "Stores the html of the output of `game`, to display it on the next visit."
+    if not enabled():
+        return
+    snapshot = {
+        "build": be.get_meta("troubadour-build") or "",
+        "count": game._passage_count,  # pylint: disable=W0212
+        "html": be.get_html(Eid("output")),
+    }
+    be.local_storage.set_raw(SNAPSHOT_KEY, json.dumps(snapshot, separators=(",", ":")))
+
+
+def snapshot_matches(game: "gm.GameImpl") -> bool:
+    """Whether the page displays the snapshot of the output of `game`, stored in the
+    previous visit (the page only displays snapshots made by the same build)."""
+    raw = be.local_storage[SNAPSHOT_KEY]
+    if raw is None or not enabled():
+        return False
+    snapshot = json.loads(raw)
+    return (
+        snapshot["build"] == (be.get_meta("troubadour-build") or "")
+        and snapshot["count"] == game._passage_count  # pylint: disable=W0212
+    )
+
+
+def clear_snapshot() -> None:
+    be.local_storage.remove(SNAPSHOT_KEY)
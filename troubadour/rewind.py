@@ -0,0 +1,474 @@
+"""State history of games, to rewind them to a previous passage.
+
+The history follows the state field by field (the attributes of the state object).
+Immutable values (numbers, strings, tuples and frozensets of them...) are kept as they
+are, and only looked at again when the field holds a new object. Fields holding
+mutable values (lists, dicts, other objects), which can change in place, are flattened
+to trees of plain values (with jsonpickle) and compared to their previous tree, which
+the new tree shares all its unchanged subtrees with. Fields that share objects are
+flattened together, as a group, so that they still share them once restored.
+
+While a passage runs, the attributes read or set on the state are noted (see
+`StateHistory.watch`): the next checkpoint only flattens the groups of the mutable
+fields that were, since the others cannot have changed. Each checkpoint keeps an undo
+patch of the fields that changed, so that it costs the size of the changes plus the
+size of the fields that the passage used. Rewinding applies the undo patches of the
+passages it goes back over, and only restores the fields they touch.
+
+Flattening a mutable field costs about as much as copying it, so checkpoints are
+recorded right after the passage is displayed, outside of the click handler (and
+before the next passage runs, if that comes first)."""
+
+from collections import deque
+from dataclasses import dataclass, field, fields, is_dataclass
+from typing import Any, Callable
+
+from jsonpickle.pickler import Pickler
+from jsonpickle.unpickler import Unpickler
+
+import troubadour.backend as be
+import troubadour.instrumentation as ins
+
+Patch = tuple | None
+"""Change of a tree: None (no change), ("v", value) (replaced by value), ("d", {key:
+patch}) (dict with changed keys, DELETE to remove a key) or ("l", {index: patch}) (list
+of the same length with changed items)."""
+
+DELETE = ("x",)
+"Patch of a dict key that must be removed."
+
+
+def diff(old: Any, new: Any) -> tuple[Any, Patch]:
+    """Compares two trees of plain values (as produced by jsonpickle).
+
+    Returns:
+        tuple[Any, Patch]: a tree equal to `new` that reuses the unchanged subtrees of
+            `old` (`old` itself if nothing changed), and the patch that turns it back
+            into `old`.
+    """
+    if type(old) is not type(new):
+        return new, ("v", old)
+    if isinstance(new, dict):
+        result = {}
+        undo: dict = {}
+        for key, value in new.items():
+            if key in old:
+                result[key], patch = diff(old[key], value)
+                if patch is not None:
+                    undo[key] = patch
+            else:
+                result[key] = value
+                undo[key] = DELETE
+        for key, value in old.items():
+            if key not in new:
+                undo[key] = ("v", value)
+        return (old, None) if not undo else (result, ("d", undo))
+    if isinstance(new, list):
+        if len(old) != len(new):
+            return new, ("v", old)
+        items = []
+        undo = {}
+        for index, (old_item, new_item) in enumerate(zip(old, new)):
+            item, patch = diff(old_item, new_item)
+            items.append(item)
+            if patch is not None:
+                undo[index] = patch
+        return (old, None) if not undo else (items, ("l", undo))
+    return (old, None) if old == new else (new, ("v", old))
+
+
+def apply(tree: Any, patch: Patch) -> Any:
+    "Returns a patched copy of `tree`, sharing its unchanged subtrees."
+    match patch:
+        case None:
+            return tree
+        case ("v", value):
+            return value
+        case ("d", changes):
+            result = dict(tree)
+            for key, change in changes.items():
+                if change is DELETE:
+                    del result[key]
+                else:
+                    result[key] = apply(result.get(key), change)
+            return result
+        case ("l", changes):
+            items = list(tree)
+            for index, change in changes.items():
+                items[index] = apply(items[index], change)
+            return items
+    raise ValueError(f"Unknown patch {patch!r}")
+
+
+IMMUTABLE_TYPES = (bool, int, float, complex, str, bytes, type(None))
+"Types of the values that cannot change in place (with tuples and frozensets of them)."
+
+STATE_CLASS = "__class__"
+"Key of the class of the state in undo patches."
+
+WHOLE_STATE = ""
+"Name of the single field of the states that have no attributes (e.g., dicts)."
+
+Key = str | tuple[str, ...]
+"""Key of a record: the name of a field holding an immutable value, or the names of a
+group of fields holding mutable values."""
+
+_accesses: dict[int, tuple[Any, set[str]]] = {}
+"Watched states and the attributes read or set on them, by id of the state."
+
+
+def is_immutable(value: Any) -> bool:
+    "Whether `value` cannot change in place, and can be kept as it is."
+    if isinstance(value, (tuple, frozenset)):
+        return all(is_immutable(item) for item in value)
+    return type(value) in IMMUTABLE_TYPES
+
+
+def same_class(cls: type, other: type) -> bool:
+    "Whether two classes are the same (or versions of the same one, after hot swaps)."
+    return (cls.__module__, cls.__qualname__) == (other.__module__, other.__qualname__)
+
+
+def state_fields(state: Any) -> dict[str, Any]:
+    "Fields of `state`, or `state` itself as a single field if it has no attributes."
+    if not hasattr(state, "__dict__") and not is_dataclass(state):
+        return {WHOLE_STATE: state}
+    values = dict(getattr(state, "__dict__", {}))
+    if is_dataclass(state):  # fields may be slots, even with a __dict__ (subclasses)
+        for item in fields(state):
+            if item.name not in values and hasattr(state, item.name):
+                values[item.name] = getattr(state, item.name)
+    return values
+
+
+def _note_access(obj: Any, name: str) -> None:
+    watched = _accesses.get(id(obj))
+    if watched is not None and watched[0] is obj:
+        watched[1].add(name)
+
+
+def track_accesses(cls: type) -> bool:
+    """Makes the instances of `cls` note the attributes that are read or set on them
+    while they are watched (see `StateHistory.watch`).
+
+    Returns:
+        bool: whether the accesses are tracked (builtin types cannot be).
+    """
+    if "__troubadour_tracked__" in cls.__dict__:
+        return True
+    # unbound methods (the attributes of the class, not of `type`)
+    get_attribute: Callable[[Any, str], Any] = getattr(cls, "__getattribute__")
+    set_attribute: Callable[[Any, str, Any], None] = getattr(cls, "__setattr__")
+    del_attribute: Callable[[Any, str], None] = getattr(cls, "__delattr__")
+
+    def getattribute(self: Any, name: str) -> Any:
+        _note_access(self, name)
+        return get_attribute(self, name)
+
+    def setattribute(self: Any, name: str, value: Any) -> None:
+        _note_access(self, name)
+        set_attribute(self, name, value)
+
+    def delattribute(self: Any, name: str) -> None:
+        _note_access(self, name)
+        del_attribute(self, name)
+
+    try:
+        setattr(cls, "__getattribute__", getattribute)
+    except TypeError:
+        return False
+    setattr(cls, "__setattr__", setattribute)
+    setattr(cls, "__delattr__", delattribute)
+    setattr(cls, "__troubadour_tracked__", True)
+    return True
+
+
+def flatten_group(values: dict[str, Any]) -> tuple[Any, frozenset[int]]:
+    """Flattens fields in a single pass, so that the objects they share remain
+    shared when they are restored.
+
+    Returns:
+        tuple[Any, frozenset[int]]: the tree of the fields and the ids of the objects
+            they hold.
+    """
+    pickler = Pickler()
+    objs = pickler._objs  # pylint: disable=W0212
+    tree = pickler.flatten(values, reset=False)  # replaces pickler._objs once done
+    ids = set(objs)
+    ids.discard(id(values))
+    return tree, frozenset(ids)
+
+
+def restore_group(tree: Any) -> tuple[dict[str, Any], frozenset[int]]:
+    """Restores fields flattened with `flatten_group`.
+
+    Returns:
+        tuple[dict[str, Any], frozenset[int]]: the fields and the ids of the objects
+            they hold.
+    """
+    unpickler = Unpickler()
+    values = unpickler.restore(tree)
+    ids = {id(obj) for obj in unpickler._objs}  # pylint: disable=W0212
+    ids.discard(id(values))
+    return values, frozenset(ids)
+
+
+@dataclass(frozen=True, slots=True)
+class FieldRecord:
+    "Value of a field (or of a group of fields) of the state at a checkpoint."
+    value: Any
+    "The value of the field, if it is immutable."
+    tree: Any = None
+    "The flattened fields of a group (see `flatten_group`)."
+    immutable: bool = True
+    ids: frozenset[int] = frozenset()
+    "Ids of the objects of a group, as long as they are in the state."
+
+
+FieldUndo = FieldRecord | Patch
+"""Undo patch of a record: its previous version (None if it did not exist), or the
+patch from the new tree of a group to its previous tree."""
+
+
+@dataclass(slots=True)
+class Checkpoint:
+    "State of a game after a passage."
+    passage_count: int
+    output: Any
+    "Output of the passage (`troubadour.game.PassageOutput`)."
+    undo: dict[Key, FieldUndo]
+    "Undo patches of the records that changed since the previous checkpoint."
+
+
+@dataclass
+class StateHistory:
+    """Bounded ring of checkpoints of a game.
+
+    Args:
+        max_checkpoints (int): number of checkpoints kept (the game can be rewound
+            by one less passage).
+    """
+
+    max_checkpoints: int = 50
+    checkpoints: deque[Checkpoint] = field(init=False)
+    _records: dict[Key, FieldRecord] = field(default_factory=dict)
+    "Fields of the state of the last checkpoint."
+    _groups: dict[str, tuple[str, ...]] = field(default_factory=dict)
+    "Keys of the groups of the fields holding mutable values, by field."
+    _cls: type | None = None
+    "Class of the state of the last checkpoint."
+    _watched: tuple[Any, set[str]] | None = None
+    "State watched since the last checkpoint and the attributes accessed on it."
+    _pending: tuple[Any, int, Any, set[str] | None] | None = None
+    "Arguments of the checkpoint waiting to be recorded, see `schedule`."
+
+    def __post_init__(self) -> None:
+        self.checkpoints = deque(maxlen=self.max_checkpoints)
+
+    def __len__(self) -> int:
+        return len(self.checkpoints)
+
+    def watch(self, state: Any) -> None:
+        """Notes the attributes read or set on `state` until the next checkpoint (by
+        the passage about to run), which only flattens the fields that were."""
+        self._stop_watching()
+        if track_accesses(type(state)):
+            self._watched = (state, set())
+            _accesses[id(state)] = self._watched
+
+    def _stop_watching(self) -> tuple[Any, set[str]] | None:
+        watched, self._watched = self._watched, None
+        if watched is not None:
+            _accesses.pop(id(watched[0]), None)
+        return watched
+
+    def schedule(self, state: Any, passage_count: int, output: Any) -> None:
+        """Records a checkpoint for `state` once the current event handler is done.
+        `flush` must be called before `state` is modified."""
+        self.flush()
+        watched = self._stop_watching()
+        accessed = watched[1] if watched is not None and watched[0] is state else None
+        self._pending = (state, passage_count, output, accessed)
+        be.set_timeout(0, self.flush)
+
+    def flush(self) -> None:
+        "Records the pending checkpoint, if any."
+        if self._pending is not None:
+            pending, self._pending = self._pending, None
+            with ins.instrumentation.phase("checkpoint"):
+                self.record(*pending)
+
+    def record(
+        self,
+        state: Any,
+        passage_count: int,
+        output: Any,
+        accessed: set[str] | None = None,
+    ) -> None:
+        """Adds a checkpoint for `state`, after passage `output`. The fields holding
+        mutable values are only flattened again if they are in `accessed` (all of
+        them if it is None)."""
+        records = self._records
+        undo: dict[Key, FieldUndo] = {}
+        values = state_fields(state)
+        dirty: set[str] = set()
+        "Fields whose group must be flattened again."
+        for name, value in values.items():
+            previous = records.get(name)
+            if previous is not None and value is previous.value:
+                continue  # same immutable value
+            if name in self._groups:
+                if accessed is not None and name not in accessed:
+                    continue  # not touched by the passage
+                dirty.add(name)
+            if is_immutable(value):
+                undo[name] = previous
+                records[name] = FieldRecord(value)
+            else:
+                if previous is not None:
+                    undo[name] = records.pop(name)
+                dirty.add(name)
+        for key in [key for key in records if isinstance(key, str)]:
+            if key not in values:
+                undo[key] = records.pop(key)
+        dirty.update(name for name in self._groups if name not in values)
+        if dirty:
+            self._regroup(values, dirty, undo)
+        if self._cls is None or not same_class(type(state), self._cls):
+            undo[STATE_CLASS] = FieldRecord(self._cls)
+        self._cls = type(state)
+        self.checkpoints.append(
+            Checkpoint(passage_count, output, undo if self.checkpoints else {})
+        )
+
+    def _regroup(
+        self, values: dict[str, Any], dirty: set[str], undo: dict[Key, FieldUndo]
+    ) -> None:
+        """Flattens the groups of the `dirty` fields again, splitting them or merging
+        them with other groups according to the objects that the fields share."""
+        records = self._records
+        old_keys = {self._groups[name] for name in dirty if name in self._groups}
+        pending = {name for key in old_keys for name in key} | dirty
+        trees: dict[str, Any] = {}
+        ids: dict[str, frozenset[int]] = {}
+        while pending:
+            name = pending.pop()
+            if name not in values or name in records:  # removed or immutable now
+                continue
+            trees[name], ids[name] = flatten_group({name: values[name]})
+            # groups sharing objects with the field are flattened with it
+            for key, record in records.items():
+                if (
+                    isinstance(key, tuple)
+                    and key not in old_keys
+                    and not record.ids.isdisjoint(ids[name])
+                ):
+                    old_keys.add(key)
+                    pending.update(key)
+        # groups of fields sharing objects
+        components: list[tuple[set[str], set[int]]] = []
+        for name, name_ids in ids.items():
+            group, group_ids = {name}, set(name_ids)
+            for other in [c for c in components if not c[1].isdisjoint(group_ids)]:
+                components.remove(other)
+                group |= other[0]
+                group_ids |= other[1]
+            components.append((group, group_ids))
+        new_records: dict[tuple[str, ...], FieldRecord] = {}
+        for group, group_ids in components:
+            key = tuple(sorted(group))
+            if len(key) == 1:
+                tree = trees[key[0]]
+            else:
+                tree, _ = flatten_group({name: values[name] for name in key})
+            new_records[key] = FieldRecord(None, tree, False, frozenset(group_ids))
+        for key in old_keys:
+            if key not in new_records:
+                undo[key] = records.pop(key)
+                for name in key:
+                    del self._groups[name]
+        for key, record in new_records.items():
+            if key in old_keys:
+                tree, patch = diff(records[key].tree, record.tree)
+                record = FieldRecord(None, tree, False, record.ids)
+                if patch is not None:
+                    undo[key] = patch
+            else:
+                undo[key] = None
+            records[key] = record
+            for name in key:
+                self._groups[name] = key
+
+    def rewind(self, state: Any, steps: int) -> tuple[Any, list[Any], int]:
+        """Drops the last `steps` checkpoints and restores `state` (the state of the
+        last one) as it was at the checkpoint that is now the last one. Only the fields
+        that changed since are set.
+
+        Returns:
+            tuple[Any, list[Any], int]: the restored state (`state` itself, unless it
+                has no attributes or its class changed), the outputs of the passages up
+                to the checkpoint and its passage count.
+        """
+        self.flush()
+        if not 0 < steps < len(self.checkpoints):
+            raise ValueError(f"Cannot rewind {steps} passages")
+        records = dict(self._records)
+        cls: Any = self._cls
+        changed: set[Key] = set()
+        for _ in range(steps):
+            for key, change in self.checkpoints.pop().undo.items():
+                if key == STATE_CLASS:
+                    assert isinstance(change, FieldRecord)
+                    cls = change.value
+                elif isinstance(change, FieldRecord):
+                    records[key] = change
+                elif change is None:
+                    del records[key]
+                else:
+                    tree = apply(records[key].tree, change)
+                    records[key] = FieldRecord(None, tree, False)
+                changed.add(key)
+        assert cls is not None
+        replaced = cls is not self._cls or (WHOLE_STATE,) in records
+        restored: dict[str, Any] = {}
+        for key in list(records) if replaced else changed:
+            record = records.get(key)
+            if record is None:
+                continue
+            if record.immutable:
+                assert isinstance(key, str)
+                restored[key] = record.value
+            else:
+                fields_values, ids = restore_group(record.tree)
+                restored.update(fields_values)
+                records[key] = FieldRecord(None, record.tree, False, ids)
+        if (WHOLE_STATE,) in records:
+            state = restored[WHOLE_STATE]
+        elif cls is not self._cls:
+            state = cls.__new__(cls)
+            for name, value in restored.items():
+                object.__setattr__(state, name, value)
+        else:  # in place (setting fields of frozen dataclasses too)
+            for name, value in restored.items():
+                object.__setattr__(state, name, value)
+            groups = self._groups_of(records)
+            for name in state_fields(state):
+                if name not in records and name not in groups:
+                    object.__delattr__(state, name)
+        self._records = records
+        self._groups = self._groups_of(records)
+        self._cls = cls
+        outputs = [checkpoint.output for checkpoint in self.checkpoints]
+        return state, outputs, self.checkpoints[-1].passage_count
+
+    @staticmethod
+    def _groups_of(records: dict[Key, FieldRecord]) -> dict[str, tuple[str, ...]]:
+        return {name: key for key in records if isinstance(key, tuple) for name in key}
+
+    def clear(self) -> None:
+        self._stop_watching()
+        self._pending = None
+        self.checkpoints.clear()
+        self._records = {}
+        self._groups = {}
+        self._cls = None
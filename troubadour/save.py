@@ -1,36 +1,536 @@
-"Various helper functions to load/save games in local storage."
+"""Various helper functions to load/save games in local storage.
 
-from typing import TypeVar
+Games are stored as a snapshot of the whole game (key "troubadour_state") followed by
+a journal of the passages run since the snapshot: the number of entries is stored
+under "troubadour_journal" and entry i under "troubadour_journal_i". Each save only
+appends an entry with the new passages and the state, and the journal is compacted
+into a new snapshot every `Journal.max_entries` entries. Only the last entry keeps the
+state: it is removed from the previous entry once the new one is counted.
+
+Stored objects are encoded with the active codec (see `use_codec`). The default
+codec encodes the passage elements of the game with a compact schema (buttons refer
+to their passage by id, see `troubadour.passages`) and compresses the result; saves
+encoded with plain jsonpickle by older versions are still decoded. Passages of
+decoded buttons are only resolved when they are clicked, so that loading a game does
+not import them (see `troubadour.lazy`)."""
+
+import base64
+import datetime
+import json
+import sys
+import zlib
+from dataclasses import dataclass, field, replace
+from typing import Any, Callable, Protocol, TypeVar
 
 import jsonpickle as jsp
+from jsonpickle.pickler import Pickler
+from jsonpickle.unpickler import Unpickler, loadclass
 
 import troubadour.backend as be
-from troubadour.definitions import Game, Eid
+import troubadour.game as gm
+import troubadour.instrumentation as ins
+import troubadour.prerender as pr
+from troubadour.continuations import Button, TextButton
+from troubadour.definitions import Backend, Game, Eid, Lid
+from troubadour.passages import can_resolve, passage_ref, resolve_passage
+
+try:
+    import troubadour.trace as tr
+except ImportError:  # not shipped with the page (see `troubadour build --trace`)
+    tr = None  # type: ignore
+
+STATE_KEY = "troubadour_state"
+JOURNAL_KEY = "troubadour_journal"
+
+FORMAT_VERSION = 2
+"Version of the compact save format (1 had no short encoding of buttons)."
+
+COMPRESSED_PREFIX = "tbd1z:"
+"Prefix of compressed payloads."
+
+
+class Codec(Protocol):
+    "Converts objects to strings that can be stored or exported, and back."
+
+    last_size: int
+    "Size (in characters) of the last encoded payload."
+
+    def encode(self, obj: Any) -> str:
+        ...
+
+    def decode(self, payload: str) -> Any:
+        ...
+
+
+@dataclass
+class JsonPickleCodec(Codec):
+    "Plain jsonpickle encoding, as used by older versions of troubadour."
+    last_size: int = 0
+
+    def encode(self, obj: Any) -> str:
+        payload = jsp.encode(obj)
+        assert payload is not None
+        self.last_size = len(payload)
+        return payload
+
+    def decode(self, payload: str) -> Any:
+        return jsp.decode(payload)
+
+
+@dataclass
+class CompactCodec(Codec):
+    """Schema-aware encoding: games, passages and journal entries are encoded as
+    plain JSON lists and dicts without type tags, with passage elements as short
+    tagged lists. Other objects (game states, continuations) go through jsonpickle,
+    with a single pickler per payload so that shared references are kept.
+
+    Args:
+        compress (bool): whether to compress the JSON with zlib (and base64-encode
+            it, since local storage only stores text).
+    """
+
+    compress: bool = False
+    last_size: int = 0
+
+    def encode(self, obj: Any) -> str:
+        pickler = Pickler()
+        flatten: Callable[[Any], Any] = lambda o: pickler.flatten(o, reset=False)
+        data = {"troubadour": FORMAT_VERSION, **_encode_object(obj, flatten)}
+        payload = json.dumps(data, separators=(",", ":"))
+        if self.compress:
+            compressed = base64.b64encode(zlib.compress(payload.encode()))
+            payload = COMPRESSED_PREFIX + compressed.decode("ascii")
+        self.last_size = len(payload)
+        return payload
+
+    def decode(self, payload: str) -> Any:
+        if payload.startswith(COMPRESSED_PREFIX):
+            compressed = base64.b64decode(payload[len(COMPRESSED_PREFIX) :])
+            payload = zlib.decompress(compressed).decode()
+        if not payload.startswith('{"troubadour":'):
+            return _upgrade(jsp.decode(payload))  # saves from older versions
+        unpickler = Unpickler()
+        restore: Callable[[Any], Any] = lambda o: unpickler.restore(o, reset=False)
+        return _decode_object(json.loads(payload), restore)
+
+
+def _upgrade(obj: Any) -> Any:
+    """Fills the fields that objects decoded from plain jsonpickle saves may lack:
+    jsonpickle only calls `__setstate__` for objects encoded with `__getstate__`."""
+    if isinstance(obj, gm.GameImpl):
+        obj.__setstate__(obj.__dict__.copy())
+    return obj
+
+
+def _has_ref(passage: Callable | str) -> bool:
+    "Whether `passage_ref(passage)` refers to `passage`."
+    return isinstance(passage, str) or can_resolve(passage)
+
+
+def _encode_element(out: "gm.PassageElement", flatten: Callable) -> list:
+    match out:
+        case gm.Container(markup, html, css, target, local_id):
+            return ["c", markup, html, css, target, local_id]
+        case gm.RawHTML(html, target):
+            return ["r", html, target]
+        case gm.TimeStamp(date, target):
+            return ["t", date.isoformat(), target]
+        case gm.Image(src, target):
+            return ["i", src, target]
+        case gm.ContinuationElement(continuation, target):
+            # exact types: subclasses may have more fields, and passages or
+            # convertors that cannot be referred to (e.g., lambdas, partials) are left
+            # to jsonpickle
+            if type(continuation) is Button and _has_ref(continuation.passage):
+                return [
+                    "b",
+                    continuation.txt,
+                    passage_ref(continuation.passage),
+                    flatten(continuation.kwargs),
+                    continuation.dialog,
+                    target,
+                ]
+            convertor = getattr(continuation, "convertor", str)
+            if (
+                type(continuation) is TextButton
+                and _has_ref(continuation.passage)
+                and (convertor is str or can_resolve(convertor))
+            ):
+                return [
+                    "tb",
+                    continuation.txt,
+                    passage_ref(continuation.passage),
+                    continuation.value_kw,
+                    flatten(continuation.kwargs),
+                    None if convertor is str else passage_ref(convertor),
+                    target,
+                ]
+            return ["k", flatten(continuation), target]
+    raise TypeError(f"Unknown passage element {out!r}")
+
+
+def _decode_element(data: list, restore: Callable) -> "gm.PassageElement":
+    match data:
+        case ["c", markup, html, css, target, local_id]:
+            return gm.Container(
+                sys.intern(markup), html, css or {}, target, Lid(local_id)
+            )
+        case ["r", html, target]:
+            return gm.RawHTML(html, target)
+        case ["t", date, target]:
+            return gm.TimeStamp(datetime.datetime.fromisoformat(date), target)
+        case ["i", src, target]:
+            return gm.Image(src, target)
+        case ["b", txt, passage, kwargs, dialog, target]:
+            return gm.ContinuationElement(
+                Button(txt, passage, restore(kwargs), dialog), target
+            )
+        case ["tb", txt, passage, value_kw, kwargs, convertor, target]:
+            return gm.ContinuationElement(
+                TextButton(
+                    txt,
+                    passage,
+                    value_kw,
+                    restore(kwargs),
+                    str if convertor is None else resolve_passage(convertor),
+                ),
+                target,
+            )
+        case ["k", continuation, target]:
+            return gm.ContinuationElement(restore(continuation), target)
+    raise ValueError(f"Unknown encoded passage element {data!r}")
+
+
+def _encode_passage(passage: "gm.PassageOutput", flatten: Callable) -> list:
+    return [
+        [_encode_element(out, flatten) for out in passage.contents],
+        passage.html,
+        passage.html_key,
+    ]
+
+
+def _decode_passage(data: list, restore: Callable) -> "gm.PassageOutput":
+    contents, html, html_key = data
+    return gm.PassageOutput(
+        [_decode_element(out, restore) for out in contents], html, html_key
+    )
+
+
+def _encode_object(obj: Any, flatten: Callable) -> dict:
+    if isinstance(obj, gm.GameImpl):
+        fields = obj.__getstate__()
+        return {
+            "type": "game",
+            "cls": f"{type(obj).__module__}.{type(obj).__qualname__}",
+            "output": [_encode_passage(p, flatten) for p in fields.pop("_output")],
+            "fields": {key: flatten(value) for key, value in fields.items()},
+        }
+    if isinstance(obj, JournalEntry):
+        data: dict[str, Any] = {"type": "entry"}
+        if obj.state is not NO_STATE:  # flattened first, as it is restored first
+            data["state"] = flatten(obj.state)
+        data["passages"] = [_encode_passage(p, flatten) for p in obj.passages]
+        data["passage_count"] = obj.passage_count
+        data["previous_html"] = obj.previous_html
+        return data
+    return {"type": "object", "data": flatten(obj)}
+
+
+def _decode_object(data: dict, restore: Callable) -> Any:
+    match data["type"]:
+        case "game":
+            cls = loadclass(data["cls"])
+            game = cls.__new__(cls)
+            output = [_decode_passage(p, restore) for p in data["output"]]
+            fields = {key: restore(value) for key, value in data["fields"].items()}
+            game.__setstate__({**fields, "_output": output})
+            return game
+        case "entry":
+            previous_html = data["previous_html"]
+            return JournalEntry(
+                restore(data["state"]) if "state" in data else NO_STATE,
+                [_decode_passage(p, restore) for p in data["passages"]],
+                data["passage_count"],
+                tuple(previous_html) if previous_html is not None else None,
+            )
+        case _:
+            return restore(data["data"])
+
+
+codec: Codec = CompactCodec(compress=True)
+"Codec used for local storage."
+
+export_codec: Codec = CompactCodec()
+"Codec used for exported files (not compressed, to remain readable JSON)."
+
+
+def use_codec(new_codec: Codec) -> None:
+    "Changes the codec used for local storage."
+    global codec  # pylint: disable=W0603
+    codec = new_codec
 
 
-def save_game(game: Game) -> None:
+S = TypeVar("S")
+
+
+def store(key: str, obj: Any) -> int:
+    """Stores `obj` in local storage under `key` with the active codec.
+
+    Returns:
+        int: size of the stored payload.
+    """
+    be.local_storage.set_raw(key, codec.encode(obj))
+    return codec.last_size
+
+
+def fetch(key: str, cls: type[S]) -> S:
+    "Reads and decodes the object of class `cls` stored under `key`."
+    payload = be.local_storage[key]
+    if payload is None:
+        raise KeyError(key)
+    obj = codec.decode(payload)
+    assert isinstance(obj, cls)
+    return obj
+
+
+def journal_key(index: int) -> str:
+    return f"{JOURNAL_KEY}_{index}"
+
+
+NO_STATE: Any = object()
+"State of the journal entries followed by a newer entry, which holds the state."
+
+
+@dataclass
+class JournalEntry:
+    "Changes to a game since the previous entry of the journal."
+    state: Any
+    "State of the game, `NO_STATE` if a later entry holds it."
+    passages: list[Any] = field(default_factory=list)
+    "New passages (`troubadour.game.PassageOutput` objects)."
+    passage_count: int = 0
+    "Number of passages run since the start of the game, including new passages."
+    previous_html: tuple[str, str] | None = None
+    "Key and cached html of the last passage before the new ones, once finished."
+
+    def __getstate__(self) -> dict[str, Any]:
+        state = self.__dict__.copy()
+        if state["state"] is NO_STATE:  # not stored
+            del state["state"]
+        return state
+
+    def __setstate__(self, state: dict[str, Any]) -> None:
+        self.__dict__.update({"state": NO_STATE, **state})
+
+
+@dataclass
+class Journal:
+    """Keeps track of what is stored in local storage, to only append new passages
+    to the journal."""
+
+    max_entries: int = 20
+    "Number of entries after which the journal is compacted into a snapshot."
+    nb_entries: int = 0
+    passage_count: int | None = None
+    "Number of passages of the stored game, None if it is unknown."
+    _backend: Backend | None = None
+    "Backend whose storage is tracked."
+    _last_entry: JournalEntry | None = None
+    "Last stored entry (without its state), None if it is unknown."
+
+    def _track_backend(self) -> None:
+        if be.get_backend() is not self._backend:  # the storage has changed
+            self._backend = be.get_backend()
+            self.nb_entries = 0
+            self.passage_count = None
+            self._last_entry = None
+
+    def write(self, game: "gm.GameImpl") -> int:
+        """Saves `game`, appending to the journal when possible.
+
+        Returns:
+            int: size of the written payload.
+        """
+        # pylint: disable=protected-access
+        self._track_backend()
+        output = game._output
+        nb_new = game._passage_count - (
+            self.passage_count if self.passage_count is not None else 0
+        )
+        if (
+            self.passage_count is None
+            or self.nb_entries >= self.max_entries
+            or nb_new <= 0
+            or nb_new >= len(output)
+        ):
+            return save_game(game)
+
+        previous = output[-nb_new - 1]
+        entry = JournalEntry(
+            game.state,
+            output[-nb_new:],
+            game._passage_count,
+            (
+                (previous.html_key, previous.html)
+                if previous.html is not None and previous.html_key is not None
+                else None
+            ),
+        )
+        # the entry is written before the count so an interrupted write is ignored,
+        # and the state of the previous entry is only removed once it is counted
+        size = store(journal_key(self.nb_entries), entry)
+        self.nb_entries += 1
+        be.local_storage.set_raw(JOURNAL_KEY, str(self.nb_entries))
+        if self._last_entry is not None:
+            size += store(journal_key(self.nb_entries - 2), self._last_entry)
+        self._last_entry = replace(entry, state=NO_STATE)
+        self.passage_count = game._passage_count
+        return size
+
+    def replay(self, game: "gm.GameImpl") -> None:
+        "Applies the stored journal to `game`, loaded from the stored snapshot."
+        # pylint: disable=protected-access
+        self._track_backend()
+        self.nb_entries = stored_journal_length()
+        self._last_entry = None
+        for index in range(self.nb_entries):
+            entry = fetch(journal_key(index), JournalEntry)
+            # entries older than the snapshot are left over by an interrupted save
+            if entry.passage_count <= game._passage_count:
+                continue
+            if entry.state is not NO_STATE:
+                game.state = entry.state
+            if entry.previous_html is not None and game._output:
+                previous = game._output[-1]
+                previous.html_key, previous.html = entry.previous_html
+            game._output.extend(entry.passages)
+            game._output = game._output[-game.max_output_len :]
+            game._passage_count = entry.passage_count
+            self._last_entry = replace(entry, state=NO_STATE)
+        self.passage_count = game._passage_count
+
+    def restart(self, game: "gm.GameImpl") -> None:
+        "Clears the journal once a snapshot of `game` is stored."
+        self._track_backend()
+        self.clear()
+        self.passage_count = game._passage_count  # pylint: disable=W0212
+
+    def clear(self) -> None:
+        "Removes all the entries of the stored journal."
+        for index in range(stored_journal_length()):
+            be.local_storage.remove(journal_key(index))
+        be.local_storage.remove(JOURNAL_KEY)
+        self.nb_entries = 0
+        self._last_entry = None
+
+
+journal = Journal()
+"Global journal object."
+
+
+def stored_journal_length() -> int:
+    "Number of entries of the journal in local storage."
+    length = be.local_storage[JOURNAL_KEY]
+    return int(length) if length is not None else 0
+
+
+def save_game(game: "gm.GameImpl") -> int:
+    """Saves a snapshot of the whole game and compacts the journal.
+
+    Returns:
+        int: size of the snapshot payload.
+    """
     # store in local memory
-    be.local_storage["troubadour_state"] = game
+    size = store(STATE_KEY, game)
+    journal.restart(game)
+    return size
+
+
+@dataclass
+class SaveScheduler:
+    """Coalesces the saves requested in quick succession into a single save, done
+    after `delay` milliseconds outside of the click handler that requested it.
+    Pending saves are flushed when the page is hidden or unloaded (see `hide`)."""
+
+    delay: int = 1000
+    _game: "gm.GameImpl | None" = None
+    _pending: bool = False
+    _backend: Backend | None = None
+    "Backend in which the page hide callback is registered."
+
+    def schedule(self, game: "gm.GameImpl") -> None:
+        "Requests a save of `game`."
+        if be.get_backend() is not self._backend:  # the page has changed
+            self._backend = be.get_backend()
+            self._pending = False
+            be.on_page_hide(self.hide)
+        self._game = game
+        if not self._pending:
+            self._pending = True
+            be.set_timeout(self.delay, self.flush)
 
-    # prepare export button
-    setup_export_button(game)
+    def flush(self) -> None:
+        "Performs the pending save, if any."
+        if self._pending and self._game is not None:
+            self._pending = False
+            with ins.instrumentation.phase("save") as record:
+                record.elements = sum(
+                    len(passage.contents)
+                    for passage in self._game._output  # pylint: disable=W0212
+                )
+                record.size = journal.write(self._game)
+                pr.clear_snapshot()  # outdated by the save
+            if tr is not None:
+                tr.recorder.persist()
+
+    def hide(self) -> None:
+        """Called when the page is hidden: flushes the pending save and stores a
+        snapshot of the output, to display it on the next visit."""
+        self.flush()
+        if self._game is not None:
+            pr.store_snapshot(self._game)
+
+    def cancel(self) -> None:
+        "Drops the pending save, if any."
+        self._pending = False
+        self._game = None
+
+
+save_scheduler = SaveScheduler()
+"Global save scheduler."
 
 
 def setup_export_button(game: Game) -> None:
-    json_source = jsp.encode(game)
-    assert json_source is not None
-    be.file_download_button(Eid("export"), json_source, "troubadour.json")
+    def export(evt: Any) -> None:
+        # shift-click exports the trace of the game (to report bugs)
+        if (
+            getattr(evt, "shiftKey", False)
+            and tr is not None
+            and tr.recorder.trace is not None
+        ):
+            be.download(tr.recorder.trace.dumps(), "troubadour-trace.json")
+            return
+        # the export file is only built when needed
+        be.download(export_codec.encode(game), "troubadour.json")
+
+    be.onclick(Eid("export"), export)
 
 
-T = TypeVar("T", bound=Game)
+T = TypeVar("T", bound="gm.GameImpl")
 
 
 def setup_import_button(game_type: type[T]) -> None:
-    def load_from_file(extracted_game: T):
+    def load_from_file(content: str):
+        extracted_game = export_codec.decode(content)
+        assert isinstance(extracted_game, game_type)
+        save_scheduler.cancel()  # do not overwrite the import when leaving the page
+        if tr is not None:  # the trace is not the one of the imported game
+            tr.recorder.clear()
+        pr.clear_snapshot()
         save_game(extracted_game)
         be.refresh_page()
 
-    be.on_file_upload(Eid("import"), load_from_file, game_type)
+    be.on_file_upload(Eid("import"), load_from_file)
 
 
 def setup_reset_button() -> None:
@@ -50,12 +550,20 @@ def setup_reset_button() -> None:
 
 
 def load_game(game_type: type[T]) -> T:
-    return be.local_storage(game_type)["troubadour_state"]
+    game = fetch(STATE_KEY, game_type)
+    journal.replay(game)
+    return game
 
 
 def state_exists() -> bool:
-    return be.local_storage.has_key("troubadour_state")
+    return be.local_storage.has_key(STATE_KEY)
 
 
 def erase_save() -> None:
-    be.local_storage.remove("troubadour_state")
+    save_scheduler.cancel()
+    pr.clear_snapshot()
+    be.local_storage.remove(STATE_KEY)
+    journal.clear()
+    if tr is not None:
+        tr.recorder.clear()
+    journal.passage_count = None
@@ -0,0 +1,245 @@
+"""Record and replay of the passages run by a game.
+
+Every passage run is logged in a trace with its inputs: the passage (its id if it is
+registered, its module and qualified name otherwise), its keyword arguments
+(flattened with jsonpickle, they include the texts typed by the player), the time of
+its timestamp and the seed of the `random` module while it runs. Replaying a trace
+from the start of a game on the headless backend rebuilds the same state and output,
+which turns a bug report into a test case or a benchmark, and can rebuild a save that
+was lost or corrupted.
+
+The trace of the current game is stored in local storage in chunks, appended by the
+save scheduler: the number of chunks is stored under "troubadour_trace" and chunk i
+under "troubadour_trace_i". The chunks are folded into one every `MAX_CHUNKS` saves,
+and games stop being recorded when their trace gets longer than `MAX_ENTRIES` or no
+longer fits in local storage. Shift-clicking the export button downloads the trace."""
+
+import datetime
+import json
+import random
+from dataclasses import dataclass, field
+from typing import Any, Callable
+
+from jsonpickle.pickler import Pickler
+from jsonpickle.unpickler import Unpickler
+
+import troubadour.backend as be
+import troubadour.game as gm
+from troubadour.definitions import Game
+from troubadour.passages import passage_ref, resolve_passage
+
+TRACE_KEY = "troubadour_trace"
+TRACE_FORMAT = 1
+
+MAX_CHUNKS = 16
+"Number of chunks of the stored trace past which they are folded into one."
+
+MAX_ENTRIES = 20_000
+"Number of entries past which a trace is no longer recorded."
+
+REWIND = ":rewind"
+"Passage name of the entries that record a rewind (with the number of steps)."
+
+
+@dataclass(slots=True)
+class TraceEntry:
+    "Inputs of a passage run."
+    passage: str
+    "Reference to the passage (see `troubadour.passages.passage_ref`)."
+    kwargs: Any
+    "Keyword arguments of the passage, flattened with jsonpickle."
+    time: datetime.datetime
+    seed: int
+
+    def encode(self) -> list:
+        return [self.passage, self.kwargs, self.time.isoformat(), self.seed]
+
+    @staticmethod
+    def decode(data: list) -> "TraceEntry":
+        passage, kwargs, time, seed = data
+        return TraceEntry(passage, kwargs, datetime.datetime.fromisoformat(time), seed)
+
+
+@dataclass
+class Trace:
+    "Passages run since the start of a game."
+    state_cls: str
+    "Class of the state of the game (module.qualname)."
+    entries: list[TraceEntry] = field(default_factory=list)
+
+    def passage_count(self) -> int:
+        "Number of passages of the game at the end of the trace."
+        count = 0
+        for entry in self.entries:
+            count += -entry.kwargs["steps"] if entry.passage == REWIND else 1
+        return count
+
+    def dumps(self) -> str:
+        return json.dumps(
+            {
+                "troubadour_trace": TRACE_FORMAT,
+                "state": self.state_cls,
+                "entries": [entry.encode() for entry in self.entries],
+            },
+            separators=(",", ":"),
+        )
+
+    @staticmethod
+    def loads(payload: str) -> "Trace":
+        data = json.loads(payload)
+        if data.get("troubadour_trace") != TRACE_FORMAT:
+            raise ValueError("Not a troubadour trace (or an unsupported version)")
+        return Trace(data["state"], [TraceEntry.decode(e) for e in data["entries"]])
+
+
+def trace_key(index: int) -> str:
+    return f"{TRACE_KEY}_{index}"
+
+
+def class_name(cls: type) -> str:
+    return f"{cls.__module__}.{cls.__qualname__}"
+
+
+@dataclass
+class TraceRecorder:
+    """Logs the passages run by the game into `trace`, and replays the inputs of a
+    trace entry instead when one is given to `play`."""
+
+    trace: Trace | None = None
+    "Trace of the current game, None when it is not recorded."
+    nb_chunks: int = 0
+    "Number of chunks of the trace in local storage."
+    nb_stored: int = 0
+    "Number of entries of the trace in local storage."
+    _next: TraceEntry | None = None
+    "Entry to replay on the next passage run."
+    _seeds: random.Random = field(default_factory=random.Random)
+
+    def begin(self, passage: Callable, kwargs: dict[str, object]) -> TraceEntry:
+        """Called before each passage run: records it and seeds the `random` module.
+
+        Returns:
+            TraceEntry: the inputs of the run.
+        """
+        if self._next is not None:
+            entry, self._next = self._next, None
+        else:
+            entry = TraceEntry(
+                passage_ref(passage),
+                Pickler().flatten(kwargs) if kwargs else {},
+                datetime.datetime.now(),
+                self._seeds.getrandbits(32),
+            )
+        if self.trace is not None:
+            self.trace.entries.append(entry)
+        random.seed(entry.seed)
+        return entry
+
+    def record(self, entry: TraceEntry) -> None:
+        "Logs a passage run somewhere else (e.g., the start passage run at build time)."
+        if self.trace is not None:
+            self.trace.entries.append(entry)
+
+    def rewound(self, steps: int) -> None:
+        "Called when the game is rewound by `steps` passages."
+        if self.trace is not None:
+            self.trace.entries.append(
+                TraceEntry(REWIND, {"steps": steps}, datetime.datetime.now(), 0)
+            )
+
+    def play(self, entry: TraceEntry) -> None:
+        "Makes the next passage run use the inputs of `entry`."
+        self._next = entry
+
+    def start(self, state_cls: type) -> None:
+        "Starts recording a new game (and drops the stored trace)."
+        self.clear()
+        self.trace = Trace(class_name(state_cls))
+
+    def resume(self, game: "gm.GameImpl") -> None:
+        """Continues the stored trace of a game loaded from storage. The game is not
+        recorded if the stored trace does not go back to its start."""
+        self.trace, self.nb_chunks, self.nb_stored = None, 0, 0
+        trace = Trace(class_name(type(game.state)))
+        length = be.local_storage[TRACE_KEY]
+        self.nb_chunks = int(length) if length is not None else 0
+        for index in range(self.nb_chunks):
+            chunk = be.local_storage[trace_key(index)]
+            if chunk is None:  # interrupted write
+                self.nb_chunks = index
+                break
+            trace.entries += [TraceEntry.decode(entry) for entry in json.loads(chunk)]
+        self.nb_stored = len(trace.entries)
+        if trace.passage_count() == game._passage_count:  # pylint: disable=W0212
+            self.trace = trace
+
+    def persist(self) -> None:
+        """Appends the entries recorded since the last call to local storage, or
+        rewrites the whole trace in a single chunk when there are `MAX_CHUNKS` of them.
+        Stops recording (and drops the stored trace) when the trace is longer than
+        `MAX_ENTRIES` or local storage is full."""
+        if self.trace is None or self.nb_stored == len(self.trace.entries):
+            return
+        if len(self.trace.entries) > MAX_ENTRIES:
+            self.clear()
+            return
+        folded = self.nb_chunks >= MAX_CHUNKS
+        index, start = (0, 0) if folded else (self.nb_chunks, self.nb_stored)
+        try:
+            be.local_storage.set_raw(
+                trace_key(index),
+                json.dumps(
+                    [entry.encode() for entry in self.trace.entries[start:]],
+                    separators=(",", ":"),
+                ),
+            )
+            be.local_storage.set_raw(TRACE_KEY, str(index + 1))
+        except Exception:  # pylint: disable=W0718
+            # quota exceeded: the save matters more than the trace
+            be.local_storage.remove(trace_key(index))
+            self.clear()
+            return
+        if folded:
+            for old in range(1, self.nb_chunks):
+                be.local_storage.remove(trace_key(old))
+        self.nb_chunks = index + 1
+        self.nb_stored = len(self.trace.entries)
+
+    def clear(self) -> None:
+        "Stops recording and removes the stored trace."
+        length = be.local_storage[TRACE_KEY]
+        for index in range(int(length) if length is not None else 0):
+            be.local_storage.remove(trace_key(index))
+        be.local_storage.remove(TRACE_KEY)
+        self.trace, self.nb_chunks, self.nb_stored = None, 0, 0
+
+
+recorder = TraceRecorder()
+"Global trace recorder."
+
+
+def replay(
+    trace: Trace,
+    game: Game,
+    entries: int | None = None,
+    aliases: dict[str, str] | None = None,
+) -> None:
+    """Runs the passages of `trace` (the first `entries` ones if not None) in `game`,
+    with the recorded inputs. `game` must be a new game, in the state class of the
+    trace. See `troubadour.passages.resolve_passage` for `aliases`."""
+    state_cls = trace.state_cls
+    for module, alias in (aliases or {}).items():
+        if state_cls.startswith(f"{module}."):
+            state_cls = alias + state_cls[len(module) :]
+    if class_name(type(game.state)) != state_cls:
+        raise ValueError(
+            f"The trace is for state class {state_cls},"
+            f" not {class_name(type(game.state))}"
+        )
+    for entry in trace.entries[:entries]:
+        if entry.passage == REWIND:
+            game.rewind(entry.kwargs["steps"])
+            continue
+        kwargs = Unpickler().restore(entry.kwargs) if entry.kwargs else {}
+        recorder.play(entry)
+        game.run_passage(resolve_passage(entry.passage, aliases), kwargs=kwargs)